@@ -0,0 +1,56 @@
+import sys
+import os
+import time
+import random
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_chat
+
+
+def _sample_messages(n, threads=200, seed=0):
+    """Generate lists of 'n' Message objects in total for 'threads' Threads, out of order.
+
+       Many messages share a timestamp, as they do in exports, which only record minutes."""
+    random.seed(seed)
+    people = ["Person {}".format(i) for i in range(threads)]
+    sizes = [random.paretovariate(1.2) for _ in range(threads)]
+    scale = n / sum(sizes)
+    message_lists = []
+    for i, size in enumerate(sizes):
+        count = max(1, int(size * scale))
+        d = datetime.datetime(2012, 1, 1)
+        messages = []
+        for num in range(1, count + 1):
+            d += datetime.timedelta(minutes=random.choice([0, 0, 1, 2, 30, 600]))
+            messages.append(fb_chat.Message(people[i], random.choice([people[i], "My Name"]), d, u"message", num))
+        random.shuffle(messages)
+        message_lists.append(([people[i]], messages))
+    return message_lists
+
+
+def _best_time(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    """Time creating Thread and Chat objects from unsorted messages, and sorting with and without keys."""
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 500000
+    message_lists = _sample_messages(n)
+    all_messages = [m for _, messages in message_lists for m in messages]
+    print "{} messages in {} threads".format(len(all_messages), len(message_lists))
+    threads = []
+    timings = [("Thread(...) for every thread", lambda: threads.__setitem__(slice(None), [fb_chat.Thread(people, messages)
+                                                                                          for people, messages in message_lists])),
+               ("Chat(...)", lambda: fb_chat.Chat("My Name", threads)),
+               ("Chat(...).all_messages()", lambda: fb_chat.Chat("My Name", threads).all_messages()),
+               ("sorted() by Message.__lt__", lambda: sorted(all_messages)),
+               ("sorted() by Message.sort_key", lambda: sorted(all_messages, key=fb_chat._sort_key))]
+    for label, func in timings:
+        print "{:<32} {:>8.3f} s".format(label, _best_time(func))
@@ -0,0 +1,64 @@
+import sys
+import os
+import time
+import random
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_chat
+
+
+def _sample_chat(n, threads=200, seed=0):
+    """Generate a Chat object of about 'n' messages in 'threads' Threads, over about five years."""
+    random.seed(seed)
+    people = ["Person {}".format(i) for i in range(threads)]
+    sizes = [random.paretovariate(1.2) for _ in range(threads)]
+    scale = n / sum(sizes)
+    thread_list = []
+    for i, size in enumerate(sizes):
+        count = max(1, int(size * scale))
+        d = datetime.datetime(2012, 1, 1) + datetime.timedelta(days=random.randint(0, 900))
+        step = 1000000 / count
+        messages = []
+        for num in range(1, count + 1):
+            d += datetime.timedelta(minutes=random.randint(0, 2 * step))
+            messages.append(fb_chat.Message(people[i], random.choice([people[i], "My Name"]), d, u"message", num))
+        thread_list.append(fb_chat.Thread([people[i]], messages))
+    return fb_chat.Chat("My Name", thread_list)
+
+
+def _copied_on(chat, date):
+    """Chat.on() as it was before views: a new Chat of new Threads, filtering and sorting every message."""
+    threads_on = [t for t in (fb_chat.Thread(thread.people, [m for m in thread.messages if m.sent_before(date)])
+                              for thread in chat.threads) if len(t) > 0]
+    return fb_chat.Chat(chat._myname, threads_on, chat.symbols)
+
+
+def _time_travel(chat, dates, on):
+    """Step through 'dates', counting the messages sent by each person in every Thread on each date."""
+    start = time.time()
+    for date in dates:
+        chat_on = on(chat, date)
+        for thread in chat_on.threads:
+            len(thread.by(chat_on._myname))
+        len(chat_on.sent_between(date - datetime.timedelta(days=30), date))
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    """Compare stepping through 100 dates using Chat.on() with copying every Thread on every date."""
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 200000
+    chat = _sample_chat(n)
+    first, last = chat.all_messages()[0].date_time, chat.all_messages()[-1].date_time
+    dates = [first + (last - first) * i / 100 for i in range(1, 101)]
+    print "{} messages in {} threads, 100 dates".format(chat._total_messages, len(chat))
+    start = time.time()
+    for message in chat.all_messages():
+        message.sent_before(last)
+    print "{:<36} {:>8.3f} s".format("One pass over every message", time.time() - start)
+    print "{:<36} {:>8.3f} s".format("Copying Chat.on() (old)", _time_travel(chat, dates, _copied_on))
+    start = time.time()
+    for date in dates:
+        chat.on(date)
+    print "{:<36} {:>8.3f} s".format("Chat.on() views, only made", time.time() - start)
+    print "{:<36} {:>8.3f} s".format("Chat.on() views", _time_travel(chat, dates, fb_chat.Chat.on))
@@ -0,0 +1,74 @@
+import sys
+import os
+import gc
+import subprocess
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_chat
+
+
+class _DictMessage(object):
+    """A Message object as it was before using __slots__, storing its attributes in a __dict__."""
+
+    def __init__(self, thread, author, date_time, text, num):
+        self.thread_name = thread
+        self.author = author
+        self.date_time = date_time
+        self.text = text
+        self._num = num
+
+
+def _sample_messages(message_class, n):
+    """Create 'n' messages, sharing names as the parser does, with distinct timestamps and texts."""
+    d = datetime.datetime(2012, 1, 1)
+    return [message_class("Alice Smith", "Alice Smith" if i % 2 else "My Name", d + datetime.timedelta(minutes=i),
+                          u"message {}".format(i), i) for i in xrange(n)]
+
+
+def _object_bytes(message):
+    """Return the memory used by 'message' itself, its timestamp, number and sort key, but not shared names or the text.
+
+       The sort key refers to the same timestamp and number objects, so only the tuple itself is added."""
+    size = sys.getsizeof(message) + sys.getsizeof(message.date_time) + sys.getsizeof(message._num)
+    if hasattr(message, "__dict__"):
+        size += sys.getsizeof(message.__dict__)
+    if hasattr(message, "sort_key"):
+        size += sys.getsizeof(message.sort_key)
+    return size
+
+
+def _resident_bytes():
+    """Return the resident memory of this process, or None if /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError):
+        return None
+
+
+_CLASSES = [("__dict__ (old Message)", _DictMessage), ("__slots__ (fb_chat.Message)", fb_chat.Message)]
+
+
+def _measure(label, message_class, n):
+    gc.collect()
+    before = _resident_bytes()
+    messages = _sample_messages(message_class, n)
+    after = _resident_bytes()
+    line = "{:<28} {:>6} bytes/message (object, timestamp, number, sort key)".format(label, _object_bytes(messages[0]))
+    if before is not None:
+        line += ", {:>6.0f} bytes/message resident".format((after - before) / float(n))
+    return line
+
+
+if __name__ == "__main__":
+    """Compare the memory used per message with and without __slots__.
+
+       Each is measured in a new process, so that memory freed by one cannot be reused by the other."""
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 1000000
+    if len(sys.argv) >= 3:
+        label, message_class = _CLASSES[int(sys.argv[2])]
+        print _measure(label, message_class, n)
+    else:
+        for i in range(len(_CLASSES)):
+            print subprocess.check_output([sys.executable, os.path.abspath(__file__), str(n), str(i)]).strip()
@@ -0,0 +1,45 @@
+import sys
+import os
+import time
+import random
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_chat
+
+
+def _sample_chat(threads=20000, people=2000, seed=0):
+    """Generate a Chat object of 'threads' Threads between 'people' people, each with one message."""
+    random.seed(seed)
+    names = ["Person {}".format(i) for i in range(people)]
+    thread_list = []
+    for _ in range(threads):
+        thread_people = random.sample(names, random.choice([1, 1, 1, 2, 3, 8]))
+        thread_list.append(fb_chat.Thread(thread_people, []))
+    return fb_chat.Chat("My Name", thread_list), names
+
+
+def _scanned(chat, names):
+    """Find the Threads containing everyone in 'names' by splitting every Thread name, as reports used to."""
+    return [t for t in chat.threads if all(name in t.people_str.split(", ") for name in names)]
+
+
+if __name__ == "__main__":
+    """Compare finding the Threads each person is in, and the Threads shared by pairs of people, with scanning every Thread."""
+    chat, names = _sample_chat()
+    pairs = list(itertools.islice(itertools.combinations(names[:50], 2), 500))
+    print "{} threads, {} people".format(len(chat), len(names))
+    start = time.time()
+    chat.threads_with([names[0]])
+    print "{:<44} {:>8.3f} s".format("Making the index of people", time.time() - start)
+    for label, func in [("Scanning, every person", lambda: [_scanned(chat, [name]) for name in names[:200]]),
+                        ("threads_with(), every person", lambda: [chat.threads_with([name]) for name in names]),
+                        ("Scanning, 500 pairs of people", lambda: [_scanned(chat, pair) for pair in pairs]),
+                        ("threads_with(), 500 pairs of people", lambda: [chat.threads_with(pair) for pair in pairs]),
+                        ("find_people(), 1000 prefixes", lambda: [chat.find_people("person 1" + str(i)) for i in range(1000)])]:
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if label == "Scanning, every person":
+            elapsed *= len(names) / 200.0  # Scanning for everyone takes too long, so estimate it
+        print "{:<44} {:>8.3f} s".format(label, elapsed)
@@ -0,0 +1,65 @@
+import sys
+import os
+import time
+import random
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import matplotlib
+matplotlib.use("Agg")
+import fb_analysis
+import fb_chat
+import fb_snapshot
+
+
+def _sample_chat(n, threads=200, seed=0):
+    """Generate a Chat object of 'n' messages of a few words each."""
+    random.seed(seed)
+    people = ["Person {}".format(i) for i in range(threads)]
+    message_lists = [[] for _ in range(threads)]
+    d = datetime.datetime(2012, 1, 1)
+    for _ in xrange(n):
+        i = int(random.paretovariate(1.1)) % threads
+        d += datetime.timedelta(minutes=random.randint(0, 5))
+        text = u" ".join(u"word{}".format(random.randint(0, 999)) for _ in range(random.randint(1, 20)))
+        message_lists[i].append(fb_chat.Message(people[i], random.choice([people[i], "My Name"]), d, text,
+                                                len(message_lists[i]) + 1))
+    return fb_chat.Chat("My Name", [fb_chat.Thread([people[i]], messages) for i, messages in enumerate(message_lists)])
+
+
+def _dashboard(chat):
+    """Work out what a dashboard of a Chat shows: every top_n_people() count, and the words and dates of the 20th person."""
+    for count_type in fb_analysis._COUNT_TYPES:
+        fb_analysis.top_n_people(chat, 10, count_type)
+    name = fb_analysis.top_n_people(chat, 20)[-1][0]
+    fb_analysis.top_word_use(chat, name)
+    fb_analysis._time_graph_data(chat, name)
+    fb_analysis._date_graph_data(chat, chat._myname)
+
+
+def _timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    """Compare working out a dashboard of results for the first time with doing so again, and after loading saved results."""
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 100000
+    filename = os.path.join(tempfile.mkdtemp(), "messages.snapshot")
+    fb_snapshot.write_snapshot(_sample_chat(n), filename)
+    chat = fb_snapshot.read_snapshot(filename)
+    print "{} messages, every count type, word use and graph data".format(n)
+    print "{:<40} {:>8.3f} s".format("First time", _timed(lambda: _dashboard(chat)))
+    print "{:<40} {:>8.4f} s".format("Again, unchanged", _timed(lambda: _dashboard(chat)))
+    print "{:<40} {:>8.4f} s".format("save_results()", _timed(lambda: fb_analysis.save_results(chat, filename)))
+    fb_analysis.clear_results_cache()
+    chat = fb_snapshot.read_snapshot(filename)
+    print "{:<40} {:>8.4f} s".format("load_results(), from a new snapshot", _timed(lambda: fb_analysis.load_results(chat, filename)))
+    print "{:<40} {:>8.4f} s".format("After loading", _timed(lambda: _dashboard(chat)))
+    thread = chat.threads[-1]
+    thread._add_messages([fb_chat.Message(thread.people_str, "My Name", datetime.datetime(2030, 1, 1), u"new", len(thread) + 1)])
+    chat._recount_messages()
+    print "{:<40} {:>8.3f} s".format("After adding a message", _timed(lambda: _dashboard(chat)))
+    print fb_analysis.results_cache_info()
@@ -0,0 +1,57 @@
+import sys
+import os
+import time
+import random
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_chat
+import fb_search
+
+
+def _sample_chat(n, threads=100, vocabulary=20000, seed=0):
+    """Generate a Chat object of 'n' messages of random words, some common and most rare."""
+    random.seed(seed)
+    letters = u"abcdefghijklmnopqrstuvwxyz\u00e9"
+    words = [u"".join(random.choice(letters) for _ in range(random.randint(2, 10))) for _ in range(vocabulary)]
+    people = ["Person {}".format(i) for i in range(threads)]
+    d = datetime.datetime(2012, 1, 1)
+    message_lists = [[] for _ in range(threads)]
+    for num in xrange(n):
+        i = random.randrange(threads)
+        d += datetime.timedelta(minutes=random.randint(0, 5))
+        text = u" ".join(words[int(random.paretovariate(0.8)) % vocabulary] for _ in range(random.randint(1, 15)))
+        message_lists[i].append(fb_chat.Message(people[i], random.choice([people[i], "My Name"]), d,
+                                                text.capitalize() + u".", len(message_lists[i]) + 1))
+    return fb_chat.Chat("My Name", [fb_chat.Thread([people[i]], messages) for i, messages in enumerate(message_lists)]), words
+
+
+def _best_time(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    """Compare searching every message with searching using the index of words, and time making the index."""
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 200000
+    chat, words = _sample_chat(n)
+    messages = chat.all_messages()
+    index = chat._get_search_index()
+    print "{} messages, {} different words".format(n, len(index))
+    filename = os.path.join(tempfile.mkdtemp(), "messages.search")
+    print "{:<36} {:>8.3f} s".format("build_index()", _best_time(lambda: fb_search.build_index(messages), 1))
+    print "{:<36} {:>8.3f} s".format("write_index()", _best_time(lambda: fb_search.write_index(index, filename), 1))
+    print "{:<36} {:>8.3f} s".format("read_index()", _best_time(lambda: fb_search.read_index(filename)))
+    queries = [words[5], words[500], words[5000][1:], words[50] + u" " + words[7], words[1].upper()]
+    for query in queries:
+        for ignore_case in (False, True):
+            label = u"search({!r}, {})".format(query, ignore_case)
+            scan = _best_time(lambda: [m for m in messages if m.contains(query, ignore_case)])
+            indexed = _best_time(lambda: chat.search(query, ignore_case))
+            print u"{:<36} {:>8.3f} s scanning, {:>8.4f} s indexed".format(label, scan, indexed).encode("utf8")
@@ -0,0 +1,64 @@
+import sys
+import os
+import time
+import random
+import datetime
+import tempfile
+import cPickle as pickle
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_chat
+import fb_snapshot
+
+
+def _sample_chat(n, threads=200, seed=0):
+    """Generate a Chat of 'n' messages spread unevenly across 'threads' Threads."""
+    random.seed(seed)
+    people = ["Person {}".format(i) for i in range(threads)]
+    sizes = [random.paretovariate(1.2) for _ in range(threads)]
+    scale = n / sum(sizes)
+    thread_list = []
+    for i, size in enumerate(sizes):
+        count = max(1, int(size * scale))
+        d = datetime.datetime(2012, 1, 1)
+        messages = []
+        for num in range(1, count + 1):
+            d += datetime.timedelta(minutes=random.choice([0, 1, 2, 30, 600]))
+            author = random.choice([people[i], "My Name"])
+            messages.append(fb_chat.Message(people[i], author, d, u"message number {} \u263a".format(num), num))
+        thread_list.append(fb_chat.Thread([people[i]], messages))
+    return fb_chat.Chat("My Name", thread_list)
+
+
+def _timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def _load_pickle(filename):
+    with open(filename, "r") as f:
+        return pickle.load(f)
+
+
+if __name__ == "__main__":
+    """Compare the time to load a Chat object from a pickle file and from a snapshot file."""
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 200000
+    chat = _sample_chat(n)
+    directory = tempfile.mkdtemp()
+    pickle_file = os.path.join(directory, "messages.pickle")
+    snapshot_file = os.path.join(directory, "messages.snapshot")
+    with open(pickle_file, "w") as f:
+        pickle.dump(chat, f)
+    fb_snapshot.write_snapshot(chat, snapshot_file)
+    print "{} messages: pickle {:.1f} MB, snapshot {:.1f} MB".format(chat._total_messages, os.path.getsize(pickle_file) / 2.0**20,
+                                                                     os.path.getsize(snapshot_file) / 2.0**20)
+    seconds, _ = _timed(_load_pickle, pickle_file)
+    print "{:<30} {:>8.3f} s".format("load pickle", seconds)
+    seconds, snapshot_chat = _timed(fb_snapshot.read_snapshot, snapshot_file)
+    print "{:<30} {:>8.3f} s".format("open snapshot", seconds)
+    seconds, _ = _timed(lambda: [thread.messages for thread in snapshot_chat.threads])
+    print "{:<30} {:>8.3f} s".format("then read every message", seconds)
+    os.remove(pickle_file)
+    os.remove(snapshot_file)
+    os.rmdir(directory)
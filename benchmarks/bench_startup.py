@@ -0,0 +1,65 @@
+import sys
+import os
+import time
+import random
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_chat
+import fb_snapshot
+
+
+def _sample_threads(n, threads=5000, seed=0):
+    """Generate a list of Threads of 'n' messages in total, of very different lengths, some with groups of people."""
+    random.seed(seed)
+    sizes = [random.paretovariate(1.1) for _ in range(threads)]
+    scale = n / sum(sizes)
+    thread_list = []
+    for i, size in enumerate(sizes):
+        people = ["Person {}".format(j) for j in random.sample(xrange(2 * threads), random.choice([1, 1, 1, 2, 5]))]
+        name = ", ".join(people)
+        d = datetime.datetime(2012, 1, 1) + datetime.timedelta(days=random.randint(0, 900))
+        messages = []
+        for num in range(1, max(1, int(size * scale)) + 1):
+            d += datetime.timedelta(minutes=random.randint(0, 600))
+            messages.append(fb_chat.Message(name, random.choice(people + ["My Name"]), d, u"message", num))
+        thread_list.append(fb_chat.Thread(people, messages))
+    return thread_list
+
+
+def _eager_chat(threads):
+    """Build a Chat as Chat.__init__ used to: sorting every message to count them, and making everything at once."""
+    threads = sorted(threads, key=len, reverse=True)
+    thread_dict = {", ".join(thread.people): thread for thread in threads}
+    total_messages = len(sorted([message for thread in threads for message in thread.messages]))
+    all_people = {"My Name"}
+    for thread in threads:
+        all_people.update(thread.people)
+    return thread_dict, total_messages, all_people
+
+
+def _best_time(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    """Time creating a Chat object for a large archive, when created directly and when opened from a snapshot."""
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 1000000
+    threads = _sample_threads(n)
+    print "{} messages in {} threads".format(sum(len(thread) for thread in threads), len(threads))
+    filename = os.path.join(tempfile.mkdtemp(), "messages.snapshot")
+    fb_snapshot.write_snapshot(fb_chat.Chat("My Name", threads), filename)
+    print "{:<44} {:>8.3f} s".format("Chat(...), sorting to count (old)", _best_time(lambda: _eager_chat(threads), 1))
+    print "{:<44} {:>8.4f} s".format("Chat(...)", _best_time(lambda: fb_chat.Chat("My Name", threads)))
+    print "{:<44} {:>8.4f} s".format("read_snapshot()", _best_time(lambda: fb_snapshot.read_snapshot(filename)))
+    print "{:<44} {:>8.4f} s".format("read_snapshot(), then chat['Person 1']", _best_time(
+        lambda: fb_snapshot.read_snapshot(filename)._thread_dict.get("Person 1")))
+    print "{:<44} {:>8.3f} s".format("Chat(...).all_messages(), when first needed", _best_time(
+        lambda: fb_chat.Chat("My Name", threads).all_messages(), 1))
@@ -0,0 +1,65 @@
+import sys
+import os
+import re
+import time
+import random
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_analysis
+import fb_chat
+import fb_snapshot
+
+_COUNT_TYPES = ["words", "wordsfrom", "wordsto", "chars", "charsfrom", "charsto"]
+
+
+def _sample_chat(n, threads=200, seed=0):
+    """Generate a Chat object of 'n' messages of a few words each."""
+    random.seed(seed)
+    people = ["Person {}".format(i) for i in range(threads)]
+    message_lists = [[] for _ in range(threads)]
+    d = datetime.datetime(2012, 1, 1)
+    for _ in xrange(n):
+        i = random.randrange(threads)
+        d += datetime.timedelta(minutes=random.randint(0, 5))
+        text = u" ".join(u"word{}".format(random.randint(0, 999)) for _ in range(random.randint(1, 20)))
+        message_lists[i].append(fb_chat.Message(people[i], random.choice([people[i], "My Name"]), d, text,
+                                                len(message_lists[i]) + 1))
+    return fb_chat.Chat("My Name", [fb_chat.Thread([people[i]], messages) for i, messages in enumerate(message_lists)])
+
+
+def _counted(chat, count_type):
+    """Count characters or words by checking every message, as top_n_people() used to."""
+    counts = {}
+    for t in chat.threads:
+        num = 0
+        for m in t.messages:
+            if count_type.endswith("from") and m.sent_by(chat._myname):
+                continue
+            if count_type.endswith("to") and not m.sent_by(chat._myname):
+                continue
+            num += len(re.findall(r'\S+', m.text)) if count_type.startswith("words") else len(m)
+        counts[t.people_str] = num
+    return counts
+
+
+def _time_all(func):
+    start = time.time()
+    for count_type in _COUNT_TYPES:
+        func(count_type)
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    """Compare top_n_people() for all six character and word counts with counting every message each time."""
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 200000
+    chat = _sample_chat(n)
+    print "{} messages, all six character and word count types".format(n)
+    print "{:<40} {:>8.3f} s".format("Counting every message (old)", _time_all(lambda ct: _counted(chat, ct)))
+    print "{:<40} {:>8.3f} s".format("top_n_people(), first use", _time_all(lambda ct: fb_analysis.top_n_people(chat, count_type=ct)))
+    print "{:<40} {:>8.3f} s".format("top_n_people(), counts made", _time_all(lambda ct: fb_analysis.top_n_people(chat, count_type=ct)))
+    filename = os.path.join(tempfile.mkdtemp(), "messages.snapshot")
+    fb_snapshot.write_snapshot(chat, filename)
+    snapshot_chat = fb_snapshot.read_snapshot(filename)
+    print "{:<40} {:>8.3f} s".format("top_n_people(), from a snapshot", _time_all(lambda ct: fb_analysis.top_n_people(snapshot_chat, count_type=ct)))
@@ -0,0 +1,69 @@
+import sys
+import os
+import timeit
+import random
+import datetime
+import dateutil.parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_parser
+
+
+_DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+_MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August",
+           "September", "October", "November", "December"]
+
+
+def _sample_timestamps(n, seed=0):
+    """Generate 'n' timestamps in the formats used by exports, as consecutive messages would have."""
+    random.seed(seed)
+    d = datetime.datetime(2012, 1, 1)
+    timestamps = []
+    for i in range(n):
+        d += datetime.timedelta(minutes=random.choice([0, 0, 1, 2, 30, 600]))
+        if i % 2 == 0:
+            timestamps.append("%s, %d %s %d at %02d:%02d UTC+01" % (_DAYS[d.weekday()], d.day, _MONTHS[d.month - 1],
+                                                                  d.year, d.hour, d.minute))
+        else:
+            timestamps.append("%s, %s %d, %d at %d:%02d%s PDT" % (_DAYS[d.weekday()], _MONTHS[d.month - 1], d.day, d.year,
+                                                                d.hour % 12 or 12, d.minute, "am" if d.hour < 12 else "pm"))
+    return timestamps
+
+
+def _dateutil_parse(timestamps):
+    for t in timestamps:
+        dateutil.parser.parse(t).replace(tzinfo=None)
+
+
+def _fast_parse(timestamps):
+    fb_parser._TIMESTAMP_MEMO.clear()
+    for t in timestamps:
+        fb_parser._parse_timestamp(t)
+
+
+def _fast_parse_warm(timestamps):
+    for t in timestamps:
+        fb_parser._parse_timestamp(t)
+
+
+def _fast_parse_no_memo(timestamps):
+    for t in timestamps:
+        fb_parser._match_timestamp(t)
+
+
+if __name__ == "__main__":
+    """Compare the per-timestamp cost of dateutil with the parser's own timestamp parsing."""
+    import warnings
+    warnings.simplefilter("ignore")  # dateutil warns about unrecognised timezone names
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 20000
+    timestamps = _sample_timestamps(n)
+    for label, func in [("dateutil.parser.parse", _dateutil_parse),
+                        ("_match_timestamp (no memo)", _fast_parse_no_memo),
+                        ("_parse_timestamp (memo)", _fast_parse)]:
+        best = min(timeit.repeat(lambda: func(timestamps), number=1, repeat=3))
+        print "{:<30} {:>8.2f} us/timestamp".format(label, 1e6 * best / n)
+    # Time repeated strings, which are all memo hits:
+    repeated = timestamps[:fb_parser._TIMESTAMP_MEMO.maxsize // 2]
+    _fast_parse(repeated)
+    best = min(timeit.repeat(lambda: _fast_parse_warm(repeated), number=1, repeat=3))
+    print "{:<30} {:>8.2f} us/timestamp".format("_parse_timestamp (memo hits)", 1e6 * best / len(repeated))
@@ -0,0 +1,66 @@
+import sys
+import os
+import time
+import random
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_analysis
+import fb_chat
+
+
+def _sample_chat(n, threads=2000, people=3000, seed=0):
+    """Generate a Chat object of 'n' messages in 'threads' Threads, some of them group chats."""
+    random.seed(seed)
+    names = ["Person {}".format(i) for i in range(people)]
+    thread_people = [random.sample(names, random.choice([1, 1, 1, 2, 6])) for _ in range(threads)]
+    message_lists = [[] for _ in range(threads)]
+    d = datetime.datetime(2012, 1, 1)
+    for _ in xrange(n):
+        i = int(random.paretovariate(1.1)) % threads
+        d += datetime.timedelta(minutes=random.randint(0, 5))
+        text = u" ".join(u"word" for _ in range(random.randint(1, 10)))
+        message_lists[i].append(fb_chat.Message(", ".join(thread_people[i]), random.choice(thread_people[i] + ["My Name"]),
+                                                d, text, len(message_lists[i]) + 1))
+    return fb_chat.Chat("My Name", [fb_chat.Thread(p, messages) for p, messages in zip(thread_people, message_lists)])
+
+
+def _counted(chat, count_type):
+    """Count one count_type for each Thread or person, as top_n_people() used to, with a pass each."""
+    counts = {}
+    if count_type == "allfrom":
+        for p in chat._all_people - {chat._myname}:
+            counts[p] = len(chat.all_from(p))
+    for t in chat.threads:
+        if count_type == "total":
+            counts[t.people_str] = len(t)
+        elif count_type in ("to", "from"):
+            counts[t.people_str] = len(t.by(chat._myname)) if count_type == "to" else len(t) - len(t.by(chat._myname))
+        elif count_type != "allfrom":
+            column = 2 if count_type.startswith("words") else 1
+            counts[t.people_str] = sum(totals[column] for author, totals in fb_analysis._text_totals(t).items()
+                                       if not ((count_type.endswith("from") and author == chat._myname) or
+                                               (count_type.endswith("to") and author != chat._myname)))
+    return sorted(counts.items(), key=lambda tup: tup[1], reverse=True)[:10]
+
+
+def _time_all(func):
+    start = time.time()
+    for count_type in fb_analysis._COUNT_TYPES:
+        func(count_type)
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    """Compare top_n_people() for all ten count types with a separate pass over every Thread for each."""
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 200000
+    chat = _sample_chat(n)
+    chat.all_messages()
+    for thread in chat.threads:
+        thread._get_text_stats()
+    print "{} messages in {} threads, all ten count types, top 10".format(n, len(chat))
+    print "{:<40} {:>8.3f} s".format("A pass for each count type (old)", _time_all(lambda ct: _counted(chat, ct)))
+    print "{:<40} {:>8.3f} s".format("top_n_people(N=10)", _time_all(lambda ct: fb_analysis.top_n_people(chat, 10, ct)))
+    start = time.time()
+    fb_analysis._count_table(chat)
+    print "{:<40} {:>8.3f} s".format("_count_table(), every count type", time.time() - start)
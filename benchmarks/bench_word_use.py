@@ -0,0 +1,67 @@
+import sys
+import os
+import re
+import time
+import random
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import matplotlib
+matplotlib.use("Agg")
+import fb_analysis
+import fb_chat
+
+
+def _sample_thread(n, seed=0):
+    """Generate a Thread of 'n' messages of words, punctuation, emoticons and the occasional URL."""
+    random.seed(seed)
+    words = [u"".join(random.choice(u"abcdefghijklmnopqrstuvwxyz") for _ in range(random.randint(1, 8))) for _ in range(5000)]
+    extras = [u":)", u":-(", u":P", u"<3", u";)", u"it's", u"we'll", u"ok.", u"yes!", u"(no)", u"http://example.com/page"]
+    d = datetime.datetime(2012, 1, 1)
+    messages = []
+    for num in xrange(1, n + 1):
+        d += datetime.timedelta(minutes=random.randint(0, 5))
+        text = u" ".join(random.choice(extras) if random.random() < 0.1 else words[int(random.paretovariate(0.8)) % len(words)]
+                         for _ in range(random.randint(1, 15)))
+        messages.append(fb_chat.Message("Person", random.choice(["Person", "My Name"]), d, text.capitalize(), num))
+    return fb_chat.Thread(["Person"], messages)
+
+
+def _old_str_to_word_list(text):
+    """Split a message into words as _str_to_word_list() used to, replacing each string in turn."""
+    text = re.sub(r'\w+:\/{2}[\d\w-]+(\.[\d\w-]+)*(?:(?:\/[^\s/]*))*', '', text).lower()
+    for old, new in fb_analysis._CHANGE.items():
+        text = text.replace(old, new)
+    for ex in fb_analysis._EXCLUDE:
+        text = text.replace(ex, " ")
+    return " ".join(text.split()).encode('ascii', 'replace').split()
+
+
+def _old_word_use(messages):
+    """Count words as top_word_use() used to: a list of every word, then counting each in the list."""
+    words = []
+    for m in messages:
+        words.extend(_old_str_to_word_list(m.text))
+    return {x: words.count(x) for x in words}
+
+
+def _timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    """Compare finding the words used in a thread with how top_word_use() used to, which took quadratic time."""
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 100000
+    chat = fb_chat.Chat("My Name", [_sample_thread(n)])
+    messages = chat["Person"].by("Person")
+    print "{} messages in the thread, {} from Person".format(n, len(messages))
+    for count in (1000, 4000):
+        print "{:<44} {:>8.3f} s".format("Old top_word_use(), first {} messages".format(count),
+                                         _timed(lambda: _old_word_use(messages[:count])))
+    print "{:<44} {:>8.3f} s".format("Old splitting into words, all messages",
+                                     _timed(lambda: [_old_str_to_word_list(m.text) for m in messages]))
+    print "{:<44} {:>8.3f} s".format("_str_to_word_list(), all messages",
+                                     _timed(lambda: [fb_analysis._str_to_word_list(m.text) for m in messages]))
+    print "{:<44} {:>8.3f} s".format("top_word_use(), all messages", _timed(lambda: fb_analysis.top_word_use(chat, "Person")))
@@ -1,9 +1,11 @@
 import sys
 import os
+import glob
 import codecs
 
 import fb_parser
 import fb_analysis
+import fb_profile
 
 
 # Nasty hack to force utf-8 encoding by default:
@@ -14,38 +16,75 @@ sys.setdefaultencoding('utf8')
 streamWriter = codecs.lookup('utf-8')[-1]
 sys.stdout = streamWriter(sys.stdout)
 
+# Parsed exports are cached here, so repeat runs on the same file are quick:
+_CACHE_DIR = ".fb_cache"
+
 
 if __name__ == "__main__":
     """Allow the parser to be run from the command line.
 
        Optionally, the function allows specifying the filename to read in from
-       as the first argument."""
+       as the first argument. Adding the flag '--profile' prints the time spent
+       in each stage of parsing and analysis, and the peak memory used."""
+    # Record timings if asked to:
+    profile = None
+    if "--profile" in sys.argv:
+        sys.argv.remove("--profile")
+        profile = fb_profile.Profile(trace_memory=True)
+        profile.start()
     if len(sys.argv) >= 2:
         # If filname passed in and a recognised format, continue:
-        if ((".zip" in sys.argv[1]) or (".htm" in sys.argv[1]) or (".pickle" in sys.argv[1])):
+        if ((".zip" in sys.argv[1]) or (".htm" in sys.argv[1]) or (".pickle" in sys.argv[1]) or
+           (".snapshot" in sys.argv[1]) or (".sqlite" in sys.argv[1]) or (".shards" in sys.argv[1]) or
+           (".parquet" in sys.argv[1])):
             fname = sys.argv[1]
         else:
             # If not a recognised format, stop but allow override:
-            print "File is not a .zip file, a .htm file or a pickle file."
+            print "File is not a .zip file, a .htm file, a pickle file, a snapshot file, a database file, a sharded snapshot or a Parquet file."
             cont = raw_input("Continue anyway? (y/n)")
             if cont == "n":
                 sys.exit(-1)
     else:
         # If no argument, attempt to open the default .zip export file:
         fname = "facebook-" + fb_parser.FBMessageParse._MYUSERNAME + ".zip"
-    if not os.path.isfile(fname):
+    if not os.path.exists(fname):
         print "File " + fname + " does not exist or could not be found! Abort."
         sys.exit(-1)
 
     # Now use the Facebook.Chat object to do stuff!
     # Some example code to add functionality immediately.
 
-    # Create the parser, and parse the messages file:
+    # Create the parser, and parse the messages file. Results of the analysis are kept next to any snapshot used:
+    results_snapshot = None
     if ".pickle" in fname:
         Facebook = fb_parser.FBMessageParse(fname, load_pickle=True)
+    elif ".snapshot" in fname:
+        Facebook = fb_parser.FBMessageParse(fname, load_snapshot=True)
+        results_snapshot = fname
+    elif ".sqlite" in fname:
+        Facebook = fb_parser.FBMessageParse(fname, load_database=True)
+    elif ".shards" in fname:
+        Facebook = fb_parser.FBMessageParse(fname, load_shards=True)
+    elif ".parquet" in fname:
+        Facebook = fb_parser.FBMessageParse(fname, load_parquet=True)
     else:
         Facebook = fb_parser.FBMessageParse(fname)
-        Facebook.parse_messages()
+        # Use the cached Chat object for this export if there is one:
+        if not os.path.isdir(_CACHE_DIR):
+            os.makedirs(_CACHE_DIR)
+        cached_snapshot = os.path.join(_CACHE_DIR, Facebook.archive_fingerprint() + ".snapshot")
+        if os.path.isfile(cached_snapshot):
+            Facebook.load_from_snapshot(cached_snapshot)
+        else:
+            # Otherwise only parse the threads which changed since the last export:
+            Facebook.parse_messages(manifest=os.path.join(_CACHE_DIR, "messages.manifest"))
+            for old_cache in (glob.glob(os.path.join(_CACHE_DIR, "*.pickle")) + glob.glob(os.path.join(_CACHE_DIR, "*.snapshot")) +
+                              glob.glob(os.path.join(_CACHE_DIR, "*.search")) + glob.glob(os.path.join(_CACHE_DIR, "*.results"))):
+                os.remove(old_cache)
+            Facebook.dump_to_snapshot(cached_snapshot)
+        results_snapshot = cached_snapshot
+    if results_snapshot is not None:
+        fb_analysis.load_results(Facebook.Chat, results_snapshot)
     # Now find and print the Top 10 Friends:
     print "Top 10 Most Messaged Friends: Total Thread Length"
     top10 = fb_analysis.top_n_people(Facebook.Chat, N=10)
@@ -54,3 +93,10 @@ if __name__ == "__main__":
     Facebook.write_to_csv()
     # Show a graph of the most messaged friend's messages:
     fb_analysis.messages_date_graph(Facebook.Chat, top10[0][0])
+    # Keep the results of the analysis with the snapshot, for next time:
+    if results_snapshot is not None:
+        fb_analysis.save_results(Facebook.Chat, results_snapshot)
+    # Show the timings if profiling:
+    if profile is not None:
+        profile.stop()
+        print profile.report()
@@ -3,13 +3,126 @@ import matplotlib.pyplot as plt
 from matplotlib.dates import date2num, num2date
 from matplotlib import ticker
 import matplotlib
+import array
+import collections
+import copy
+import functools
+import heapq
+import inspect
+import itertools
+import numpy
+import operator
+import os
 import re
+import cPickle as pickle
+import fb_cache
+import fb_profile
+
+# =============================================================================
+#                               Cached Results                                #
+#                                                                             #
+# Public Functions:                                                           #
+#  - results_cache_info()                                                     #
+#  - clear_results_cache()                                                    #
+#  - set_results_cache_size(maxsize)                                          #
+#  - save_results(Chat, snapshot)                                             #
+#  - load_results(Chat, snapshot)                                             #
+#                                                                             #
+# =============================================================================
+
+# Results of the analysis functions, keyed by (Chat token, Chat version, function name, arguments):
+_RESULTS = fb_cache.LRUCache(64)
+_MISSING = object()
+# Saved results files are pickled dictionaries of this version:
+_RESULTS_VERSION = 1
+
+
+def _memoized(func):
+    """Decorate an analysis function taking a Chat object first so that its results are reused.
+
+       Results are kept in _RESULTS, keyed by the Chat's token and version (see
+       fb_chat.Chat) and the other arguments, so a result is only reused while
+       the Chat has not been changed. The 'progress' argument is not part of
+       the key, and is not called when a result is reused. Calls with arguments
+       which cannot be a dictionary key, or with Chat-like objects without a
+       version, are never cached. A shallow copy of the result is returned."""
+    @functools.wraps(func)
+    def wrapper(Chat, *args, **kwargs):
+        call_args = inspect.getcallargs(func, Chat, *args, **kwargs)
+        call_args.pop("Chat")
+        call_args.pop("progress", None)
+        try:
+            key = (Chat._get_cache_token(), Chat._get_version(), func.__name__, tuple(sorted(call_args.items())))
+            hash(key)
+        except (AttributeError, TypeError):
+            return func(Chat, *args, **kwargs)
+        result = _RESULTS.get(key, _MISSING)
+        if result is _MISSING:
+            result = func(Chat, *args, **kwargs)
+            _RESULTS[key] = result
+        return copy.copy(result)
+    return wrapper
+
+
+def results_cache_info():
+    """Return a dictionary of the hits, misses, size and maximum size of the cache of results."""
+    return _RESULTS.info()
+
+
+def clear_results_cache():
+    """Remove every cached result, and reset the counts of hits and misses."""
+    _RESULTS.clear()
+
+
+def set_results_cache_size(maxsize):
+    """Change the number of results cached, keeping the most recently used. Zero disables the cache."""
+    global _RESULTS
+    old_results = _RESULTS
+    _RESULTS = fb_cache.LRUCache(maxsize)
+    for key, result in old_results.items()[-maxsize:] if maxsize > 0 else []:
+        _RESULTS[key] = result
+    _RESULTS.hits, _RESULTS.misses = old_results.hits, old_results.misses
+
+
+def _results_filename(snapshot):
+    """Return the name of the results file kept next to the snapshot file 'snapshot'."""
+    return os.path.splitext(snapshot)[0] + ".results"
+
+
+def save_results(Chat, snapshot):
+    """Save the cached results for 'Chat' to a '.results' file next to its snapshot file.
+
+       Only results for the Chat as it was in the snapshot, before any changes,
+       are saved (e.g. 'messages.snapshot' has results 'messages.results')."""
+    token = Chat._get_cache_token()
+    results = [(key[2], key[3], result) for key, result in _RESULTS.items() if ((key[0] == token) and (key[1] == 0))]
+    with open(_results_filename(snapshot), "wb") as f:
+        pickle.dump({"version": _RESULTS_VERSION, "token": token, "results": results}, f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_results(Chat, snapshot):
+    """Load the results saved by save_results() next to 'snapshot' into the cache, and return how many there were.
+
+       The results are only used if they were saved for the messages in 'Chat',
+       which must be unchanged since it was read from the snapshot."""
+    filename = _results_filename(snapshot)
+    if ((not os.path.isfile(filename)) or (Chat._get_version() != 0)):
+        return 0
+    with open(filename, "rb") as f:
+        saved = pickle.load(f)
+    token = Chat._get_cache_token()
+    if ((saved.get("version") != _RESULTS_VERSION) or (saved.get("token") != token)):
+        return 0
+    for name, args, result in saved["results"]:
+        _RESULTS[(token, 0, name, args)] = result
+    return len(saved["results"])
+
 
 # =============================================================================
 #                          Top N Most Messaged People                         #
 #                                                                             #
 # Public Functions:                                                           #
-#  - top_n_people(Chat, N, count_type, groups)                                #
+#  - top_n_people(Chat, N, count_type, groups, progress)                      #
 #                                                                             #
 # =============================================================================
 
@@ -17,6 +130,92 @@ _COUNT_TYPES = ["total", "to", "from", "allfrom", "words", "wordsfrom", "wordsto
                 "chars", "charsfrom", "charsto"]
 
 
+def _text_totals(thread):
+    """Return a dictionary of the [messages, characters, words] sent by each author in 'thread'.
+
+       Uses the counts kept by fb_chat.Thread objects where possible, and counts
+       the messages of other Thread-like objects directly."""
+    if hasattr(thread, "_get_text_stats"):
+        return thread._get_text_stats()[2]
+    totals = {}
+    for m in thread.messages:
+        author_totals = totals.setdefault(m.author, [0, 0, 0])
+        author_totals[0] += 1
+        author_totals[1] += len(m)
+        author_totals[2] += len(re.findall(r'\S+', m.text))  # Matches any non-whitespace sub-string
+    return totals
+
+
+def _direct_thread_names(Chat):
+    """Return the set of names of Threads with only one other person in them.
+
+       Uses the index of people in fb_chat.Chat objects where possible, and
+       splits the names of the Threads of other Chat-like objects."""
+    if hasattr(Chat, "threads_with"):
+        return set(t.people_str for t in Chat.threads_with(groups=False))
+    return set(t.people_str for t in Chat.threads if len(t.people_str.split(", ")) == 1)
+
+
+# The count types which need the number of messages, characters or words sent by each person in each Thread:
+_AUTHOR_COUNT_TYPES = ["to", "from", "allfrom", "words", "wordsfrom", "wordsto", "chars", "charsfrom", "charsto"]
+
+
+@_memoized
+def _count_table(Chat, authors=True, progress=None):
+    """Return a table of every count_type for every Thread, made in one pass over the Threads.
+
+       The table is a dictionary containing the list of Thread names, in the
+       order of Chat.threads, under "names", and a NumPy array of each count
+       in the same order under the count_type it is for. The "allfrom" counts
+       are an array in the order of the list of people under "people".
+        - The "total" counts need only the length of each Thread. Unless
+          'authors' is False, the messages, characters and words sent by each
+          author in each Thread are collected into arrays of (Thread number,
+          author number, messages, characters, words) and all other counts are
+          added up from these together.
+        - If a 'progress' function is given, it is called as progress("top_n_people",
+          done, total) after each Thread is counted."""
+    threads = Chat.threads
+    table = {"names": [t.people_str for t in threads],
+             "total": numpy.fromiter((len(t) for t in threads), numpy.int64, len(threads))}
+    if not authors:
+        return table
+    # Number each author as they are found, and list a row for each author in each Thread:
+    author_numbers = {}
+    thread_column, author_column = array.array("i"), array.array("i")
+    message_column, char_column, word_column = array.array("l"), array.array("l"), array.array("l")
+    for i, t in enumerate(fb_profile.with_progress("top_n_people", threads, progress)):
+        for author, totals in _text_totals(t).iteritems():
+            thread_column.append(i)
+            author_column.append(author_numbers.setdefault(author, len(author_numbers)))
+            message_column.append(totals[0])
+            char_column.append(totals[1])
+            word_column.append(totals[2])
+    thread_ids, author_ids = numpy.array(thread_column, numpy.intc), numpy.array(author_column, numpy.intc)
+    mine = (author_ids == author_numbers.get(Chat._myname, -1))
+
+    def thread_sums(values, rows=slice(None)):
+        """Add up the chosen 'rows' of 'values' for each Thread."""
+        return numpy.bincount(thread_ids[rows], values[rows], len(threads)).astype(numpy.int64)
+
+    # Messages, characters and words sent by the current user, and by everyone:
+    message_values = numpy.array(message_column, numpy.int64)
+    for prefix, values in [("", message_values), ("chars", numpy.array(char_column, numpy.int64)),
+                           ("words", numpy.array(word_column, numpy.int64))]:
+        table[prefix + "to"] = thread_sums(values, mine)
+        if prefix:
+            table[prefix] = thread_sums(values)
+        table[prefix + "from"] = table[prefix or "total"] - table[prefix + "to"]
+    # Messages sent by each person across all Threads, except the current user, listed as top_n_people() always has:
+    people = Chat._all_people.copy()
+    people.remove(Chat._myname)  # Remove _myname from people (but not the original!):
+    table["people"] = list(people)
+    all_sent = numpy.bincount(author_ids, message_values, len(author_numbers)).astype(numpy.int64)
+    table["allfrom"] = numpy.array([all_sent[author_numbers[p]] if p in author_numbers else 0 for p in table["people"]],
+                                   numpy.int64)
+    return table
+
+
 def _update_thread_dict(thread_dict, thread_name, num):
     """Add new entries to count dictionary, dealing with duplicates carefully."""
     if thread_name not in thread_dict:
@@ -25,7 +224,32 @@ def _update_thread_dict(thread_dict, thread_name, num):
         thread_dict[thread_name] += num
 
 
-def top_n_people(Chat, N=-1, count_type="total", groups=False):
+@_memoized
+def _people_counts(Chat, count_type="total", groups=False, progress=None):
+    """Return a list of (name, count) tuples for everyone top_n_people() would list, unsorted.
+
+       The counts are taken from the table made by _count_table(), and listed
+       in the order top_n_people() has always ranked tied counts in."""
+    count_type = count_type if count_type in _COUNT_TYPES else "total"
+    table = _count_table(Chat, count_type in _AUTHOR_COUNT_TYPES, progress)
+    thread_dict = {}
+    if count_type == "allfrom":
+        # People are always listed individually for "allfrom", added one at a time as ties have always been ordered:
+        for p, num in itertools.izip(table["people"], table["allfrom"].tolist()):
+            thread_dict.update({p: num})
+        return thread_dict.items()
+    for thread_name, num in itertools.izip(table["names"], table[count_type].tolist()):
+        _update_thread_dict(thread_dict, thread_name, num)
+    if groups:
+        return thread_dict.items()
+    # Without 'groups', only list threads with one other person:
+    direct_names = _direct_thread_names(Chat)
+    return [item for item in thread_dict.items() if item[0] in direct_names]
+
+
+@fb_profile.profiled("top_n_people")
+@_memoized
+def top_n_people(Chat, N=-1, count_type="total", groups=False, progress=None):
     """Return a list of the top N most messaged people.
 
        The "Top N People" can be judged by one of four criteria. The list
@@ -41,87 +265,14 @@ def top_n_people(Chat, N=-1, count_type="total", groups=False):
           the other person in the thread. If 'groups' is enabled, all messages
           not from '_myname' are counted.
         - "allfrom" - the total number of messages from each individual person
-          across all threads. Groups cannot be enabled and will be ignored."""
-    thread_dict = {}
-    if count_type is "to":
-        # Count the number of messages sent directly to each person.
-        for t in Chat.threads:
-            num = len(t.by(Chat._myname))
-            _update_thread_dict(thread_dict, t.people_str, num)
-    elif count_type is "from":
-        # Count the number of messages received directly from each person.
-        for t in Chat.threads:
-            my_num = len(t.by(Chat._myname))
-            tot_num = len(t)
-            num = tot_num - my_num
-            _update_thread_dict(thread_dict, t.people_str, num)
-    elif count_type is "allfrom":
-        # Count all messages in all threads received from each person.
-        all_people = Chat._all_people.copy()
-        all_people.remove(Chat._myname)  # Remove _myname from all_people (but not the original!):
-        for p in all_people:
-            num = len(Chat.all_from(p))
-            thread_dict.update({p: num})
-    elif count_type is "words":
-        # Count total number of words exchanged in threads.
-        for t in Chat.threads:
-            num = 0
-            for m in t.messages:
-                num += len(re.findall(r'\S+', m.text))  # Matches any non-whitespace sub-string
-                # num += len(m.text.split(" "))  # Counts all things separated by a space
-            _update_thread_dict(thread_dict, t.people_str, num)
-    elif count_type is "wordsfrom":
-        # Count total number of words sent by other people in threads.
-        for t in Chat.threads:
-            num = 0
-            for m in t.messages:
-                if not m.sent_by(Chat._myname):
-                    num += len(re.findall(r'\S+', m.text))
-            _update_thread_dict(thread_dict, t.people_str, num)
-    elif count_type is "wordsto":
-        # Count total number of words sent to the other people in threads.
-        for t in Chat.threads:
-            num = 0
-            for m in t.messages:
-                if m.sent_by(Chat._myname):
-                    num += len(re.findall(r'\S+', m.text))
-            _update_thread_dict(thread_dict, t.people_str, num)
-    elif count_type is "chars":
-        # Count total number of characters exchanged in threads.
-        for t in Chat.threads:
-            num = 0
-            for m in t.messages:
-                num += len(m)
-            _update_thread_dict(thread_dict, t.people_str, num)
-    elif count_type is "charsfrom":
-        # Count total number of characters sent by other people in threads.
-        for t in Chat.threads:
-            num = 0
-            for m in t.messages:
-                if not m.sent_by(Chat._myname):
-                    num += len(m)
-            _update_thread_dict(thread_dict, t.people_str, num)
-    elif count_type is "charsto":
-        # Count total number of characters sent to the other people in threads.
-        for t in Chat.threads:
-            num = 0
-            for m in t.messages:
-                if m.sent_by(Chat._myname):
-                    num += len(m)
-            _update_thread_dict(thread_dict, t.people_str, num)
-    else:
-        # Else the default: count the total messages in each thread.
-        for t in Chat.threads:
-            num = len(t)
-            _update_thread_dict(thread_dict, t.people_str, num)
-    sorted_list = sorted(thread_dict.items(), key=lambda tup: tup[1], reverse=True)
-    top_n = []
-    for i, item in enumerate(sorted_list):
-        if ((len(top_n) >= N) and (N > 0)):
-            return top_n
-        if ((len(item[0].split(", ")) == 1) or groups):
-            top_n.append((item[0], item[1]))
-    return top_n
+          across all threads. Groups cannot be enabled and will be ignored.
+       Every count_type is counted at once, see _count_table(). If a 'progress'
+       function is given, it is called as progress("top_n_people", done, total)
+       after each thread is counted."""
+    counts = _people_counts(Chat, count_type, groups, progress)
+    if N > 0:
+        return heapq.nlargest(N, counts, key=operator.itemgetter(1))
+    return sorted(counts, key=operator.itemgetter(1), reverse=True)
 
 
 # =============================================================================
@@ -130,10 +281,11 @@ def top_n_people(Chat, N=-1, count_type="total", groups=False):
 # Public Functions:                                                           #
 #  - use_facebook_colours()                                                   #
 #  - use_ios_colours()                                                        #
-#  - messages_time_graph(Chat, name, filename, no_gui)                        #
-#  - messages_date_graph(Chat, name, filename, start_date, end_date, no_gui)  #
+#  - messages_time_graph(Chat, name, filename, no_gui, progress)              #
+#  - messages_date_graph(Chat, name, filename, start_date, end_date, no_gui,  #
+#                                                                  progress)  #
 #  - messages_pie_chart(Chat, N, filename, count_type, groups,                #
-#                                                        no_gui, percentages) #
+#                                              no_gui, percentages, progress) #
 #                                                                             #
 # =============================================================================
 
@@ -206,7 +358,24 @@ def _dt_to_decimal_time(datetime):
     return time_decimal
 
 
-def messages_time_graph(Chat, name=None, filename=None, no_gui=False):
+@_memoized
+def _time_graph_data(Chat, name):
+    """Return the times of day of the messages sent to and received from 'name', and the labels for the graph."""
+    # If looking at graph with other users, get messages to and from:
+    if name != Chat._myname:
+        Thread = Chat[name]
+        times_from = [_dt_to_decimal_time(message.date_time) for message in Thread.by(name)]
+        times_to = [_dt_to_decimal_time(message.date_time) for message in Thread.by(Chat._myname)]
+        label = [Chat._myname, name]
+    else:  # If looking at all messages sent; do things differently:
+        times_from = [_dt_to_decimal_time(message.date_time) for message in Chat.all_messages() if message.author != Chat._myname]
+        times_to = [_dt_to_decimal_time(message.date_time) for message in Chat.all_from(Chat._myname)]
+        label = [Chat._myname, "Others"]
+    return times_to, times_from, label
+
+
+@fb_profile.profiled("messages_time_graph")
+def messages_time_graph(Chat, name=None, filename=None, no_gui=False, progress=None):
     """Create a graph of the time of day of messages sent between users.
 
        Produces a histogram of the times of messages sent to and received from
@@ -220,22 +389,17 @@ def messages_time_graph(Chat, name=None, filename=None, no_gui=False):
        - If a 'filename' is specified, output to file as well as displaying
          onscreen for viewing.
        - To run without displaying a graph onscreen, set 'no_gui' to True. If no filename
-         is specified with this, the function will run but produce no output anywhere."""
+         is specified with this, the function will run but produce no output anywhere.
+       - If a 'progress' function is given, it is called as progress("messages_time_graph",
+         done, 2) once the messages have been counted and once the graph is drawn."""
     # Implement a default case:
     if name is None:
         name = Chat._myname
     # Divide up into hourly bins, changing datetime objects to times in range [0,1):
     bins = _hour_list()
-    # If looking at graph with other users, get messages to and from:
-    if name != Chat._myname:
-        Thread = Chat[name]
-        times_from = [_dt_to_decimal_time(message.date_time) for message in Thread.by(name)]
-        times_to = [_dt_to_decimal_time(message.date_time) for message in Thread.by(Chat._myname)]
-        label = [Chat._myname, name]
-    else:  # If looking at all messages sent; do things differently:
-        times_from = [_dt_to_decimal_time(message.date_time) for message in Chat.all_messages() if message.author != Chat._myname]
-        times_to = [_dt_to_decimal_time(message.date_time) for message in Chat.all_messages() if message.author == Chat._myname]
-        label = [Chat._myname, "Others"]
+    times_to, times_from, label = _time_graph_data(Chat, name)
+    if progress is not None:
+        progress("messages_time_graph", 1, 2)
     # Create the figure, hiding the display if no_gui set:
     if no_gui:
         plt.ioff()
@@ -272,6 +436,8 @@ def messages_time_graph(Chat, name=None, filename=None, no_gui=False):
     # If given a filename, output to file:
     if ((filename is not None) and (type(filename) is str)):
         plt.savefig(filename, bbox_inches='tight')
+    if progress is not None:
+        progress("messages_time_graph", 2, 2)
 
 
 # ====== Histogram of Date:
@@ -299,7 +465,28 @@ def _month_list(d1, d2):
     return months
 
 
-def messages_date_graph(Chat, name=None, filename=None, start_date=None, end_date=None, no_gui=False):
+@_memoized
+def _date_graph_data(Chat, name):
+    """Return the dates of the messages sent to and received from 'name', the labels for the graph and the first and last dates."""
+    # If looking at graph with other users, get messages to and from:
+    if name != Chat._myname:
+        Thread = Chat[name]
+        first, last = Thread[0].date_time, Thread[-1].date_time
+        dates_from = [date2num(message.date_time) for message in Thread.by(name)]
+        dates_to = [date2num(message.date_time) for message in Thread.by(Chat._myname)]
+        label = [Chat._myname, name]
+    # If looking at all messages sent; do things differently:
+    else:
+        message_list = Chat.all_messages()
+        first, last = message_list[0].date_time, message_list[-1].date_time
+        dates_from = [date2num(message.date_time) for message in message_list if message.author != Chat._myname]
+        dates_to = [date2num(message.date_time) for message in Chat.all_from(Chat._myname)]
+        label = [Chat._myname, "Others"]
+    return dates_to, dates_from, label, first, last
+
+
+@fb_profile.profiled("messages_date_graph")
+def messages_date_graph(Chat, name=None, filename=None, start_date=None, end_date=None, no_gui=False, progress=None):
     """Create a graph of the number of messages sent between users.
 
        Produces a graph of messages sent to and received from another user. The
@@ -315,45 +502,28 @@ def messages_date_graph(Chat, name=None, filename=None, start_date=None, end_dat
          covered; the default is the first message to the last, but specifying dates
          inside this range can be used to narrow down the region considered.
        - To run without displaying a graph onscreen, set 'no_gui' to True. If no filename
-         is specified with this, the function will run but produce no output anywhere."""
+         is specified with this, the function will run but produce no output anywhere.
+       - If a 'progress' function is given, it is called as progress("messages_date_graph",
+         done, 2) once the messages have been counted and once the graph is drawn."""
     # Implement a default case:
     if name is None:
         name = Chat._myname
     # Sanity check input dates, and fix if necessary (note MUST be one line to avoid reassignment before comparison):
     if ((start_date is not None) and (end_date is not None)):
         start_date, end_date = min(start_date, end_date), max(start_date, end_date)
-    # If looking at graph with other users, get messages to and from:
-    if name != Chat._myname:
-            Thread = Chat[name]
-            # If a start date given (which is after the message thread starts), use it:
-            if start_date is None:
-                d_min = Thread[0].date_time
-            else:
-                d_min = max(Chat._date_parse(start_date), Thread[0].date_time)
-            # If an end date given (which is before the message thread ends), use it:
-            if end_date is None:
-                d_max = Thread[-1].date_time
-            else:
-                d_max = min(Chat._date_parse(end_date), Thread[-1].date_time)
-            dates_from = [date2num(message.date_time) for message in Thread.by(name)]
-            dates_to = [date2num(message.date_time) for message in Thread.by(Chat._myname)]
-            label = [Chat._myname, name]
-    # If looking at all messages sent; do things differently:
+    dates_to, dates_from, label, first, last = _date_graph_data(Chat, name)
+    # If a start date given (which is after the messages start), use it:
+    if start_date is None:
+        d_min = first
     else:
-        message_list = Chat.all_messages()
-        # If a start date given (which is after the message thread starts), use it:
-        if start_date is None:
-            d_min = message_list[0].date_time
-        else:
-            d_min = max(Chat._date_parse(start_date), message_list[0].date_time)
-        # If an end date given (which is before the message thread ends), use it:
-        if end_date is None:
-            d_max = message_list[-1].date_time
-        else:
-            d_max = min(Chat._date_parse(end_date), message_list[-1].date_time)
-        dates_from = [date2num(message.date_time) for message in message_list if message.author != Chat._myname]
-        dates_to = [date2num(message.date_time) for message in message_list if message.author == Chat._myname]
-        label = [Chat._myname, "Others"]
+        d_min = max(Chat._date_parse(start_date), first)
+    # If an end date given (which is before the messages end), use it:
+    if end_date is None:
+        d_max = last
+    else:
+        d_max = min(Chat._date_parse(end_date), last)
+    if progress is not None:
+        progress("messages_date_graph", 1, 2)
     # Divide up into month bins, changing datetime objects to number of days for plotting:
     bins = [date2num(b) for b in _month_list(d_min, d_max)]
     # Create the figure, hiding the display if no_gui set:
@@ -392,6 +562,8 @@ def messages_date_graph(Chat, name=None, filename=None, start_date=None, end_dat
     # If given a filename, output to file:
     if ((filename is not None) and (type(filename) is str)):
         plt.savefig(filename, bbox_inches='tight')
+    if progress is not None:
+        progress("messages_date_graph", 2, 2)
 
 
 # ====== Pie Chart of Totals:
@@ -410,8 +582,9 @@ def _make_labels_wrap(labels):
     return labels
 
 
+@fb_profile.profiled("messages_pie_chart")
 def messages_pie_chart(Chat, N=10, filename=None, count_type="total", groups=False,
-                       no_gui=False, percentages=True):
+                       no_gui=False, percentages=True, progress=None):
     """Create a pie chart of the number of messages exchanged with friends.
 
        The graph shows the most messaged friends sorted using the top_n_people()
@@ -428,7 +601,9 @@ def messages_pie_chart(Chat, N=10, filename=None, count_type="total", groups=Fal
         - To run without displaying a graph onscreen, set 'no_gui' to True. If no filename
           is specified with this, the function will run but produce no output anywhere.
         - The percentages on the graph can be removed by setting 'percentages' to
-          False."""
+          False.
+        - A 'progress' function is called as for top_n_people(), which counts
+          in the same way."""
     # The title of the graph depends on the count_type:
     _title_dict = {"total": "Total Lengths of Message Threads",
                    "allfrom": "Total Number of Messages Received",
@@ -439,21 +614,13 @@ def messages_pie_chart(Chat, N=10, filename=None, count_type="total", groups=Fal
                    "chars": "Total Character Lengths of Message Threads",
                    "charsfrom": "Character Length of All Messages Received from People in Personal Threads",
                    "charsto": "Character Length of All Messages Sent to People in Personal Threads"}
-    # The data to plot:
-    thread_counts = top_n_people(Chat, count_type=count_type, groups=groups)
-    # Set up useful lists and counts:
-    names = []
-    counts = []
-    other_count = 0
-    colours = []
-    # Run through the data, adding it to the correct list. If not in N, add to Other:
-    for n, t in enumerate(thread_counts):
-        if n < N:
-            names.append(t[0])
-            counts.append(t[1])
-            colours.append(_COLOURS[n % len(_COLOURS)])
-        else:
-            other_count += t[1]
+    # The data to plot; the top N people, and everyone else added together:
+    people_counts = _people_counts(Chat, count_type, groups, progress)
+    top_counts = heapq.nlargest(N, people_counts, key=operator.itemgetter(1)) if N > 0 else []
+    names = [t[0] for t in top_counts]
+    counts = [t[1] for t in top_counts]
+    colours = [_COLOURS[n % len(_COLOURS)] for n in range(len(top_counts))]
+    other_count = sum(t[1] for t in people_counts) - sum(counts)
     # Add an "Others" section in dark grey using the other_count:
     names.append("Others")
     counts.append(other_count)
@@ -490,34 +657,58 @@ def messages_pie_chart(Chat, N=10, filename=None, count_type="total", groups=Fal
 #                           Word Frequency Analysis                           #
 #                                                                             #
 # Public Functions:                                                           #
-#  - top_word_use(Chat, name, from_me, ignore_single_words)                   #
+#  - top_word_use(Chat, name, from_me, ignore_single_words, progress)         #
 #                                                                             #
 # =============================================================================
 
 
+# Some characters and strings need deleting from messages to separate them into proper words:
+_EXCLUDE = ["'s", "'ll", ".", ",", ":", ";", "!", "?", "*", '"', "-", "+", "^", "_", "~", "(", ")", "[", "]", "/", "\\", "@", "="]
+# Some things need removing, but not deleting as with _EXCLUDE:
+_CHANGE = {"'": "", ":p": "tongueoutsmiley", ":-p": "tongueoutsmiley",
+           ":)": "happyfacesmiley", ":-)": "happyfacesmiley", ":/": "awkwardfacesmiley",
+           ":-/": "awkwardfacesmiley", "<3": "loveheartsmiley", ":(": "sadfacesmiley",
+           ":-(": "sadfacesmiley", ":'(": "cryingfacesmiley", ":d": "grinningfacesmiley",
+           ":-d": "grinningfacesmiley", ";)": "winkfacesmiley", ";-)": "winkfacesmiley",
+           ":o": "shockedfacesmiley"}
+# The order of items in the CHANGE dictionary means changing back isn't quite so simple; just use a second dictionary:
+_CHANGE_BACK = {"tongueoutsmiley": ":P", "happyfacesmiley": ":)", "awkwardfacesmiley": ":/",
+                "loveheartsmiley": "<3", "sadfacesmiley": ":(", "cryingfacesmiley": ":'(",
+                "grinningfacesmiley": ":D", "winkfacesmiley": ";)", "shockedfacesmiley": ":o"}
+# URLs are removed with a regular expression, else they mess up when removing punctuation:
+_URL = re.compile(r'\w+:\/{2}[\d\w-]+(\.[\d\w-]+)*(?:(?:\/[^\s/]*))*')
+
+
+def _alternatives(strings):
+    """Return a compiled regular expression matching any of 'strings', longest first."""
+    return re.compile("|".join(re.escape(s) for s in sorted(strings, key=len, reverse=True)))
+
+
+# Words were made by replacing each _CHANGE item in turn, in the order of the dictionary: no emoticon can
+# create or break up another, so the emoticons before "'" are changed in one pass, then "'" is removed and
+# the emoticons after it are changed in a second pass. Any containing "'" can no longer be found by then:
+_QUOTE_POSITION = _CHANGE.keys().index("'")
+_CHANGE_BEFORE_QUOTE = _alternatives(_CHANGE.keys()[:_QUOTE_POSITION])
+_CHANGE_AFTER_QUOTE = _alternatives([old for old in _CHANGE.keys()[_QUOTE_POSITION + 1:] if "'" not in old])
+# Likewise "'s" and "'ll" in _EXCLUDE never match, since "'" has been removed; the rest are single characters:
+_EXCLUDE_CHARACTERS = re.compile("[" + re.escape("".join(ex for ex in _EXCLUDE if len(ex) == 1)) + "]")
+
+
+def _changed(match):
+    """Return what a _CHANGE item found by a regular expression is changed to."""
+    return _CHANGE[match.group()]
+
+
 def _str_to_word_list(text):
     """Turn a string into a list of words, removing URLs and punctuation.
 
        - The function takes in a string and returns a list of strings."""
-    # Some characters and strings need deleting from messages to separate them into proper words:
-    _EXCLUDE = ["'s", "'ll", ".", ",", ":", ";", "!", "?", "*", '"', "-", "+", "^", "_", "~", "(", ")", "[", "]", "/", "\\", "@", "="]
-    # Some things need removing, but not deleting as with _EXCLUDE:
-    _CHANGE = {"'": "", ":p": "tongueoutsmiley", ":-p": "tongueoutsmiley",
-               ":)": "happyfacesmiley", ":-)": "happyfacesmiley", ":/": "awkwardfacesmiley",
-               ":-/": "awkwardfacesmiley", "<3": "loveheartsmiley", ":(": "sadfacesmiley",
-               ":-(": "sadfacesmiley", ":'(": "cryingfacesmiley", ":d": "grinningfacesmiley",
-               ":-d": "grinningfacesmiley", ";)": "winkfacesmiley", ";-)": "winkfacesmiley",
-               ":o": "shockedfacesmiley"}
-    # Remove URLs with a regular expression, else they mess up when removing punctuation:
-    text = re.sub(r'\w+:\/{2}[\d\w-]+(\.[\d\w-]+)*(?:(?:\/[^\s/]*))*', '', text)
-    # Remove the NEWLINE denoting string, and replace with a space before anything else:
-    text = text.replace("<|NEWLINE|>", " ")
+    text = _URL.sub('', text)
     text = text.lower()
     # Change and exclude things:
-    for old, new in _CHANGE.items():
-        text = text.replace(old, new)
-    for ex in _EXCLUDE:
-        text = text.replace(ex, " ")
+    text = _CHANGE_BEFORE_QUOTE.sub(_changed, text).replace("'", "")
+    text = _CHANGE_AFTER_QUOTE.sub(_changed, text)
+    text = _EXCLUDE_CHARACTERS.sub(" ", text)
     # A hack to replace all whitespace with one space:
     text = " ".join(text.split())
     # Get rid of non-ASCII characters for simplicity
@@ -526,28 +717,26 @@ def _str_to_word_list(text):
     return text.split()
 
 
-def _message_list_word_list(messages):
-    """Take a list of Message objects and return a list of strings.
+def _message_list_word_counts(messages, progress=None):
+    """Take a list of Message objects and return a Counter of the words in them.
 
-       The returned list of strings contains all of the words in the messages."""
-    word_list = []
-    for m in messages:
-        word_list.extend(_str_to_word_list(m.text))
-    return word_list
+       Words are counted as each message is split up, so no list of every word is
+       made. If given, progress("top_word_use", done, total) is called after each message."""
+    word_counts = collections.Counter()
+    for m in fb_profile.with_progress("top_word_use", messages, progress):
+        word_counts.update(_str_to_word_list(m.text))
+    return word_counts
 
 
-def _word_list_to_freq(words, ignore_single_words=False):
-    """Take a list of strings, and return a list of (word, word_use_count).
+def _word_counts_to_freq(word_counts, ignore_single_words=False):
+    """Take a Counter of words, and return a list of (word, word_use_count).
 
-       - The returned list of pairs is sorted in descending order.
+       - The returned list of pairs is sorted in descending order. The Counter
+         is changed: it is not copied, as a copy would list tied words in a
+         different order.
        - Passing 'ignore_single_words' will remove any words only used once in
          a message thread."""
-    # The order of items in the CHANGE dictionary means changing back isn't quite so simple; just use a second dictionary:
-    _CHANGE_BACK = {"tongueoutsmiley": ":P", "happyfacesmiley": ":)", "awkwardfacesmiley": ":/",
-                    "loveheartsmiley": "<3", "sadfacesmiley": ":(", "cryingfacesmiley": ":'(",
-                    "grinningfacesmiley": ":D", "winkfacesmiley": ";)", "shockedfacesmiley": ":o"}
-    # Make a dictionary of words and their total count:
-    freq = {x: words.count(x) for x in words}
+    freq = word_counts
     # Change the emoticons back to emoticons:
     for new, old in _CHANGE_BACK.items():
         if new in freq:
@@ -560,18 +749,28 @@ def _word_list_to_freq(words, ignore_single_words=False):
     return freq
 
 
-def top_word_use(Chat, name, from_me=False, ignore_single_words=False):
+def _word_list_to_freq(words, ignore_single_words=False):
+    """Take a list of strings, and return a list of (word, word_use_count), as _word_counts_to_freq() does."""
+    return _word_counts_to_freq(collections.Counter(words), ignore_single_words)
+
+
+@fb_profile.profiled("top_word_use")
+@_memoized
+def top_word_use(Chat, name, from_me=False, ignore_single_words=False, progress=None):
     """Work out the most commonly used words by a friend.
 
-       The function returns a list of (word, word_use_count) tuples. For long threads,
-       THIS FUNCTION WILL TAKE A VERY LONG TIME, due to the analysis being done
-       directly in Python, not in a module using the faster C or C++.
+       The function returns a list of (word, word_use_count) tuples. The words
+       in each message are found using a few regular expressions, and counted
+       as each message is split up, so the time taken grows only in proportion
+       to the number of words.
 
        - 'name' is a string of the name of the Thread to consider.
        - 'from_me' is a boolean flag to consider messages sent by you to 'name'
          if True, otherwise messages received from 'name' are used, the default.
        - Setting 'ignore_single_words' to True removes words which are only used
-         once, which reduces the length of the list returned."""
+         once, which reduces the length of the list returned.
+       - If a 'progress' function is given, it is called as progress("top_word_use",
+         done, total) after the words in each message are found."""
     if name != Chat._myname:
         if from_me:
             messages = Chat[name].by(Chat._myname)
@@ -579,6 +778,6 @@ def top_word_use(Chat, name, from_me=False, ignore_single_words=False):
             messages = Chat[name].by(name)
     else:
         messages = Chat.all_from(Chat._myname)
-    wlist = _message_list_word_list(messages)
-    freq = _word_list_to_freq(wlist, ignore_single_words)
+    word_counts = _message_list_word_counts(messages, progress)
+    freq = _word_counts_to_freq(word_counts, ignore_single_words)
     return freq
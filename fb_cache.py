@@ -0,0 +1,85 @@
+class LRUCache(object):
+    """A dictionary-like cache holding at most 'maxsize' items.
+
+        - When full, adding a new item evicts the least recently used item. Both
+          reading and writing an item count as using it.
+        - The number of cache hits and misses from get() are recorded, and can be
+          inspected using info().
+        - Items are kept in a circular doubly linked list of [prev, next, key, value]
+          lists, so that every operation is O(1)."""
+
+    _PREV, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._map = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __len__(self):
+        """Return the number of items in the cache."""
+        return len(self._map)
+
+    def __contains__(self, key):
+        """Return True if 'key' is in the cache, without counting it as used."""
+        return key in self._map
+
+    def _move_to_front(self, link):
+        """Mark an item as the most recently used."""
+        link_prev, link_next = link[self._PREV], link[self._NEXT]
+        link_prev[self._NEXT] = link_next
+        link_next[self._PREV] = link_prev
+        last = self._root[self._PREV]
+        last[self._NEXT] = self._root[self._PREV] = link
+        link[self._PREV] = last
+        link[self._NEXT] = self._root
+
+    def get(self, key, default=None):
+        """Return the item stored for 'key', or 'default' if it is not in the cache."""
+        link = self._map.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._move_to_front(link)
+        return link[self._VALUE]
+
+    def __setitem__(self, key, value):
+        """Store 'value' for 'key', evicting the least recently used item if full."""
+        link = self._map.get(key)
+        if link is not None:
+            link[self._VALUE] = value
+            self._move_to_front(link)
+            return
+        if self.maxsize <= 0:
+            return
+        if len(self._map) >= self.maxsize:
+            oldest = self._root[self._NEXT]
+            self._root[self._NEXT] = oldest[self._NEXT]
+            oldest[self._NEXT][self._PREV] = self._root
+            del self._map[oldest[self._KEY]]
+        last = self._root[self._PREV]
+        link = [last, self._root, key, value]
+        last[self._NEXT] = self._root[self._PREV] = self._map[key] = link
+
+    def items(self):
+        """Return a list of (key, value) pairs, least recently used first, without counting them as used."""
+        items = []
+        link = self._root[self._NEXT]
+        while link is not self._root:
+            items.append((link[self._KEY], link[self._VALUE]))
+            link = link[self._NEXT]
+        return items
+
+    def clear(self):
+        """Remove every item from the cache and reset the hit and miss counts."""
+        self._map.clear()
+        self._root[:] = [self._root, self._root, None, None]
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """Return a dictionary of the cache's hits, misses, size and maximum size."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._map), "maxsize": self.maxsize}
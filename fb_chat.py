@@ -1,4 +1,102 @@
+import array
+import bisect
+import collections
 import datetime
+import heapq
+import itertools
+import operator
+import re
+import uuid
+import fb_search
+
+
+# Older versions stored messages with newlines replaced by this, and quote marks doubled, for csv output:
+_NEWLINE = "<|NEWLINE|>"
+# Messages are sorted using their precomputed keys, never by comparing Message objects:
+_sort_key = operator.attrgetter("sort_key")
+# Words in a message are counted as runs of non-whitespace characters:
+_WORD = re.compile(r"\S+")
+# Changes to Chat and Thread objects are numbered from one counter, so no two changes share a version:
+_VERSIONS = itertools.count(1)
+
+
+def _parse_date(date):
+    """Allow dates to be entered as integer tuples (YYYY, MM, DD[, HH, MM])."""
+    if type(date) is datetime.datetime:
+        return date
+    else:
+        return datetime.datetime(*date)
+
+
+def _parse_between(start, end=None):
+    """Return the 'start' and 'end' dates of a sent_between() query as datetime objects."""
+    start = _parse_date(start)
+    if end is not None:
+        end = _parse_date(end)
+    else:
+        end = start + datetime.timedelta(1)  # 1 day (24 hours) later than 'start'
+    return start, end
+
+
+def _decorate(i, messages):
+    """Return an iterator of the messages in list 'i' of a merge, with the parts of their sort keys.
+
+       The parts are unpacked since flat tuples compare faster. A function is
+       used so that each iterator has its own 'i'."""
+    return ((m.date_time, m._number, i, j, m) for j, m in enumerate(messages))
+
+
+def _merge_messages(message_lists):
+    """Merge date ordered lists of messages into one date ordered iterator.
+
+       The order is the same as sorting all the messages together: messages sent
+       at the same time with the same number stay in the order of 'message_lists'."""
+    decorated = [_decorate(i, messages) for i, messages in enumerate(message_lists)]
+    return (item[-1] for item in heapq.merge(*decorated))
+
+
+def _author_positions(messages):
+    """Return a dictionary of the positions in 'messages' of the messages sent by each author.
+
+       The positions for each author are in increasing order."""
+    index = {}
+    for i, message in enumerate(messages):
+        try:
+            index[message.author].append(i)
+        except KeyError:
+            index[message.author] = [i]
+    return index
+
+
+def _fold(name):
+    """Return 'name' in lower case, as unicode, for comparing names ignoring case."""
+    if isinstance(name, str):
+        name = name.decode("utf8", "replace")
+    return name.lower()
+
+
+def _text_counts(messages):
+    """Return arrays of the number of characters and the number of words in each of 'messages'."""
+    chars = array.array("i", [len(message.text) for message in messages])
+    words = array.array("i", [len(_WORD.findall(message.text)) for message in messages])
+    return chars, words
+
+
+def _author_totals(authors, chars, words):
+    """Return a dictionary of the [messages, characters, words] sent by each author.
+
+       The arguments are the author, number of characters and number of words of
+       each message, in the same order."""
+    totals = {}
+    for author, message_chars, message_words in itertools.izip(authors, chars, words):
+        try:
+            author_totals = totals[author]
+        except KeyError:
+            author_totals = totals[author] = [0, 0, 0]
+        author_totals[0] += 1
+        author_totals[1] += message_chars
+        author_totals[2] += message_words
+    return totals
 
 
 class Chat(object):
@@ -7,17 +105,164 @@ class Chat(object):
         - Contains a list of Thread objects, which can be accessed using item
           accessing Chat["Thread Name"] style.
         - When initialising, 'myname' should be the name of the user, and 'threads'
-          should be a list of Thread objects.
-        - Provides useful functions for accessing messages."""
-
-    def __init__(self, myname, threads):
+          should be a list of Thread objects. Optionally, 'symbols' can be the
+          SymbolTable used to create the messages; otherwise one is made from
+          the messages when first used.
+        - The names of all people and threads are kept in the SymbolTable
+          Chat.symbols, which gives each a small integer ID.
+        - Creating a Chat only counts the messages in each Thread. The dictionary
+          of Threads by name, the set of all people and the index of the Threads
+          each person is in are made when first used.
+        - Provides useful functions for accessing messages. Messages from all
+          threads are merged into date order once, when first needed, and date
+          queries use binary search. The messages sent by each person are found
+          using an index of their positions in this list, and searches use an
+          index of the words in each message (see the fb_search module). If
+          messages are added to the Threads, call _recount_messages() to update
+          these.
+        - The Chat and each Thread have a version, which changes whenever they are
+          changed using _recount_messages(), or Thread._add_messages() and
+          Thread._renumber_messages(). Together with a token identifying the
+          Chat, this allows results worked out from the messages to be reused
+          until they change (see fb_analysis)."""
+
+    # Whether to keep the date ordered list of all messages once made:
+    _keep_timeline = True
+    # Chat objects pickled before the list and its indexes were kept will not have them:
+    _timeline = None
+    _author_index = None
+    _search_index = None
+    _thread_dict_cache = None
+    _all_people_cache = None
+    _participant_index = None
+    _symbols_cache = None
+    _version = 0
+    _indexed_version = 0
+    _cache_token = None
+
+    def __init__(self, myname, threads, symbols=None):
         self.threads = sorted(threads, key=len, reverse=True)
-        self._thread_dict = {", ".join(thread.people): thread for thread in self.threads}
-        self._total_messages = len(self.all_messages())
+        self._total_messages = sum(len(thread) for thread in self.threads)
         self._myname = myname
-        self._all_people = {myname}
-        for thread in self.threads:
-            self._all_people.update(thread.people)
+        self._thread_dict_cache = None
+        self._all_people_cache = None
+        self._participant_index = None
+        self._indexed_version = self._get_version()
+        self._timeline = None
+        self._author_index = None
+        self._search_index = None
+        self._symbols_cache = symbols
+        if symbols is not None:
+            symbols.intern(myname)
+            for thread in self.threads:
+                symbols.intern(thread.people_str)
+                for person in thread.people:
+                    symbols.intern(person)
+
+    def __getstate__(self):
+        """Return the attributes to pickle, leaving out the date ordered list of messages, its indexes and other caches."""
+        state = self.__dict__.copy()
+        state["_thread_dict_cache"] = None
+        state["_all_people_cache"] = None
+        state["_participant_index"] = None
+        state["_timeline"] = None
+        state["_author_index"] = None
+        state["_search_index"] = None
+        state["_cache_token"] = None  # A copy may be changed differently, so needs its own token
+        return state
+
+    @property
+    def _thread_dict(self):
+        """The dictionary of Threads by the names of the people in them, made when first used."""
+        if self._thread_dict_cache is None:
+            self._thread_dict_cache = {", ".join(thread.people): thread for thread in self.threads}
+        return self._thread_dict_cache
+
+    @_thread_dict.setter
+    def _thread_dict(self, thread_dict):
+        self._thread_dict_cache = thread_dict
+
+    @property
+    def _all_people(self):
+        """The set of the names of everyone in the Chat, including 'myname', made when first used."""
+        if self._all_people_cache is None:
+            all_people = {self._myname}
+            for thread in self.threads:
+                all_people.update(thread.people)
+            self._all_people_cache = all_people
+        return self._all_people_cache
+
+    @_all_people.setter
+    def _all_people(self, all_people):
+        self._all_people_cache = all_people
+
+    @property
+    def symbols(self):
+        """The SymbolTable of the names of everyone and every Thread in the Chat, made when first used if not given."""
+        if self._symbols_cache is None:
+            symbols = SymbolTable([self._myname])
+            for thread in self.threads:
+                symbols.intern(thread.people_str)
+                for person in thread.people:
+                    symbols.intern(person)
+                for message in thread.messages:
+                    symbols.intern(message.author)
+                    symbols.intern(message.thread_name)
+            self._symbols_cache = symbols
+        return self._symbols_cache
+
+    @symbols.setter
+    def symbols(self, symbols):
+        self._symbols_cache = symbols
+
+    def _get_participant_index(self):
+        """Return the index of the Threads each person is in.
+
+           Returns a dictionary of the set of positions in Chat.threads of the
+           Threads each person is in, and a sorted list of (lower case name, name)
+           pairs for everyone in any Thread. Made when first used."""
+        if self._participant_index is None:
+            threads_of = {}
+            for i, thread in enumerate(self.threads):
+                for person in thread.people:
+                    try:
+                        threads_of[person].add(i)
+                    except KeyError:
+                        threads_of[person] = {i}
+            names = sorted((_fold(person), person) for person in threads_of)
+            self._participant_index = (threads_of, names)
+        return self._participant_index
+
+    def find_people(self, prefix):
+        """Return a list of the names of everyone in a Thread whose name starts with 'prefix', ignoring case.
+
+           The names are in alphabetical order, ignoring case. Use find_people("")
+           for everyone."""
+        names = self._get_participant_index()[1]
+        prefix = _fold(prefix)
+        found = []
+        for folded, name in itertools.islice(names, bisect.bisect_left(names, (prefix,)), None):
+            if not folded.startswith(prefix):
+                break
+            found.append(name)
+        return found
+
+    def threads_with(self, names=(), groups=True):
+        """Return a list of the Threads containing every person in the list 'names'.
+
+            - For example, Chat.threads_with(["Alice", "Bob"]) returns all the
+              Threads containing both Alice and Bob. The Threads are in the same
+              order as Chat.threads, longest first.
+            - If 'groups' is False, only Threads with one other person are included.
+              With no 'names', this is every such Thread.
+            - The names must match exactly: use find_people() to look them up."""
+        threads_of = self._get_participant_index()[0]
+        if len(names) == 0:
+            positions = xrange(len(self.threads))
+        else:
+            position_sets = sorted((threads_of.get(name, set()) for name in names), key=len)
+            positions = sorted(position_sets[0].intersection(*position_sets[1:]))
+        return [self.threads[i] for i in positions if (groups or (len(self.threads[i].people) == 1))]
 
     def __getitem__(self, key):
         """Allow accessing Thread objects in the list using Chat["Thread Name"].
@@ -48,24 +293,111 @@ class Chat(object):
            to be entered as datetime.datetime objects. The Year, Month and
            Day are compulsory, the Hours and Minutes optional. May cause exceptions
            if poorly formatted tuples are used."""
-        if type(date) is datetime.datetime:
-            return date
-        else:
-            return datetime.datetime(*date)
+        return _parse_date(date)
 
     def _recount_messages(self):
         """Update the count of total messages.
 
            Since Thread objects can be extended dynamically, this may prove
-           necessary."""
-        self._total_messages = len(self.all_messages())
+           necessary. The date ordered list of all messages and its indexes of
+           authors and words are also rebuilt when next needed."""
+        self._total_messages = sum(len(thread) for thread in self.threads)
+        self._timeline = None
+        self._author_index = None
+        self._search_index = None
+        self._version = next(_VERSIONS)
+        self._indexed_version = self._version
+
+    def _get_version(self):
+        """Return the version of the Chat, which changes whenever it or any of its Threads are changed.
+
+           Versions are never reused, so the latest of the versions of the Chat
+           and its Threads identifies the messages in the Chat. It is 0 if
+           nothing has been changed since the Chat was created."""
+        return max([self._version] + [thread._version for thread in self.threads])
+
+    def _get_cache_token(self):
+        """Return a string identifying this Chat object, made when first needed.
+
+           Chats read from the same snapshot file share its token; any other
+           Chat, including an unpickled copy, has a token of its own."""
+        if self._cache_token is None:
+            self._cache_token = uuid.uuid4().hex
+        return self._cache_token
+
+    def _check_version(self):
+        """Forget the date ordered list of messages and its indexes if the Chat has changed since they were made.
+
+           Threads changed without calling _recount_messages() change the version
+           of the Chat, so these are made again rather than going out of date."""
+        version = self._get_version()
+        if version != self._indexed_version:
+            self._timeline = None
+            self._author_index = None
+            self._search_index = None
+            self._indexed_version = version
+
+    def _get_timeline(self):
+        """Return the date ordered list of all messages, and a list of their timestamps.
+
+           The Threads are already in date order, so they are merged in linear time
+           the first time this is needed; later calls reuse the lists until the
+           version of the Chat changes."""
+        self._check_version()
+        if self._timeline is not None:
+            return self._timeline
+        messages = list(_merge_messages([thread.messages for thread in self.threads]))
+        timeline = (messages, [message.date_time for message in messages])
+        if self._keep_timeline:
+            self._timeline = timeline
+        return timeline
+
+    def _get_range(self):
+        """Return the date ordered lists of messages and timestamps, and how many of them are in this Chat.
+
+           For a Chat, this is the whole of the lists from _get_timeline(). A
+           ChatView shares the lists of the Chat it was made from, and uses only
+           the messages sent before its date, which come first."""
+        messages, dates = self._get_timeline()
+        return messages, dates, len(messages)
+
+    def _get_author_index(self):
+        """Return the date ordered list of all messages and a dictionary of the positions of each author's messages in it."""
+        messages = self._get_timeline()[0]
+        if self._author_index is None:
+            self._author_index = _author_positions(messages)
+        return messages, self._author_index
+
+    def _get_search_index(self):
+        """Return the fb_search.SearchIndex of the words in all messages.
+
+           The index refers to messages by their position in the date ordered
+           list of all messages. It is made the first time it is needed, unless
+           one was loaded with the Chat object."""
+        self._check_version()
+        if self._search_index is None:
+            self._search_index = fb_search.build_index(self._get_timeline()[0])
+        return self._search_index
+
+    def _found(self, positions, messages, end):
+        """Return the messages at the sorted 'positions' in the date ordered list 'messages' which are before 'end'."""
+        return [messages[i] for i in itertools.islice(positions, bisect.bisect_left(positions, end))]
+
+    def _merge_threads(self, query, *args):
+        """Return the date ordered list of the messages found by the Thread method 'query' in every Thread.
+
+           Used when the date ordered list of all messages is not kept, so that
+           each query reads each Thread at most once, and Threads which cannot
+           match (see fb_snapshot.ShardedThread) need not be read at all."""
+        return list(_merge_messages([getattr(thread, query)(*args) for thread in self.threads]))
 
     def all_messages(self):
         """Return a date ordered list of all messages.
 
            The list is all messages contained in the Chat object, as a list of
            Message objects."""
-        return sorted([message for thread in self.threads for message in thread.messages])
+        messages, _, end = self._get_range()
+        return messages[:end]
 
     def all_from(self, name):
         """Return a date ordered list of all messages sent by 'name'.
@@ -73,21 +405,31 @@ class Chat(object):
            The list returned is a list of Message objects. This is distinct from
            Thread.by(name) since all threads are searched by this method. For all
            messages in one thread from 'name', use Thread.by(name) on the correct Thread."""
-        return sorted([message for thread in self.threads for message in thread.by(name)])
+        if not self._keep_timeline:
+            # Without the list of all messages to index, merge each Thread's messages from 'name':
+            return self._merge_threads("by", name)
+        messages, _, end = self._get_range()
+        return self._found(self._get_author_index()[1].get(name, []), messages, end)
 
     def sent_before(self, date):
         """Return a date ordered list of all messages sent before specified date.
 
            The function returns a list of Message objects. The 'date' can be a
            datetime.datetime object, or a three or five tuple (YYYY, MM, DD[, HH, MM])."""
-        return sorted([message for thread in self.threads for message in thread.sent_before(date)])
+        if not self._keep_timeline:
+            return self._merge_threads("sent_before", date)
+        messages, dates, end = self._get_range()
+        return messages[:bisect.bisect_left(dates, _parse_date(date), 0, end)]
 
     def sent_after(self, date):
         """Return a date ordered list of all messages sent after specified date.
 
            The list returned is a list of Message objects. The 'date' can be a
            datetime.datetime object, or a three or five tuple (YYYY, MM, DD[, HH, MM])."""
-        return sorted([message for thread in self.threads for message in thread.sent_after(date)])
+        if not self._keep_timeline:
+            return self._merge_threads("sent_after", date)
+        messages, dates, end = self._get_range()
+        return messages[bisect.bisect_right(dates, _parse_date(date), 0, end):end]
 
     def sent_between(self, start, end=None):
         """Return a date ordered list of all messages sent between specified dates.
@@ -98,7 +440,11 @@ class Chat(object):
             - Not entering an 'end' date is interpreted as all messages sent on
               the day 'start'. Where a time is specified also, a 24 hour period
               beginning at 'start' is used."""
-        return sorted([message for thread in self.threads for message in thread.sent_between(start, end)])
+        if not self._keep_timeline:
+            return self._merge_threads("sent_between", start, end)
+        start, end = _parse_between(start, end)
+        messages, dates, count = self._get_range()
+        return messages[bisect.bisect_left(dates, start, 0, count):bisect.bisect_right(dates, end, 0, count)]
 
     def search(self, string, ignore_case=False):
         """Return a date ordered list of all messages containing 'string'.
@@ -106,19 +452,155 @@ class Chat(object):
            This function searches in all threads, and returns a list of Message
            objects.
             - The function can be made case-insensitive by setting 'ignore_case'
-              to True."""
-        return sorted([message for thread in self.threads for message in thread.search(string, ignore_case)])
+              to True.
+            - The index of words finds the messages which may contain 'string',
+              and only these are checked."""
+        if not self._keep_timeline:
+            return self._merge_threads("search", string, ignore_case)
+        positions = self._get_search_index().matching(string)
+        messages, _, end = self._get_range()
+        if positions is None:
+            return [message for message in itertools.islice(messages, end) if message.contains(string, ignore_case)]
+        return [message for message in self._found(positions, messages, end) if message.contains(string, ignore_case)]
+
+    def search_words(self, words):
+        """Return a date ordered list of all messages containing every word in the list 'words'.
+
+           Words are matched whole and case-insensitively, in any order: searching
+           for ["cat"] does not find "category". Each item in 'words' may be a
+           phrase, which is split into words."""
+        positions = self._get_search_index().with_words(words)
+        messages, _, end = self._get_range()
+        return self._found(positions, messages, end)
+
+    def search_phrase(self, phrase):
+        """Return a date ordered list of all messages containing the words of 'phrase', in order.
+
+           Words are matched whole and case-insensitively, and punctuation between
+           them is ignored: searching for "see you soon" finds "See you... soon!"."""
+        phrase_words = fb_search.words(phrase)
+        positions = self._get_search_index().with_words([phrase])
+        messages, _, end = self._get_range()
+        return [message for message in self._found(positions, messages, end)
+                if fb_search.contains_phrase(message.text, phrase_words)]
 
     def on(self, date):
         """Return the Chat object as it would have been on 'date'.
 
-           The Chat object returned is a new object containing the subset of the
-           Threads which contain messages sent before 'date', where each of these
-           Threads is a new Thread with only these messages in.
+           The object returned is a ChatView containing the subset of the Threads
+           which contain messages sent before 'date', where each of these Threads
+           is a ThreadView of only these messages. Views share the messages of
+           this Chat rather than copying them, so are quick to make.
            - 'date' can be a datetime.datetime object, or a three or five tuple
               (YYYY, MM, DD[, HH, MM])."""
-        threads_on = [t.on(date) for t in self.threads if len(t.on(date)) > 0]
-        return Chat(self._myname, threads_on)
+        return ChatView(self, date)
+
+
+class ChatView(Chat):
+    """A read-only view of a Chat object as it was on an earlier date.
+
+        - Made using Chat.on(date). Contains the Threads of the Chat with messages
+          sent before the date, as ThreadView objects, and behaves like a Chat
+          containing only those messages.
+        - Shares the date ordered list of messages and the indexes of the Chat it
+          was made from: only the messages before the date are used. The Chat
+          should not have messages added to it while its views are in use.
+        - Pickles as an ordinary Chat object."""
+
+    def __init__(self, chat, date):
+        date = _parse_date(date)
+        threads_on = [t for t in (thread.on(date) for thread in chat.threads) if len(t) > 0]
+        self._chat = chat
+        Chat.__init__(self, chat._myname, threads_on, chat.symbols)
+        self._date = date
+        self._keep_timeline = chat._keep_timeline
+
+    def __reduce__(self):
+        return (Chat, (self._myname, self.threads, self.symbols))
+
+    def _get_timeline(self):
+        """Return the date ordered list of the messages in the view, and a list of their timestamps.
+
+           Where the Chat does not keep its list of all messages, the view merges
+           its own Threads, and makes its own indexes, rather than reading every
+           message of the Chat."""
+        if not self._keep_timeline:
+            return Chat._get_timeline(self)
+        messages, dates, end = self._get_range()
+        return messages[:end], dates[:end]
+
+    def _get_range(self):
+        if not self._keep_timeline:
+            return Chat._get_range(self)
+        messages, dates, _ = self._chat._get_range()
+        return messages, dates, self._total_messages
+
+    def _get_author_index(self):
+        if not self._keep_timeline:
+            return Chat._get_author_index(self)
+        return self._chat._get_author_index()
+
+    def _get_search_index(self):
+        if not self._keep_timeline:
+            return Chat._get_search_index(self)
+        return self._chat._get_search_index()
+
+    def _get_version(self):
+        return self._chat._get_version()
+
+    def _get_cache_token(self):
+        """Return a token shared by all views of the same Chat on the same date."""
+        return "{}@{}".format(self._chat._get_cache_token(), self._date.isoformat())
+
+
+class SymbolTable(object):
+    """An object to store the names of people and threads, each only once.
+
+        - Each name is given a small integer ID, in the order they are added.
+          Names can be looked up by ID using SymbolTable[id], and IDs by name
+          using SymbolTable.id(name).
+        - Use intern(name) when creating objects which refer to a name: the stored
+          copy is returned, so that every message by one person shares one string."""
+
+    def __init__(self, names=()):
+        self.names = []
+        self._ids = {}
+        for name in names:
+            self.intern(name)
+
+    def __getitem__(self, symbol_id):
+        """Return the name with ID 'symbol_id'."""
+        return self.names[symbol_id]
+
+    def __contains__(self, name):
+        """Return True if 'name' is in the table."""
+        return name in self._ids
+
+    def __len__(self):
+        """Return the number of names in the table."""
+        return len(self.names)
+
+    def __repr__(self):
+        """Set Python's representation of the SymbolTable object."""
+        return "<SYMBOL TABLE: NAMES={}>".format(len(self.names))
+
+    def intern(self, name):
+        """Return the stored copy of 'name', adding it to the table if necessary."""
+        try:
+            return self.names[self._ids[name]]
+        except KeyError:
+            self._ids[name] = len(self.names)
+            self.names.append(name)
+            return name
+
+    def id(self, name):
+        """Return the ID of 'name', adding it to the table if necessary."""
+        try:
+            return self._ids[name]
+        except KeyError:
+            self._ids[name] = len(self.names)
+            self.names.append(name)
+            return self._ids[name]
 
 
 class Thread(object):
@@ -128,12 +610,69 @@ class Thread(object):
           of messages in the thread as Message objects.
         - When initialising, 'people' should be a list of strings containing the
           names of the participants and 'messages' should be a list of Message
-          objects."""
+          objects.
+        - The messages are kept in date order, so date queries use binary search
+          on a list of their timestamps, made when first needed. The messages sent
+          by each person are found using an index of their positions, and the
+          number of characters and words in each message are counted, also when
+          first needed.
+        - Adding or renumbering messages changes the Thread's version, see Chat."""
+
+    _version = 0
 
     def __init__(self, people, messages):
         self.people = people
         self.people_str = ", ".join(self.people)
-        self.messages = sorted(messages)
+        self.messages = sorted(messages, key=_sort_key)
+
+    def __getstate__(self):
+        """Return the attributes to pickle, leaving out the list of timestamps, index of authors and text counts."""
+        state = self.__dict__.copy()
+        state.pop("_date_index", None)
+        state.pop("_author_index", None)
+        state.pop("_text_stats", None)
+        return state
+
+    def _get_date_index(self):
+        """Return the list of messages and a list of their timestamps, in order.
+
+           The timestamps are found again if the messages list has been replaced
+           or has changed length."""
+        messages = self.messages
+        index = getattr(self, "_date_index", None)
+        if ((index is None) or (index[0] is not messages) or (len(index[1]) != len(messages))):
+            index = (messages, [message.date_time for message in messages])
+            self._date_index = index
+        return index
+
+    def _get_author_index(self):
+        """Return the list of messages and a dictionary of the positions of each author's messages in it.
+
+           The index is made again if the messages list has been replaced or has
+           changed length."""
+        messages = self.messages
+        index = getattr(self, "_author_index", None)
+        if ((index is None) or (index[0] is not messages) or (index[2] != len(messages))):
+            index = (messages, _author_positions(messages), len(messages))
+            self._author_index = index
+        return index[:2]
+
+    def _get_text_stats(self):
+        """Return the number of characters and words in each message, and the totals sent by each author.
+
+           Returns an array of the number of characters in each message, an array
+           of the number of words, and a dictionary of the [messages, characters,
+           words] sent by each author. The counts are made the first time they are
+           needed, and made again if the messages list has been replaced or has
+           changed length."""
+        messages = self.messages
+        stats = getattr(self, "_text_stats", None)
+        if ((stats is None) or (stats[0] is not messages) or (stats[1] != len(messages))):
+            chars, words = _text_counts(messages)
+            totals = _author_totals((message.author for message in messages), chars, words)
+            stats = (messages, len(messages), chars, words, totals)
+            self._text_stats = stats
+        return stats[2:]
 
     def __getitem__(self, key):
         """Allow accessing Message objects in the messages list using Thread[n].
@@ -147,7 +686,7 @@ class Thread(object):
 
     def __repr__(self):
         """Set Python's representation of the Thread object."""
-        return '<THREAD: PEOPLE={}, MESSAGE_COUNT={}>'.format(self.people_str, len(self.messages))
+        return '<THREAD: PEOPLE={}, MESSAGE_COUNT={}>'.format(self.people_str, len(self))
 
     def __len__(self):
         """Return the total number of messages in the thread."""
@@ -156,9 +695,12 @@ class Thread(object):
     def _add_messages(self, new_messages):
         """Allow adding messages to an already created Thread object.
 
-           This function is useful for merging duplicate threads together."""
-        self.messages.extend(new_messages)
-        self.messages = sorted(self.messages)
+           This function is useful for merging duplicate threads together. The
+           existing messages are already sorted, so the new messages are sorted
+           and then merged in."""
+        self.messages = list(_merge_messages([self.messages, sorted(new_messages, key=_sort_key)]))
+        self._author_index = None
+        self._version = next(_VERSIONS)
 
     def _renumber_messages(self):
         """Renumber all messages in the 'messages' list.
@@ -170,26 +712,32 @@ class Thread(object):
         for message in self.messages:
             message._num = i
             i += 1
+        self._version = next(_VERSIONS)
 
     def by(self, name):
         """Return a date ordered list of all messages sent by 'name'.
 
            Returns a list of Message objects."""
-        return [message for message in self.messages if message.sent_by(name)]
+        messages, authors = self._get_author_index()
+        positions = authors.get(name, [])
+        return [messages[i] for i in itertools.islice(positions, bisect.bisect_left(positions, len(self)))]
 
     def sent_before(self, date):
         """Return a date ordered list of all messages sent before specified date.
 
            The function returns a list of Message objects. The 'date' can be a
            datetime.datetime object, or a three or five tuple (YYYY, MM, DD[, HH, MM])."""
-        return [message for message in self.messages if message.sent_before(date)]
+        messages, dates = self._get_date_index()
+        return messages[:bisect.bisect_left(dates, _parse_date(date), 0, len(self))]
 
     def sent_after(self, date):
         """Return a date ordered list of all messages sent after specified date.
 
            The list returned is a list of Message objects. The 'date' can be a
            datetime.datetime object, or a three or five tuple (YYYY, MM, DD[, HH, MM])."""
-        return [message for message in self.messages if message.sent_after(date)]
+        messages, dates = self._get_date_index()
+        end = len(self)
+        return messages[bisect.bisect_right(dates, _parse_date(date), 0, end):end]
 
     def sent_between(self, start, end=None):
         """Return a date ordered list of all messages sent between specified dates.
@@ -200,7 +748,10 @@ class Thread(object):
             - Not entering an 'end' date is interpreted as all messages sent on
               the day 'start'. Where a time is specified also, a 24 hour period
               beginning at 'start' is used."""
-        return [message for message in self.messages if message.sent_between(start, end)]
+        start, end = _parse_between(start, end)
+        messages, dates = self._get_date_index()
+        count = len(self)
+        return messages[bisect.bisect_left(dates, start, 0, count):bisect.bisect_right(dates, end, 0, count)]
 
     def search(self, string, ignore_case=False):
         """Return a date ordered list of messages in Thread containing 'string'.
@@ -209,16 +760,116 @@ class Thread(object):
            objects.
             - The function can be made case-insensitive by setting 'ignore_case'
               to True."""
-        return sorted([message for message in self.messages if message.contains(string, ignore_case)])
+        return [message for message in self.messages if message.contains(string, ignore_case)]
 
     def on(self, date):
         """Return the Thread object as it would have been on 'date'.
 
-           The Thread object returned is a new object containing the subset of the
-           messages sent before 'date'.
+           The object returned is a ThreadView of the subset of the messages sent
+           before 'date', sharing them with this Thread rather than copying them.
            - 'date' can be a datetime.datetime object, or a three or five tuple
               (YYYY, MM, DD[, HH, MM])."""
-        return Thread(self.people, self.sent_before(date))
+        dates = self._get_date_index()[1]
+        return ThreadView(self, bisect.bisect_left(dates, _parse_date(date), 0, len(self)))
+
+
+class _MessagePrefix(collections.Sequence):
+    """A read-only sequence of the first 'count' messages of a list, sharing the list rather than copying it.
+
+       Supports len(), iteration, indexing and slicing as the list would, and
+       compares equal to a list of the same messages."""
+
+    __slots__ = ["_messages", "_count"]
+
+    def __init__(self, messages, count):
+        self._messages = messages
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return itertools.islice(self._messages, self._count)
+
+    def __getitem__(self, key):
+        if type(key) is slice:
+            return [self._messages[i] for i in xrange(*key.indices(self._count))]
+        if not (-self._count <= key < self._count):
+            raise IndexError("list index out of range")
+        return self._messages[key % self._count]
+
+    def __eq__(self, other):
+        return list(self) == list(other) if isinstance(other, (list, collections.Sequence)) else NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class ThreadView(Thread):
+    """A read-only view of the first messages of a Thread object.
+
+        - Made using Thread.on(date). Behaves like a Thread containing only the
+          messages sent before the date.
+        - Shares the list of messages and the indexes of the Thread it was made
+          from, and stores only the number of messages in the view: 'messages' is
+          a sequence of the first messages of that list, not a copy. The Thread
+          should not have messages added to it while its views are in use.
+        - Pickles as an ordinary Thread object."""
+
+    def __init__(self, thread, count):
+        if isinstance(thread, ThreadView):
+            thread = thread._thread  # Views of views share the original Thread's messages too
+        self.people = thread.people
+        self.people_str = thread.people_str
+        self._thread = thread
+        self._count = count
+
+    @property
+    def messages(self):
+        """The messages in the view, as a sequence sharing the list of the Thread it was made from."""
+        return _MessagePrefix(self._thread.messages, self._count)
+
+    def __reduce__(self):
+        return (Thread, (self.people, list(self.messages)))
+
+    def __getitem__(self, key):
+        """Allow accessing Message objects in the messages list using Thread[n]."""
+        if type(key) is int:
+            if not (-self._count <= key < self._count):
+                raise IndexError("list index out of range")
+            return self._thread[key % self._count]
+        return self.messages[key]
+
+    def __len__(self):
+        """Return the total number of messages in the view."""
+        return self._count
+
+    @property
+    def _version(self):
+        return self._thread._version
+
+    def _get_date_index(self):
+        return self._thread._get_date_index()
+
+    def _get_author_index(self):
+        return self._thread._get_author_index()
+
+    def _get_text_stats(self):
+        """Return the counts of characters and words of the messages in the view, and the totals for each author.
+
+           The counts of each message are those of the Thread the view was made
+           from; the totals are added up again for the messages in the view."""
+        chars, words, _ = self._thread._get_text_stats()
+        chars, words = chars[:self._count], words[:self._count]
+        authors = (message.author for message in self.messages)
+        return chars, words, _author_totals(authors, chars, words)
+
+    def _add_messages(self, new_messages):
+        raise TypeError("Messages cannot be added to a ThreadView; add them to the Thread it was made from.")
 
 
 class Message(object):
@@ -229,14 +880,55 @@ class Message(object):
         - When initialising, thread_name' should be the containing Thread.people_str,
           'author' should be string containing the message sender's name, 'date_time'
           should be a datetime.datetime object, 'text' should be the content of
-          the message and 'num' should be the number of the message in the thread."""
+          the message and 'num' should be the number of the message in the thread.
+        - Messages use __slots__ rather than a __dict__ to save memory, since there
+          may be millions of them. They pickle as a dictionary of their attributes,
+          as they did before, so older pickle files can still be loaded. The text
+          of messages from older pickle files is unescaped when loaded.
+        - Each Message has a 'sort_key' of (date_time, num), made when it is created
+          and updated when its number changes. Sort messages using this key, as in
+          sorted(messages, key=operator.attrgetter("sort_key")): it gives the same
+          order as comparing Messages, much faster. The 'date_time' should not be
+          changed after the Message is created."""
+
+    __slots__ = ["thread_name", "author", "date_time", "text", "_number", "sort_key"]
 
     def __init__(self, thread, author, date_time, text, num):
         self.thread_name = thread
         self.author = author
         self.date_time = date_time
         self.text = text
-        self._num = num
+        self._number = num
+        self.sort_key = (date_time, num)
+
+    @property
+    def _num(self):
+        return self._number
+
+    @_num.setter
+    def _num(self, num):
+        self._number = num
+        self.sort_key = (self.date_time, num)
+
+    def __getstate__(self):
+        """Return the attributes of the Message as a dictionary, for pickling."""
+        return {"thread_name": self.thread_name, "author": self.author, "date_time": self.date_time,
+                "text": self.text, "_num": self._number, "escaped": False}
+
+    def __setstate__(self, state):
+        """Restore the attributes of the Message from a dictionary when unpickling.
+
+           Older versions stored the text with newlines replaced by '<|NEWLINE|>'
+           and quote marks doubled, and pickled no 'escaped' flag: their text is
+           changed back, so that lengths and counts of words are right."""
+        self.thread_name = state["thread_name"]
+        self.author = state["author"]
+        self.date_time = state["date_time"]
+        text = state["text"]
+        if state.get("escaped", True):
+            text = text.replace(_NEWLINE, "\n").replace('""', '"')
+        self.text = text
+        self._num = state["_num"]
 
     def __repr__(self):
         """Set Python's representation of the Message object."""
@@ -244,8 +936,12 @@ class Message(object):
             format(self.thread_name, self._num, self.date_time, self.author, self.text)
 
     def __str__(self):
-        """Return a string form of a Message in format required for csv output."""
-        out = '"' + self.thread_name + '","' + str(self._num) + '","' + self.author + '","' + str(self.date_time) + '","' + self.text + '"\n'
+        """Return a string form of a Message in format required for csv output.
+
+           Newlines in the message are replaced by '<|NEWLINE|>' and quote marks
+           are doubled, so the message is on one line of the csv file."""
+        text = _NEWLINE.join(self.text.splitlines()).replace('"', '""')
+        out = '"' + self.thread_name + '","' + str(self._num) + '","' + self.author + '","' + str(self.date_time) + '","' + text + '"\n'
         return out
 
     def __lt__(self, message):
@@ -254,13 +950,9 @@ class Message(object):
            Sorting is by date, unless two messages were sent at the same time,
            in which case message number is used to resolve conflicts. This number
            ordering holds fine for messages in single threads, but offers no real
-           objective order outside a thread."""
-        if self.date_time == message.date_time:
-            if abs(self._num - message._num) > 9000:    # If dates equal, but numbers miles apart
-                return False  # MUST be where two 10000 groups join: larger number actually smaller here!
-            else:
-                return self._num < message._num
-        return self.sent_before(message.date_time)
+           objective order outside a thread. Threads split by Facebook are merged
+           and renumbered by the parser, so numbers are consistent in a Thread."""
+        return (self.date_time, self._num) < (message.date_time, message._num)
 
     def __gt__(self, message):
         """Allow sorting of messages by implementing the greater than operator.
@@ -268,13 +960,9 @@ class Message(object):
            Sorting is by date, unless two messages were sent at the same time,
            in which case message number is used to resolve conflicts. This number
            ordering holds fine for messages in single threads, but offers no real
-           objective order outside a thread."""
-        if self.date_time == message.date_time:
-            if abs(self._num - message._num) > 9000:    # If dates equal, but numbers miles apart
-                return True  # MUST be where two 10000 groups join: smaller number actually larger here!
-            else:
-                return self._num > message._num
-        return self.sent_after(message.date_time)
+           objective order outside a thread. Threads split by Facebook are merged
+           and renumbered by the parser, so numbers are consistent in a Thread."""
+        return (self.date_time, self._num) > (message.date_time, message._num)
 
     def __eq__(self, message):
         """Messages are equal if their number, date, author and text are the same."""
@@ -284,9 +972,7 @@ class Message(object):
 
     def __len__(self):
         """Return the number of characters in the message body."""
-        text = self.text.replace("<|NEWLINE|>", "")  # Undo adding extra characters
-        text = text.replace('""', '"')  # And escaping quote marks
-        return len(text)
+        return len(self.text)
 
     def _date_parse(self, date):
         """Allow dates to be entered as integer tuples (YYYY, MM, DD[, HH, MM]).
@@ -0,0 +1,128 @@
+import json
+import fb_chat
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None  # Parquet files need pyarrow, which is optional
+
+# The columns of a Parquet file, one row per message. Threads are numbered
+# in the order of Chat.threads, and their messages stored in order:
+_COLUMNS = ["thread_id", "thread", "num", "author", "date_time", "text"]
+_DICTIONARY_COLUMNS = ["thread", "author"]
+_METADATA_KEY = "fb_chat"
+_PARQUET_VERSION = 1
+
+
+def _check_pyarrow():
+    if pyarrow is None:
+        raise ImportError("Reading and writing Parquet files needs the 'pyarrow' module.")
+
+
+def _schema():
+    return pyarrow.schema([("thread_id", pyarrow.int32()), ("thread", pyarrow.string()), ("num", pyarrow.int32()),
+                           ("author", pyarrow.string()), ("date_time", pyarrow.timestamp("us")),
+                           ("text", pyarrow.string())])
+
+
+def _row_group(schema, messages, thread_ids):
+    """Return a pyarrow Table of the Message objects in 'messages'."""
+    columns = [pyarrow.array(thread_ids, pyarrow.int32()),
+               pyarrow.array([m.thread_name for m in messages], pyarrow.string()),
+               pyarrow.array([m._num for m in messages], pyarrow.int32()),
+               pyarrow.array([m.author for m in messages], pyarrow.string()),
+               pyarrow.array([m.date_time for m in messages], pyarrow.timestamp("us")),
+               pyarrow.array([m.text for m in messages], pyarrow.string())]
+    return pyarrow.Table.from_arrays(columns, schema=schema)
+
+
+def write_parquet(chat, filename, row_group_size=100000):
+    """Write the messages in the fb_chat.Chat object 'chat' to a Parquet file.
+
+        - The file has one row per message, with the columns 'thread_id' (the
+          position of the Thread in Chat.threads), 'thread', 'num', 'author',
+          'date_time' and 'text'. The 'thread' and 'author' columns are dictionary
+          encoded. Message bodies are stored exactly as in the Message objects.
+        - Messages are written in Thread order, in row groups of 'row_group_size'
+          messages, without first collecting all of them.
+        - The people in each Thread and the Chat owner are stored in the file's
+          metadata, so that read_parquet() can rebuild the Chat object."""
+    _check_pyarrow()
+    metadata = {"version": _PARQUET_VERSION, "myname": chat._myname,
+                "threads": [[thread.people, len(thread)] for thread in chat.threads]}
+    schema = _schema().with_metadata({_METADATA_KEY: json.dumps(metadata)})
+    writer = parquet.ParquetWriter(filename, schema, use_dictionary=_DICTIONARY_COLUMNS)
+    try:
+        messages = []
+        thread_ids = []
+        for thread_id, thread in enumerate(chat.threads):
+            for message in thread.messages:
+                messages.append(message)
+                thread_ids.append(thread_id)
+                if len(messages) >= row_group_size:
+                    writer.write_table(_row_group(schema, messages, thread_ids))
+                    messages = []
+                    thread_ids = []
+        if messages:
+            writer.write_table(_row_group(schema, messages, thread_ids))
+    finally:
+        writer.close()
+
+
+def read_parquet_batches(filename, columns=None):
+    """Yield the messages in a Parquet file written by write_parquet(), one row group at a time.
+
+       Each row group is returned as a pyarrow Table. If 'columns' is a list of
+       column names, only those columns are read from the file."""
+    _check_pyarrow()
+    parquet_file = parquet.ParquetFile(filename)
+    for i in xrange(parquet_file.num_row_groups):
+        yield parquet_file.read_row_group(i, columns=columns)
+
+
+def _chunks(column):
+    return column.chunks if hasattr(column, "chunks") else column.data.chunks
+
+
+def _values(column):
+    """Return a list of the numbers or timestamps in a column, converting using NumPy for speed."""
+    values = []
+    for chunk in _chunks(column):
+        values.extend(chunk.to_numpy().tolist())
+    return values
+
+
+def _names(column, symbols):
+    """Return a list of the strings in a dictionary encoded column, as byte strings stored in the SymbolTable 'symbols'."""
+    names = []
+    for chunk in _chunks(column):
+        dictionary = [symbols.intern(name.encode("utf8")) for name in chunk.dictionary.to_pylist()]
+        names.extend([dictionary[i] for i in chunk.indices.to_pylist()])
+    return names
+
+
+def read_parquet(filename):
+    """Read a Parquet file written by write_parquet() and return the Chat object."""
+    _check_pyarrow()
+    parquet_file = parquet.ParquetFile(filename)
+    metadata = json.loads(parquet_file.schema.to_arrow_schema().metadata[_METADATA_KEY])
+    if metadata["version"] != _PARQUET_VERSION:
+        raise ValueError("{} is a Parquet file of an unsupported version.".format(filename))
+    table = parquet.read_table(filename, columns=_COLUMNS[1:], read_dictionary=_DICTIONARY_COLUMNS)
+    symbols = fb_chat.SymbolTable()
+    thread_names = _names(table.column("thread"), symbols)
+    authors = _names(table.column("author"), symbols)
+    nums = _values(table.column("num"))
+    date_times = _values(table.column("date_time"))
+    texts = table.column("text").to_pylist()
+    threads = []
+    start = 0
+    for people, count in metadata["threads"]:
+        people = [symbols.intern(person.encode("utf8")) for person in people]
+        messages = [fb_chat.Message(thread_names[i], authors[i], date_times[i], texts[i], nums[i])
+                    for i in xrange(start, start + count)]
+        thread = fb_chat.Thread(people, [])
+        thread.messages = messages  # Already in order, so no need to sort
+        threads.append(thread)
+        start += count
+    return fb_chat.Chat(metadata["myname"].encode("utf8"), threads, symbols)
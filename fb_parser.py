@@ -1,10 +1,321 @@
 import datetime
-import dateutil
+import dateutil.parser
+import heapq
+import re
 import sys
+import csv
+import json
+import itertools
+from cStringIO import StringIO
 from bs4 import BeautifulSoup as bs
+from lxml import etree
 import zipfile
-import pickle
+import cPickle as pickle
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import fb_cache
 import fb_chat
+import fb_profile
+import fb_parquet
+import fb_search
+import fb_snapshot
+import fb_sqlite
+
+
+def _element_string(element):
+    """Return the text of an lxml element as BeautifulSoup's Tag.string would.
+
+       The text is only returned if the element has exactly one child node; if
+       that child is itself an element, its string is returned instead."""
+    if element is None:
+        return None
+    children = list(element)
+    if element.text:
+        return unicode(element.text) if len(children) == 0 else None
+    if ((len(children) != 1) or children[0].tail):
+        return None
+    if children[0].tag is etree.Comment:
+        return unicode(children[0].text or "")
+    return _element_string(children[0])
+
+
+def _next_sibling_string(element):
+    """Return the string of the node following an lxml element, as BeautifulSoup would."""
+    if element.tail:
+        return unicode(element.tail)
+    return _element_string(element.getnext())
+
+
+def _thread_element_messages(element):
+    """Return a list of raw (author, date, body) strings from a 'div.thread' lxml element."""
+    message_list = []
+    for m in element.iterchildren('div'):
+        if m.get('class') != 'message':
+            continue
+        user = m.find(".//*[@class='user']")
+        meta = m.find(".//*[@class='meta']")
+        message_list.append((_element_string(user), _element_string(meta), _next_sibling_string(m)))
+    return message_list
+
+
+# ====== Timestamp parsing:
+
+_MONTHS = {"january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6, "july": 7,
+           "august": 8, "september": 9, "october": 10, "november": 11, "december": 12,
+           "jan": 1, "feb": 2, "mar": 3, "apr": 4, "jun": 6, "jul": 7, "aug": 8, "sep": 9,
+           "sept": 9, "oct": 10, "nov": 11, "dec": 12}
+_WEEKDAYS = frozenset(["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+                       "mon", "tue", "wed", "thu", "fri", "sat", "sun"])
+# Timezone names which appear in exports. The timezone is discarded (see _message_date_parse),
+# so these only need recognising; names with an offset, like 'UTC+01', must be UTC or GMT:
+_TIMEZONES = frozenset(["UTC", "GMT", "BST", "IST", "WET", "WEST", "CET", "CEST", "EET", "EEST", "MSK",
+                        "HST", "AKST", "AKDT", "PST", "PDT", "MST", "MDT", "CST", "CDT", "EST", "EDT",
+                        "AST", "ADT", "NST", "NDT", "AEST", "AEDT", "ACST", "ACDT", "AWST", "NZST", "NZDT"])
+_TIME_TZ = r' at (?P<hour>\d{1,2}):(?P<minute>\d{2})(?P<ampm>am|pm)?(?: (?P<tz>[A-Z]+)(?P<offset>[+-]\d{1,2}(?::?\d{2})?)?)?$'
+_TIMESTAMP_FORMATS = [
+    # 'Tuesday, 5 January 2016 at 18:04 UTC+01'
+    re.compile(r'(?P<weekday>[A-Za-z]+), (?P<day>\d{1,2}) (?P<month>[A-Za-z]+) (?P<year>\d{4})' + _TIME_TZ),
+    # 'Tuesday, January 5, 2016 at 6:04pm PST'
+    re.compile(r'(?P<weekday>[A-Za-z]+), (?P<month>[A-Za-z]+) (?P<day>\d{1,2}), (?P<year>\d{4})' + _TIME_TZ)]
+_TIMESTAMP_MEMO = fb_cache.LRUCache(8192)
+
+
+def _match_timestamp(datestr):
+    """Parse a timestamp in one of the fixed formats used by Facebook exports.
+
+       Returns a naive datetime.datetime object, or None if the string is not in
+       a recognised format and so needs parsing by dateutil instead."""
+    for timestamp_format in _TIMESTAMP_FORMATS:
+        match = timestamp_format.match(datestr)
+        if match is not None:
+            break
+    else:
+        return None
+    weekday, day, month, year, hour, minute, ampm, tz, offset = match.group('weekday', 'day', 'month', 'year', 'hour',
+                                                                            'minute', 'ampm', 'tz', 'offset')
+    month = _MONTHS.get(month.lower())
+    if ((month is None) or (weekday.lower() not in _WEEKDAYS)):
+        return None
+    if ((tz is not None) and ((tz not in _TIMEZONES) or ((offset is not None) and (tz not in ("UTC", "GMT"))))):
+        return None
+    hour = int(hour)
+    if ampm is not None:
+        if not (1 <= hour <= 12):
+            return None
+        hour = hour % 12 + (12 if ampm == "pm" else 0)
+    try:
+        return datetime.datetime(int(year), month, int(day), hour, int(minute))
+    except ValueError:
+        return None
+
+
+def _parse_timestamp(datestr):
+    """Turn the datestamp on a message into a naive datetime object.
+
+       Exports use only a few fixed formats, so these are matched directly and
+       dateutil is only used for strings which are not recognised. Since many
+       messages share a timestamp, results are memoized in a bounded LRU cache."""
+    date = _TIMESTAMP_MEMO.get(datestr)
+    if date is None:
+        date = _match_timestamp(datestr)
+        if date is None:
+            date = dateutil.parser.parse(datestr).replace(tzinfo=None)
+        _TIMESTAMP_MEMO[datestr] = date
+    return date
+
+
+# ====== Exporting to csv:
+
+_CSV_HEADER = ["Thread", "Message Number", "Message Author", "Message Timestamp", "Message Body"]
+_CSV_BUFFER_SIZE = 2**20
+
+
+def _utf8(string):
+    if type(string) is unicode:
+        return string.encode('utf8')
+    return string
+
+
+def _message_fields(message):
+    """Return the (thread name, number, author, timestamp, text) of 'message'."""
+    return (message.thread_name, message._num, message.author, message.date_time, message.text)
+
+
+def _csv_row(fields, escape_newlines=False):
+    """Return the csv file row for the _message_fields() 'fields' as UTF-8 strings."""
+    thread_name, num, author, date_time, text = fields
+    if escape_newlines:
+        text = fb_chat._NEWLINE.join(text.splitlines())  # As older versions stored messages
+    return [_utf8(thread_name), str(num), _utf8(author), str(date_time), _utf8(text)]
+
+
+def _jsonl_row(fields):
+    """Return the JSON Lines file line for the _message_fields() 'fields'."""
+    thread_name, num, author, date_time, text = fields
+    row = {"thread": thread_name, "message_number": num, "author": author, "timestamp": date_time.isoformat(),
+           "body": text}
+    return json.dumps(row, ensure_ascii=False, sort_keys=True).encode('utf8') + "\n"
+
+
+# ====== Partitioned export:
+
+_PARTITION_MANIFEST = "manifest.json"
+_PARTITION_MANIFEST_VERSION = 1
+_PARTITION_TYPES = ["thread", "month", "thread_month"]
+_PARTITION_FORMATS = ["csv", "jsonl"]
+
+
+def _partition_name(thread_name=None, month=None):
+    """Return the file name, without extension, of the partition for a thread and/or month.
+
+       Thread names are shortened to safe characters, with part of a hash of the
+       full name added so that different threads never share a file."""
+    parts = []
+    if thread_name is not None:
+        safe_name = re.sub(r'[^\w.-]+', '_', thread_name)[:48]
+        parts.append(safe_name + "-" + hashlib.sha1(_utf8(thread_name)).hexdigest()[:8])
+    if month is not None:
+        parts.append("{:04d}-{:02d}".format(*month))
+    return "_".join(parts)
+
+
+def _month(fields):
+    return (fields[3].year, fields[3].month)
+
+
+def _render_partition(rows, file_format, escape_newlines):
+    """Return the contents of a partition file containing the _message_fields() 'rows'."""
+    buffer = StringIO()
+    if file_format == "jsonl":
+        buffer.writelines(_jsonl_row(fields) for fields in rows)
+    else:
+        writer = csv.writer(buffer, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        writer.writerow(_CSV_HEADER)
+        writer.writerows(_csv_row(fields, escape_newlines) for fields in rows)
+    return buffer.getvalue()
+
+
+def _write_partition(args):
+    """Write one partition file, unless it is unchanged since the last export.
+
+       Returns the manifest entry for the partition and whether the file was written.
+       Called in a worker process when exporting in parallel."""
+    directory, filename, rows, file_format, escape_newlines, previous = args
+    contents = _render_partition(rows, file_format, escape_newlines)
+    entry = {"file": filename, "rows": len(rows), "bytes": len(contents),
+             "sha1": hashlib.sha1(contents).hexdigest(),
+             "first_timestamp": rows[0][3].isoformat(), "last_timestamp": rows[-1][3].isoformat()}
+    path = os.path.join(directory, filename)
+    if ((previous == entry) and os.path.isfile(path) and (os.path.getsize(path) == entry["bytes"])):
+        return entry, False
+    with open(path, "wb") as f:
+        f.write(contents)
+    return entry, True
+
+
+# ====== Parallel parsing:
+
+_THREAD_MARKER = '<div class="thread">'
+_MANIFEST_VERSION = 2
+_WORKER_PARSER = None
+
+
+def _thread_offsets(f, chunk_size=2**20):
+    """Return the byte offsets of every 'div.thread' opening tag in file 'f'.
+
+       The file is read through once in chunks, overlapping each chunk slightly
+       so that markers falling across a chunk boundary are not missed."""
+    offsets = []
+    overlap = len(_THREAD_MARKER) - 1
+    position = 0
+    tail = ""
+    f.seek(0)
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        data = tail + chunk
+        start = position - len(tail)
+        i = data.find(_THREAD_MARKER)
+        while i != -1:
+            offsets.append(start + i)
+            i = data.find(_THREAD_MARKER, i + 1)
+        tail = data[-overlap:]
+        position += len(chunk)
+    return offsets
+
+
+def _init_worker(parser_class, parser_state):
+    """Create the FBMessageParse object used by a worker process to parse threads."""
+    global _WORKER_PARSER
+    _WORKER_PARSER = parser_class.__new__(parser_class)
+    _WORKER_PARSER.__dict__.update(parser_state)
+
+
+def _read_thread_range(fname, start, end):
+    """Read the single thread found in a byte range of the htm file.
+
+       Returns the raw (thread name, message list) pair, as _soup_threads() does."""
+    with open(fname, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    root = etree.fromstring(data, etree.HTMLParser(encoding='utf-8'))
+    element = root.find(".//div[@class='thread']")
+    return element.text, _thread_element_messages(element)
+
+
+def _parse_thread_range(args):
+    """Parse the single thread found in a byte range of the htm file.
+
+       Run in a worker process: returns the parsed thread as a (thread name,
+       message list, unknown UIDs) tuple, to be combined into the Chat object by
+       the parent process."""
+    _WORKER_PARSER._UNKNOWNS = set()
+    thread_name, message_list = _WORKER_PARSER._parse_thread(*_read_thread_range(*args))
+    return thread_name, message_list, _WORKER_PARSER._UNKNOWNS
+
+
+class _ThreadBuilder(object):
+    """Collect together the parts of a Thread as they are read from the htm file.
+
+       Facebook splits threads over 10,000 messages long into several 'div.thread'
+       blocks with the same participants. Each block is kept as a separate segment,
+       and the segments are only merged once all have been read in."""
+
+    def __init__(self, thread_name):
+        self.thread_name = thread_name
+        self.segments = []
+
+    def add_segment(self, messages):
+        """Add a list of Message objects read in from one 'div.thread' block."""
+        self.segments.append(messages)
+
+    def build(self):
+        """Create the Thread object, merging and renumbering segments if necessary.
+
+           Each segment is already in order, so the segments are merged in linear
+           time. Segments are ranked by when they start, so that messages with equal
+           timestamps at the boundary of two segments stay in the right order, and
+           the merged messages are renumbered from 1 in a single pass."""
+        people = self.thread_name.split(", ")
+        if len(self.segments) == 1:
+            return fb_chat.Thread(people, self.segments[0])
+        segments = [sorted(segment, key=fb_chat._sort_key) for segment in self.segments if len(segment) > 0]
+        segments.sort(key=lambda segment: (segment[0].date_time, segment[-1].date_time))
+        decorated = [[(m.date_time, rank, m._num, m) for m in segment] for rank, segment in enumerate(segments)]
+        messages = []
+        for num, (_, _, _, message) in enumerate(heapq.merge(*decorated), 1):
+            message._num = num
+            messages.append(message)
+        return fb_chat.Thread(people, messages)
+
+
+def _search_index_filename(snapshot_filename):
+    """Return the name of the search index file saved with a snapshot file."""
+    return os.path.splitext(snapshot_filename)[0] + ".search"
 
 
 class FBMessageParse(object):
@@ -16,7 +327,19 @@ class FBMessageParse(object):
           the .htm file contained in the archive.
         - Can dump the Chat object to a pickle file and load it again in another
           session: use dump_to_pickle() and load_from_pickle().
-        - Can export messages to csv format: use write_to_csv()
+        - Can also save the Chat object as a snapshot file, which loads almost
+          instantly: use dump_to_snapshot() and load_from_snapshot(). An index of
+          the words in the messages, for Chat.search(), is saved alongside it. Or save
+          each Thread to a separate file, to be read only when used: use
+          dump_to_sharded_snapshot() and load_from_sharded_snapshot().
+        - Can write the Chat object to a SQLite database, and use the messages
+          from it without loading them into memory: use dump_to_database() and
+          load_from_database().
+        - Can export messages to csv format: use write_to_csv(). Or export to a
+          directory of csv or JSON Lines files, one per thread and/or month, using
+          write_partitions().
+        - Can export messages to a Parquet file and read them back, if the pyarrow
+          module is installed: use write_to_parquet() and load_from_parquet().
         - Using a 'uid_people' file, can turn unrecognised nnnnnnn@facebook.com identifiers
           into names. Lines should be '[uid]:[name]'. See the print_unknowns() function.
         - Allows customised renaming of contacts using a 'duplicates' file. In a similar
@@ -27,16 +350,22 @@ class FBMessageParse(object):
     _MYNAME = "My Name"
     _MYUSERNAME = "myusername"
 
-    def __init__(self, fname, load_pickle=False):
+    def __init__(self, fname, load_pickle=False, load_snapshot=False, load_database=False, load_shards=False,
+                 load_parquet=False):
         self._UIDPEOPLE = {}
         self._PEOPLEUID = {}
         self._PEOPLEDUPLICATES = {}
-        self._UNKNOWNS = []
+        self._UNKNOWNS = set()
+        self._AUTHORS = {}
+        self._symbols = fb_chat.SymbolTable()
         #
         self.Chat = None
         #
+        self._fname = fname
         self._archive = None
         self._messages_htm = None
+        self._extracted_htm = None
+        self._thread_total = None
         # Open either the .zip and contained htm, the pickle file, or another file:
         if ".zip" in fname:
             self._archive = zipfile.ZipFile(fname, 'r')
@@ -44,6 +373,14 @@ class FBMessageParse(object):
             self._messages_htm = self._archive.open('html/messages.htm')
         elif load_pickle or ".pickle" in fname:
             self.load_from_pickle(fname)
+        elif load_snapshot or ".snapshot" in fname:
+            self.load_from_snapshot(fname)
+        elif load_database or ".sqlite" in fname:
+            self.load_from_database(fname)
+        elif load_shards or ".shards" in fname:
+            self.load_from_sharded_snapshot(fname)
+        elif load_parquet or ".parquet" in fname:
+            self.load_from_parquet(fname)
         else:
             self._messages_htm = open(fname, "r")
         #
@@ -57,6 +394,9 @@ class FBMessageParse(object):
             self._archive.close()
         if self._messages_htm is not None:
             self._messages_htm.close()
+        if self._extracted_htm is not None:
+            os.remove(self._extracted_htm)
+            self._extracted_htm = None
 
     def __del__(self):
         """Ensure _close() is called on deletion."""
@@ -117,25 +457,38 @@ class FBMessageParse(object):
             namelist[i] = self._message_author_parse(name)
         if ((self._MYNAME in namelist) and (len(namelist) > 1)):  # You can send yourself messages, so don't delete name if it's the only one.
             namelist.remove(self._MYNAME)                         # Otherwise remove your name from the list.
-        return ", ".join(namelist)
+        return self._symbols.intern(", ".join(namelist))
 
     def _message_author_parse(self, name):
         """Tidy up the name of the sender of a message.
 
            If the name is a UID email address, use the UID dictionary to replace
            their name if possible. If the name is a duplicate (or to be renamed)
-           then rename. Any UIDs which remain are added to a list to facilitate
-           populating a 'uid_people' file: see print_unknowns()."""
+           then rename. Any UIDs which remain are added to a set to facilitate
+           populating a 'uid_people' file: see print_unknowns().
+            - A chat has only a few hundred distinct authors, so each raw name is
+              only tidied up once, and the result stored in the _AUTHORS dictionary.
+              The tidied name is stored in the parser's SymbolTable, which becomes
+              that of the Chat object made by parse_messages()."""
         if name is None:
             return "UNKNOWN_AUTHOR" # Facebook has been providing messages with no recorded author!
-        name = name.encode('ascii', 'replace')  # BeutifulSoup works in Unicode, do we want ASCII names?
-        n = name.replace("@facebook.com", "")
-        if n in self._UIDPEOPLE:
-            name = self._UIDPEOPLE[n]
-        if n in self._PEOPLEDUPLICATES:
-            name = self._PEOPLEDUPLICATES[n]
-        if ((n in name) and (n != name)):  # If n is still the UID, and we still don't have a name:
-            self._UNKNOWNS.append(n)      # Add the UID to the UNKNOWN list
+        try:
+            name, unknown_uid = self._AUTHORS[name]
+        except KeyError:
+            raw_name = name
+            name = name.encode('ascii', 'replace')  # BeutifulSoup works in Unicode, do we want ASCII names?
+            n = name.replace("@facebook.com", "")
+            if n in self._UIDPEOPLE:
+                name = self._UIDPEOPLE[n]
+            if n in self._PEOPLEDUPLICATES:
+                name = self._PEOPLEDUPLICATES[n]
+            unknown_uid = None
+            if ((n in name) and (n != name)):  # If n is still the UID, and we still don't have a name:
+                unknown_uid = n
+            name = self._symbols.intern(name)
+            self._AUTHORS[raw_name] = (name, unknown_uid)
+        if unknown_uid is not None:
+            self._UNKNOWNS.add(unknown_uid)  # Add the UID to the UNKNOWN set
         return name
 
     def _message_date_parse(self, datestr):
@@ -144,8 +497,9 @@ class FBMessageParse(object):
            This will parse to a timezone aware Python timestamp and then
            remove the timezone info; converting it to local time.
            This may not be the behaviour desired, and can be changed;
-           but most other functions assume naive datetimes."""
-        return dateutil.parser.parse(datestr).replace(tzinfo=None)
+           but most other functions assume naive datetimes. The common export
+           formats are parsed without using dateutil, see _parse_timestamp()."""
+        return _parse_timestamp(datestr)
 
     def _date_unix(self, datetime_date):
         """Turn a datetime.datetime object into a UNIX time int."""
@@ -154,15 +508,13 @@ class FBMessageParse(object):
     def _message_body_parse(self, message_body):
         """Tidy up the message body itself.
 
-           This turns newline characters into a unique custom string which can
-           be replaced after export if necessary. Quote marks are also escaped,
-           to allow the use of quotes and commas in messages whilst allowing
-           export to csv. Those two lines can be removed if desired."""
+           The text is stored exactly as sent: newlines and quote marks are only
+           escaped when exporting to csv. See write_to_csv().
+            - BeautifulSoup strings keep the whole document in memory, so a plain
+              copy of the text is stored."""
         if message_body is None:
-            message_body = ""
-        message_body = '<|NEWLINE|>'.join(message_body.splitlines())  # We can't have newline characters in a csv file
-        message_body = message_body.replace('"', '""')  # Attempt to escape " characters in messages, for csv output
-        return message_body
+            return u""
+        return unicode(message_body)
 
     def print_unknowns(self):
         """Print out any UIDs of people not recognised by the code.
@@ -175,12 +527,243 @@ class FBMessageParse(object):
             return
         if len(self._UNKNOWNS) == 0:
             return
-        self._UNKNOWNS = list(set(self._UNKNOWNS))  # An unordered duplicate removal method
         print "To identify these accounts, try visiting www.facebook.com/[uid] and adding '[uid]:[name]' to a file in the current directory named 'uid_people'"
         for uid in self._UNKNOWNS:
             print uid
 
-    def parse_messages(self, group_duplicates=True):
+    def _check_header(self, actual_header):
+        """Verify that the file being parsed is a Facebook Message export.
+
+           Compares the title of the htm document with that expected for _MYNAME,
+           and allows manual override if the two do not match."""
+        check_header = self._MYNAME + " - Messages"
+        if ((actual_header is None) or (check_header != actual_header)):
+            print "The title of the htm document does not match that expected:"
+            print '"' + check_header + '"'
+            print "Is the file a message export? Is the user's name correct?"
+            cont = raw_input("Continue anyway? (y/n)")
+            if cont == "n":
+                sys.exit(-1)
+
+    def _soup_threads(self):
+        """Read the whole htm file with BeautifulSoup and yield each thread in turn.
+
+           Yields (thread name, message list) pairs, where the message list contains
+           (author, date, body) tuples of the raw strings from the htm file."""
+        with fb_profile.stage("build_soup"):
+            soup = bs(self._messages_htm, "lxml")
+        # Verify that we're parsing a Facebook Message export and _MYNAME is right:
+        try:
+            actual_header = soup.html.head.title.string
+        except AttributeError:
+            actual_header = None
+        self._check_header(actual_header)
+        timer = fb_profile.stage("find_all")
+        timer.start()
+        thread_list = soup.find_all(class_='thread')
+        self._thread_total = len(thread_list)
+        for t in thread_list:
+            message_list = [(m.find(class_='user').string, m.find(class_='meta').string, m.next_sibling.string)
+                            for m in t.find_all(class_='message')]
+            timer.stop()
+            yield t.contents[0], message_list
+            timer.start()
+        timer.stop()
+
+    def _stream_threads(self):
+        """Read the htm file one thread at a time and yield each thread in turn.
+
+           Yields the same (thread name, message list) pairs as _soup_threads(), but
+           only one 'div.thread' is parsed and held in memory at a time, so peak
+           memory depends on the largest thread rather than the size of the whole
+           export. The threads are found by scanning for their byte ranges, as
+           when parsing in several processes (see _thread_ranges()): lxml's HTML
+           parser reads most of the document before reporting the end of any
+           element, so parsing the whole file incrementally would not do this."""
+        for r in self._thread_ranges():
+            with fb_profile.stage("read_ranges"):
+                thread = _read_thread_range(*r)
+            yield thread
+
+    def _seekable_htm(self):
+        """Return the filename of a seekable copy of messages.htm.
+
+           An htm file is used directly, but when reading from a .zip archive the
+           htm file is extracted once to a temporary file, which is removed again
+           by _close()."""
+        if self._archive is None:
+            return self._fname
+        if self._extracted_htm is None:
+            fd, self._extracted_htm = tempfile.mkstemp(suffix=".htm")
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(self._archive.open('html/messages.htm'), f, 2**20)
+        return self._extracted_htm
+
+    def _config_fingerprint(self):
+        """Return a hash of the settings which affect how threads are parsed.
+
+           This is the user's name and the contents of the 'uid_people' and
+           'duplicates' files, along with the version of the parsed thread format."""
+        config = repr((_MANIFEST_VERSION, self._MYNAME, sorted(self._UIDPEOPLE.items()), sorted(self._PEOPLEDUPLICATES.items())))
+        return hashlib.sha1(config).hexdigest()
+
+    def archive_fingerprint(self):
+        """Return a hash identifying the export file being parsed and the parser settings.
+
+           Two runs on the same .zip or .htm file, with the same 'uid_people' and
+           'duplicates' files, produce the same fingerprint; so it can be used to
+           name a cached Chat object for the file. See facebook.py for an example."""
+        digest = hashlib.sha1(self._config_fingerprint())
+        with open(self._fname, "rb") as f:
+            for chunk in iter(lambda: f.read(2**20), ""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _load_manifest(self, manifest):
+        """Load the parsed threads saved in a manifest file by a previous import.
+
+           Returns a dictionary from thread fingerprint to parsed thread. If the file
+           does not exist, or was made with different settings, it is ignored."""
+        try:
+            with open(manifest, "rb") as f:
+                saved = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return {}
+        if saved.get("config") != self._config_fingerprint():
+            return {}
+        return saved["threads"]
+
+    def _thread_ranges(self):
+        """Find the byte range of each thread in the htm file.
+
+           The file is scanned once for the start of each 'div.thread', and each
+           byte range holds exactly one thread. Returns a list of (htm filename,
+           start, end) tuples in file order, after checking the title of the file
+           as the other ways of reading it do. A .zip archive is extracted to a
+           temporary file first."""
+        with fb_profile.stage("scan_threads"):
+            fname = self._seekable_htm()
+            with open(fname, "rb") as f:
+                offsets = _thread_offsets(f)
+                f.seek(0, os.SEEK_END)
+                file_end = f.tell()
+                # Verify that we're parsing a Facebook Message export and _MYNAME is right:
+                f.seek(0)
+                head = f.read(offsets[0] if len(offsets) > 0 else file_end)
+        title = etree.fromstring(head, etree.HTMLParser(encoding='utf-8')).find(".//title")
+        self._check_header(_element_string(title))
+        ranges = [(fname, start, end) for start, end in zip(offsets, offsets[1:] + [file_end])]
+        self._thread_total = len(ranges)
+        return ranges
+
+    def _range_threads(self, processes=1, manifest=None):
+        """Parse the threads of the htm file by splitting it into byte ranges.
+
+           The byte range of each thread is found by _thread_ranges(). Yields parsed
+           (thread name, message list) pairs in file order, as _parse_thread() would
+           return them.
+            - If 'processes' is more than 1, the ranges are sent to a pool of worker
+              processes to be parsed in parallel.
+            - If a 'manifest' filename is given, each range is fingerprinted by
+              hashing its bytes. Threads unchanged since the manifest was saved are
+              reused rather than parsed again, and the manifest is then updated."""
+        ranges = self._thread_ranges()
+        fname = self._seekable_htm()
+        # Fingerprint each range, and only parse those not in the manifest:
+        if manifest is not None:
+            saved_threads = self._load_manifest(manifest)
+            fingerprints = []
+            with fb_profile.stage("fingerprint"):
+                with open(fname, "rb") as f:
+                    for _, start, end in ranges:
+                        f.seek(start)
+                        fingerprints.append(hashlib.sha1(f.read(end - start)).hexdigest())
+        else:
+            saved_threads = {}
+            fingerprints = [None] * len(ranges)
+        to_parse = [r for r, fingerprint in zip(ranges, fingerprints) if fingerprint not in saved_threads]
+        fb_profile.count("threads_reused", len(ranges) - len(to_parse))
+        if processes > 1:
+            state = {"_UIDPEOPLE": self._UIDPEOPLE, "_PEOPLEUID": self._PEOPLEUID,
+                     "_PEOPLEDUPLICATES": self._PEOPLEDUPLICATES, "_MYNAME": self._MYNAME,
+                     "_AUTHORS": {}, "_symbols": fb_chat.SymbolTable(),
+                     "_archive": None, "_messages_htm": None, "_extracted_htm": None}
+            pool = multiprocessing.Pool(processes, _init_worker, (self.__class__, state))
+            chunksize = max(1, len(to_parse) // (4 * processes))
+            # Only the time spent waiting for the workers can be recorded:
+            parsed = fb_profile.timed_iter("workers", pool.imap(_parse_thread_range, to_parse, chunksize))
+        else:
+            pool = None
+            parsed = self._parse_ranges(to_parse)
+        try:
+            threads = {}
+            for fingerprint in fingerprints:
+                if fingerprint in saved_threads:
+                    thread = saved_threads[fingerprint]
+                else:
+                    thread = next(parsed)
+                if fingerprint is not None:
+                    threads[fingerprint] = thread
+                thread_name, message_list, unknowns = thread
+                self._UNKNOWNS.update(unknowns)
+                yield thread_name, message_list
+        finally:
+            if pool is not None:
+                pool.terminate()
+        if manifest is not None:
+            with open(manifest, "wb") as f:
+                pickle.dump({"config": self._config_fingerprint(), "threads": threads}, f, pickle.HIGHEST_PROTOCOL)
+
+    def _parse_ranges(self, ranges):
+        """Parse each thread from a list of byte ranges of the htm file in turn.
+
+           Yields (thread name, message list, unknown UIDs) tuples, as the worker
+           processes return them."""
+        for r in ranges:
+            with fb_profile.stage("read_ranges"):
+                raw_thread_name, raw_message_list = _read_thread_range(*r)
+            yield self._parse_thread_unknowns(raw_thread_name, raw_message_list)
+
+    def _parse_thread_unknowns(self, raw_thread_name, raw_message_list):
+        """Parse a thread as _parse_thread() does, also returning any new unknown UIDs.
+
+           The unknown UIDs are not added to _UNKNOWNS, but left for the caller to
+           add, so that parsed threads can be cached along with their UIDs."""
+        all_unknowns = self._UNKNOWNS
+        self._UNKNOWNS = set()
+        try:
+            thread_name, message_list = self._parse_thread(raw_thread_name, raw_message_list)
+            unknowns = self._UNKNOWNS
+        finally:
+            self._UNKNOWNS = all_unknowns
+        return thread_name, message_list, unknowns
+
+    def _parse_thread(self, raw_thread_name, raw_message_list):
+        """Parse the raw strings of a thread read in from the htm file.
+
+           Takes the thread's name and a list of raw (author, date, body) strings, and
+           returns the tidied thread name and a list of (author, datetime, body)
+           tuples in the same order."""
+        profile = fb_profile.current()
+        if profile is None:
+            thread_name = self._thread_name_cleanup(raw_thread_name)
+            message_list = [(self._message_author_parse(author), self._message_date_parse(date), self._message_body_parse(body))
+                            for author, date, body in raw_message_list]
+        else:  # Time each part of the parsing separately:
+            thread_name = profile.timed("thread_names", self._thread_name_cleanup, raw_thread_name)
+            message_list = [(profile.timed("authors", self._message_author_parse, author),
+                             profile.timed("dates", self._message_date_parse, date),
+                             profile.timed("bodies", self._message_body_parse, body))
+                            for author, date, body in raw_message_list]
+        return thread_name, message_list
+
+    def _htm_size(self):
+        """Return the size in bytes of the messages.htm file being parsed."""
+        if self._archive is not None:
+            return self._archive.getinfo('html/messages.htm').file_size
+        return os.path.getsize(self._fname)
+
+    def parse_messages(self, group_duplicates=True, stream=False, processes=1, manifest=None, progress=None):
         """Take the loaded zip file or htm file and create a Chat object.
 
            Takes the messages.htm file and reads in the messages using
@@ -189,92 +772,214 @@ class FBMessageParse(object):
             - Optional argument 'group_duplicates' groups together Threads containing
               the same participants. Message Threads over 10,000 messages long are
               split by Facebook for export: this can help group them. True by default.
+            - Setting 'stream' to True reads the file one thread at a time using lxml
+              rather than building the whole document in memory with BeautifulSoup.
+              The Chat object produced is identical, but peak memory use depends
+              only on the largest thread. A .zip archive is extracted to a temporary
+              file first.
+            - Setting 'processes' to more than 1 parses threads in parallel using that
+              many worker processes; None uses one process per CPU. A .zip archive is
+              extracted to a temporary file first. The Chat object produced is identical.
+            - If a 'manifest' filename is given, threads which are byte-for-byte
+              unchanged since the manifest was last saved are reused rather than
+              parsed again, and the manifest is updated with the current threads.
+              Useful when importing a new export of mostly the same messages.
+            - If a 'progress' function is given, it is called after each thread is
+              read as progress("parse_messages", threads_done, total_threads).
+            - If an fb_profile.Profile is active, the time spent in each stage of
+              parsing is recorded in it, along with counts of threads, messages,
+              unknown UIDs and bytes read. When parsing using several processes,
+              only the time spent waiting for the workers is recorded.
             - Contains code to verify that the file being examined is in fact a
               Facebook Messages export, though it allows manual override."""
         # Check we have a htm file open to import from:
         if self._messages_htm is None:
-            print "No archive/message file open. Was data loaded from a pickle file?"
+            print "No archive/message file open. Was data loaded from a pickle, snapshot, database or Parquet file?"
             return
         #
-        soup = bs(self._messages_htm, "lxml")
-        # Verify that we're parsing a Facebook Message export and _MYNAME is right:
-        check_header = self._MYNAME + " - Messages"
-        try:
-            actual_header = soup.html.head.title.string
-        except AttributeError:
-            actual_header = None
-        if ((actual_header is None) or (check_header != actual_header)):
-            print "The title of the htm document does not match that expected:"
-            print '"' + check_header + '"'
-            print "Is the file a message export? Is the user's name correct?"
-            cont = raw_input("Continue anyway? (y/n)")
-            if cont == "n":
-                sys.exit(-1)
-        # Set up some important lists:
-        thread_list = soup.find_all(class_='thread')
-        thread_num = 0
-        _chat_list = []
-        _thread_names = []
-        _duplicates_list = []
+        # Each Chat object has a SymbolTable of its own:
+        self._symbols = fb_chat.SymbolTable()
+        self._AUTHORS = {}
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if ((processes > 1) or (manifest is not None)):
+            thread_list = self._range_threads(processes, manifest)
+        else:
+            if stream:
+                raw_thread_list = self._stream_threads()
+            else:
+                raw_thread_list = self._soup_threads()
+            thread_list = (self._parse_thread(name, message_list) for name, message_list in raw_thread_list)
+        fb_profile.count("bytes_read", self._htm_size())
+        # Store each name only once, however many messages it appears in, including
+        # names parsed by worker processes or read from a manifest:
+        symbols = self._symbols
+        # Keep the Threads in the order first seen, and an index of them by name:
+        _builder_list = []
+        _builder_dict = {}
         # Start going through the threads:
-        for t in thread_list:
-            message_list = t.find_all(class_='message')
+        for thread_num, (thread_name, message_list) in enumerate(thread_list, 1):
+            if progress is not None:
+                progress("parse_messages", thread_num, self._thread_total)
+            fb_profile.count("threads")
+            fb_profile.count("messages", len(message_list))
             _thread_list = []
-            total_message_num = len(message_list)
-            #
-            message_num = total_message_num
-            thread_name = self._thread_name_cleanup(t.contents[0])
-            # Work out if the thread is a duplicate:
-            duplicate_thread = False
-            if thread_name in _thread_names:
-                duplicate_thread = True
-            else:
-                _thread_names.append(thread_name)
-            # For each message, sort Author, Date and Body then create Message object:
-            for m in message_list:
-                message_author = self._message_author_parse(m.find(class_='user').string)
-                message_date = self._message_date_parse(m.find(class_='meta').string)
-                message_body = self._message_body_parse(m.next_sibling.string)
-                #
+            message_num = len(message_list)
+            thread_name = symbols.intern(thread_name)
+            # For each message, create the Message object from Author, Date and Body:
+            for message_author, message_date, message_body in message_list:
+                message_author = symbols.intern(message_author)
                 _thread_list.append(fb_chat.Message(thread_name, message_author, message_date, message_body, message_num))
                 #
                 message_num -= 1
-            #
-            thread_num += 1
-            # If we're grouping duplicated threads, deal with them now:
-            if ((not duplicate_thread) or (not group_duplicates)):
-                _chat_list.append(fb_chat.Thread(thread_name.split(", "), _thread_list))
+            # If we're grouping duplicated threads, add to the existing Thread:
+            if ((thread_name in _builder_dict) and group_duplicates):
+                _builder_dict[thread_name].add_segment(_thread_list)
             else:
-                for t in _chat_list:
-                    if t.people_str == thread_name:
-                        _duplicates_list.append(thread_name)
-                        t._add_messages(_thread_list)
-                        break
+                builder = _ThreadBuilder(thread_name)
+                builder.add_segment(_thread_list)
+                _builder_list.append(builder)
+                _builder_dict[thread_name] = builder
         # Create the Chat object, set and return it:
-        self.Chat = fb_chat.Chat(self._MYNAME, _chat_list)
-        for t in _duplicates_list:
-            self.Chat[t]._renumber_messages()  # If we've grouped them, the messages need renumbering.
+        with fb_profile.stage("build_threads"):
+            threads = [builder.build() for builder in _builder_list]
+        with fb_profile.stage("create_chat"):
+            self.Chat = fb_chat.Chat(self._MYNAME, threads, symbols)
+        fb_profile.count("unknown_uids", len(self._UNKNOWNS))
         return self.Chat
 
-    def write_to_csv(self, filename='messages.csv', chronological=False):
+    @fb_profile.profiled("write_to_csv")
+    def write_to_csv(self, filename='messages.csv', chronological=False, escape_newlines=False):
         """Export all messages to csv format.
 
            The filename can be specified as an optional argument. If 'chronological'
            is True, messages are printed in date order, otherwise they are printed
-           grouped in Threads sorted by total thread length."""
-        with open(filename, "w") as f:
-            header_line = '"Thread","Message Number","Message Author","Message Timestamp","Message Body"\n'
-            f.write(header_line.encode('utf8'))
-            if chronological:
-                for message in self.Chat.all_messages():
-                    text = str(message)
-                    f.write(text.encode('utf8'))
+           grouped in Threads sorted by total thread length.
+            - Every field is quoted, and quote marks in messages are doubled. Messages
+              containing newlines span several lines of the file, which csv readers
+              handle correctly.
+            - Setting 'escape_newlines' to True replaces newlines in messages with
+              '<|NEWLINE|>' instead, so each message is on one line. This is the
+              format older versions of the parser wrote.
+            - Messages are written as they are read, in large blocks. In date order,
+              the already sorted Threads are merged as they are written."""
+        if chronological:
+            messages = fb_chat._merge_messages([thread.messages for thread in self.Chat.threads])
+        else:
+            messages = (message for thread in self.Chat.threads for message in thread.messages)
+        with open(filename, "wb", _CSV_BUFFER_SIZE) as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+            writer.writerow(_CSV_HEADER)
+            writer.writerows(_csv_row(_message_fields(message), escape_newlines) for message in messages)
+
+    def _partitions(self, partition_by):
+        """Yield (file name, rows) for each partition of the messages, as used by write_partitions()."""
+        if partition_by == "month":
+            messages = fb_chat._merge_messages([thread.messages for thread in self.Chat.threads])
+            for month, rows in itertools.groupby(itertools.imap(_message_fields, messages), _month):
+                yield _partition_name(month=month), list(rows)
+            return
+        names = set()
+        for thread in self.Chat.threads:
+            thread_name = thread.people_str
+            # Threads are only split into several with the same name if not grouping duplicates:
+            suffix = 1
+            while _partition_name(thread_name) in names:
+                suffix += 1
+                thread_name = "{}_{}".format(thread.people_str, suffix)
+            names.add(_partition_name(thread_name))
+            rows = [_message_fields(message) for message in thread.messages]
+            if partition_by == "thread":
+                if rows:
+                    yield _partition_name(thread_name), rows
             else:
-                for thread in self.Chat.threads:
-                    for message in thread.messages:
-                        text = str(message)
-                        f.write(text.encode('utf8'))
+                for month, month_rows in itertools.groupby(rows, _month):
+                    yield _partition_name(thread_name, month), list(month_rows)
+
+    @fb_profile.profiled("write_partitions")
+    def write_partitions(self, directory='messages_export', partition_by="thread", file_format="csv",
+                         processes=1, escape_newlines=False):
+        """Export all messages to a directory of files, one for each thread and/or month.
+
+           Useful for loading the messages into other tools in parallel. Returns the
+           list of file names written.
+            - 'partition_by' is "thread" for one file per Thread, "month" for one file
+              per calendar month, or "thread_month" for one file per month of each
+              Thread. Messages are in date order in each file.
+            - 'file_format' is "csv", for files like those from write_to_csv(), or
+              "jsonl" for JSON Lines files with one message object per line.
+              'escape_newlines' applies to csv files as in write_to_csv().
+            - Setting 'processes' to more than 1 writes the files in parallel using
+              that many worker processes; None uses one process per CPU.
+            - The directory also contains 'manifest.json', listing each file with its
+              number of messages, size in bytes, first and last timestamps and SHA-1
+              checksum. When exporting again to the same directory, files whose
+              contents are unchanged are not rewritten, and files no longer needed
+              are removed."""
+        if partition_by not in _PARTITION_TYPES:
+            raise ValueError("'partition_by' must be one of: " + ", ".join(_PARTITION_TYPES))
+        if file_format not in _PARTITION_FORMATS:
+            raise ValueError("'file_format' must be one of: " + ", ".join(_PARTITION_FORMATS))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        settings = {"version": _PARTITION_MANIFEST_VERSION, "partition_by": partition_by,
+                    "file_format": file_format, "escape_newlines": escape_newlines}
+        # Find the files written by the last export, if it used the same settings:
+        manifest_file = os.path.join(directory, _PARTITION_MANIFEST)
+        previous = {}
+        try:
+            with open(manifest_file, "rb") as f:
+                saved = json.load(f)
+            if all(saved.get(key) == value for key, value in settings.items()):
+                previous = dict((entry["file"], entry) for entry in saved["partitions"])
+        except (IOError, ValueError, KeyError):
+            pass
+        jobs = [(directory, name + "." + file_format, rows, file_format, escape_newlines, previous.get(name + "." + file_format))
+                for name, rows in self._partitions(partition_by)]
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = list(pool.imap(_write_partition, jobs))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_write_partition(job) for job in jobs]
+        entries = [entry for entry, _ in results]
+        written = [entry["file"] for entry, was_written in results if was_written]
+        # Remove files from the last export which are no longer needed:
+        current = set(entry["file"] for entry in entries)
+        for old_file in previous:
+            if ((old_file not in current) and os.path.isfile(os.path.join(directory, old_file))):
+                os.remove(os.path.join(directory, old_file))
+        settings["partitions"] = entries
+        with open(manifest_file, "wb") as f:
+            json.dump(settings, f, indent=1, sort_keys=True)
+        fb_profile.count("partitions_written", len(written))
+        fb_profile.count("partitions_unchanged", len(entries) - len(written))
+        return written
+
+    @fb_profile.profiled("write_to_parquet")
+    def write_to_parquet(self, filename='messages.parquet', row_group_size=100000):
+        """Export all messages to a Parquet file, for use with other analysis tools.
+
+           Messages are written in Thread order, in row groups of 'row_group_size'
+           messages, with the thread and author names dictionary encoded. Needs the
+           pyarrow module. See the fb_parquet module, which can also read the
+           messages back in batches of chosen columns."""
+        fb_parquet.write_parquet(self.Chat, filename, row_group_size)
 
+    @fb_profile.profiled("load_from_parquet")
+    def load_from_parquet(self, filename='messages.parquet'):
+        """Read in a Parquet file written by write_to_parquet(), optionally from a specified filename.
+
+           The function sets the internal Chat object and returns the Chat object."""
+        self.Chat = fb_parquet.read_parquet(filename)
+        return self.Chat
+
+    @fb_profile.profiled("dump_to_pickle")
     def dump_to_pickle(self, filename='messages.pickle'):
         """Serialise the Chat object to a pickle file.
 
@@ -285,6 +990,7 @@ class FBMessageParse(object):
         with open(filename, "w") as f:
             pickle.dump(self.Chat, f)
 
+    @fb_profile.profiled("load_from_pickle")
     def load_from_pickle(self, filename='messages.pickle'):
         """Read in the pickle file, optionally from a specified filename.
 
@@ -294,3 +1000,78 @@ class FBMessageParse(object):
         with open(filename, "r") as f:
             self.Chat = pickle.load(f)
         return self.Chat
+
+    @fb_profile.profiled("dump_to_snapshot")
+    def dump_to_snapshot(self, filename='messages.snapshot', search_index=True):
+        """Save the Chat object to a snapshot file.
+
+            - Like a pickle file, but the messages are stored as columns of numbers
+              and text which load_from_snapshot() reads without creating any Message
+              objects until they are used. Loading is almost instant however many
+              messages there are. See the fb_snapshot module.
+            - If 'search_index' is True, the index of words in the messages used by
+              Chat.search() is also saved, in a '.search' file next to the snapshot
+              (e.g. 'messages.search'), so it need not be made again after loading.
+              It is marked with the token of the snapshot, so is only used with
+              that snapshot. See the fb_search module."""
+        token = fb_snapshot.write_snapshot(self.Chat, filename)
+        index_filename = _search_index_filename(filename)
+        if search_index:
+            fb_search.write_index(self.Chat._get_search_index(), index_filename, token)
+        elif os.path.isfile(index_filename):
+            os.remove(index_filename)  # An index of an older snapshot would be wrong
+
+    @fb_profile.profiled("load_from_snapshot")
+    def load_from_snapshot(self, filename='messages.snapshot'):
+        """Read in the snapshot file, optionally from a specified filename.
+
+           The function sets the internal Chat object and returns the Chat object.
+           The file is memory mapped, and messages are read from it as needed. If
+           a search index was saved with the snapshot, it is loaded too."""
+        self.Chat = fb_snapshot.read_snapshot(filename)
+        index_filename = _search_index_filename(filename)
+        if os.path.isfile(index_filename):
+            index = fb_search.read_index(index_filename)
+            if index.token == self.Chat._get_cache_token():  # Not an index of another snapshot
+                self.Chat._search_index = index
+        return self.Chat
+
+    @fb_profile.profiled("dump_to_sharded_snapshot")
+    def dump_to_sharded_snapshot(self, dirname='messages.shards'):
+        """Save the Chat object as a directory with one file for each Thread.
+
+           The directory also contains a small index of the Threads, which is all
+           that load_from_sharded_snapshot() reads. Useful when only a few Threads
+           are needed at a time. See the fb_snapshot module."""
+        fb_snapshot.write_sharded_snapshot(self.Chat, dirname)
+
+    @fb_profile.profiled("load_from_sharded_snapshot")
+    def load_from_sharded_snapshot(self, dirname='messages.shards', max_loaded_threads=64):
+        """Read in the index of a sharded snapshot, optionally from a specified directory.
+
+           The function sets the internal Chat object and returns the Chat object.
+           Each Thread is read from its file the first time it is used, and at
+           most 'max_loaded_threads' Threads are kept in memory at once. The total
+           message counts, and top_n_people() counting total messages, need only
+           the index."""
+        self.Chat = fb_snapshot.read_sharded_snapshot(dirname, max_loaded_threads)
+        return self.Chat
+
+    @fb_profile.profiled("dump_to_database")
+    def dump_to_database(self, filename='messages.sqlite'):
+        """Write the Chat object to a SQLite database file.
+
+           The database has tables of threads, people and messages, indexed by
+           thread, author and timestamp, and a full-text index of message bodies
+           if the SQLite library supports it. See the fb_sqlite module."""
+        fb_sqlite.write_database(self.Chat, filename)
+
+    @fb_profile.profiled("load_from_database")
+    def load_from_database(self, filename='messages.sqlite'):
+        """Open the SQLite database file, optionally from a specified filename.
+
+           The function sets the internal Chat object and returns it. This is a
+           fb_sqlite.DatabaseChat, which reads messages from the database only when
+           they are used, but can otherwise be used like any Chat object."""
+        self.Chat = fb_sqlite.DatabaseChat(filename)
+        return self.Chat
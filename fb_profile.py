@@ -0,0 +1,212 @@
+import time
+import functools
+import resource
+try:
+    import tracemalloc  # Python 3.4+, or the pytracemalloc backport
+except ImportError:
+    tracemalloc = None
+
+# The Profile currently recording, if any:
+_ACTIVE = None
+
+
+class _Stage(object):
+    """Time one named stage of the Profile, either as a context manager or using start() and stop()."""
+
+    __slots__ = ["_profile", "_name", "_wall", "_cpu"]
+
+    def __init__(self, profile, name):
+        self._profile = profile
+        self._name = name
+
+    def start(self):
+        self._wall = time.time()
+        self._cpu = time.clock()
+
+    def stop(self):
+        self._profile.add_time(self._name, time.time() - self._wall, time.clock() - self._cpu)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+
+class _NullStage(object):
+    """Stand in for _Stage when no Profile is active, doing nothing."""
+
+    __slots__ = []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+class Profile(object):
+    """An object to record where time goes when parsing and analysing messages.
+
+        - Start recording with start() and stop with stop(), or use the Profile
+          in a 'with' statement. While it is active, the fb_parser and fb_analysis
+          code records the wall clock and CPU time spent in each stage, and counts
+          of threads, messages, unknown UIDs and bytes read.
+        - When no Profile is active, nothing is recorded, and the instrumented code
+          runs almost exactly as fast as before.
+        - If 'trace_memory' is True, the peak memory used while active is recorded
+          too. This uses tracemalloc if available (which slows things down), else
+          the peak resident memory of the whole process is reported.
+        - The results can be accessed using the 'stages', 'counters' and
+          'peak_memory' attributes, or as_dict(); report() gives a printable table."""
+
+    def __init__(self, trace_memory=False):
+        self.stages = {}
+        self.counters = {}
+        self.trace_memory = trace_memory
+        self.peak_memory = None
+        self._stage_order = []
+        self._previous = None
+
+    def __repr__(self):
+        """Set Python's representation of the Profile object."""
+        return "<PROFILE: STAGES={} COUNTERS={}>".format(len(self.stages), self.counters)
+
+    def start(self):
+        """Start recording into this Profile."""
+        global _ACTIVE
+        self._previous = _ACTIVE
+        _ACTIVE = self
+        if self.trace_memory and (tracemalloc is not None):
+            tracemalloc.start()
+
+    def stop(self):
+        """Stop recording into this Profile, and record peak memory if required."""
+        global _ACTIVE
+        _ACTIVE = self._previous
+        if self.trace_memory:
+            if ((tracemalloc is not None) and tracemalloc.is_tracing()):
+                self.peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                self.peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux reports KB
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def add_time(self, name, wall, cpu, calls=1):
+        """Add wall clock and CPU time, in seconds, to the stage called 'name'."""
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {"wall": 0.0, "cpu": 0.0, "calls": 0}
+            self._stage_order.append(name)
+        stage["wall"] += wall
+        stage["cpu"] += cpu
+        stage["calls"] += calls
+
+    def count(self, name, n=1):
+        """Add 'n' to the counter called 'name'."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed(self, name, func, *args):
+        """Call func(*args), adding the time taken to the stage called 'name'."""
+        wall = time.time()
+        cpu = time.clock()
+        result = func(*args)
+        self.add_time(name, time.time() - wall, time.clock() - cpu)
+        return result
+
+    def as_dict(self):
+        """Return the recorded stages, counters and peak memory as a dictionary."""
+        return {"stages": dict((name, dict(stage)) for name, stage in self.stages.items()),
+                "counters": dict(self.counters), "peak_memory": self.peak_memory}
+
+    def report(self):
+        """Return a table of the recorded stages, counters and peak memory as a string."""
+        lines = ["{:<24} {:>10} {:>10} {:>10}".format("Stage", "Wall (s)", "CPU (s)", "Calls")]
+        for name in self._stage_order:
+            stage = self.stages[name]
+            lines.append("{:<24} {:>10.3f} {:>10.3f} {:>10}".format(name, stage["wall"], stage["cpu"], stage["calls"]))
+        for name in sorted(self.counters):
+            lines.append("{:<24} {:>10}".format(name, self.counters[name]))
+        if self.peak_memory is not None:
+            lines.append("{:<24} {:>10.1f} MB".format("peak_memory", self.peak_memory / 2.0**20))
+        return "\n".join(lines)
+
+
+def current():
+    """Return the active Profile, or None if nothing is being recorded."""
+    return _ACTIVE
+
+
+def stage(name):
+    """Return an object to time the stage called 'name' in the active Profile.
+
+       The object can be used in a 'with' statement, or using start() and stop().
+       If no Profile is active, it does nothing."""
+    if _ACTIVE is None:
+        return _NULL_STAGE
+    return _Stage(_ACTIVE, name)
+
+
+def count(name, n=1):
+    """Add 'n' to the counter called 'name' in the active Profile, if there is one."""
+    if _ACTIVE is not None:
+        _ACTIVE.count(name, n)
+
+
+def timed_iter(name, iterable):
+    """Iterate over 'iterable', timing each step as the stage 'name' in the active Profile."""
+    timer = stage(name)
+    iterator = iter(iterable)
+    while True:
+        timer.start()
+        try:
+            item = next(iterator)
+        finally:
+            timer.stop()
+        yield item
+
+
+def with_progress(name, items, progress=None):
+    """Iterate over the list 'items', calling progress(name, done, total) after each item.
+
+       If 'progress' is None, 'items' is returned unchanged."""
+    if progress is None:
+        return items
+    return _progress_iter(name, items, progress)
+
+
+def _progress_iter(name, items, progress):
+    total = len(items)
+    for done, item in enumerate(items, 1):
+        yield item
+        progress(name, done, total)
+
+
+def profiled(name):
+    """Decorate a function so that each call is timed as the stage 'name' in the active Profile."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _ACTIVE is None:
+                return func(*args, **kwargs)
+            with _Stage(_ACTIVE, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
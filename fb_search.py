@@ -0,0 +1,214 @@
+import array
+import bisect
+import mmap
+import re
+import struct
+import sys
+import cPickle as pickle
+
+
+# Search index files start with this, then the length of the pickled metadata:
+_MAGIC = "FBSRCH01"
+_HEADER = struct.Struct("<8sQ")
+_INDEX_VERSION = 1
+# Words are runs of letters, digits and underscores, compared in lower case:
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _lower(text):
+    if isinstance(text, str):
+        text = text.decode("utf8")
+    return text.lower()
+
+
+def words(text):
+    """Return the list of words in 'text', in lower case, in the order they appear."""
+    return _WORD.findall(_lower(text))
+
+
+def contains_phrase(text, phrase_words):
+    """Return True if the words in the list 'phrase_words' appear one after another in 'text'."""
+    if len(phrase_words) == 0:
+        return True
+    text_words = words(text)
+    n = len(phrase_words)
+    return any(text_words[i:i + n] == phrase_words for i in xrange(len(text_words) - n + 1))
+
+
+def build_index(messages):
+    """Return a SearchIndex of the words in the list of Message objects 'messages'.
+
+       Messages are referred to by their position in 'messages', so the list
+       should be in date order, as from Chat.all_messages()."""
+    postings = {}
+    for i, message in enumerate(messages):
+        for word in set(_WORD.findall(message.text.lower())):
+            try:
+                postings[word].append(i)
+            except KeyError:
+                postings[word] = array.array("i", [i])
+    terms = sorted(postings)
+    data = array.array("i")
+    starts = [0]
+    for term in terms:
+        data.extend(postings[term])
+        starts.append(len(data))
+    if sys.byteorder != "little":
+        data.byteswap()
+    return SearchIndex(terms, starts, len(messages), data.tostring(), 0)
+
+
+def write_index(index, filename, token=None):
+    """Write the SearchIndex 'index' to a file, which read_index() can open.
+
+       The optional 'token' identifies the messages indexed, such as the token of
+       the snapshot file written with the index, and is kept as SearchIndex.token."""
+    metadata = {"version": _INDEX_VERSION, "total": index.total, "terms": index.terms, "starts": index._starts,
+                "token": token}
+    metadata = pickle.dumps(metadata, pickle.HIGHEST_PROTOCOL)
+    with open(filename, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(metadata)))
+        f.write(metadata)
+        f.write(buffer(index._data, index._offset, 4 * index._starts[-1]))
+
+
+def read_index(filename):
+    """Open a search index file written by write_index() and return the SearchIndex.
+
+       The file is memory mapped, and the list of messages containing each word
+       is only read from it when that word is searched for."""
+    with open(filename, "rb") as f:
+        magic, metadata_length = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC:
+            raise ValueError("{} is not a search index file.".format(filename))
+        metadata = pickle.loads(f.read(metadata_length))
+        if metadata["version"] != _INDEX_VERSION:
+            raise ValueError("{} is a search index of an unsupported version.".format(filename))
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return SearchIndex(metadata["terms"], metadata["starts"], metadata["total"], data, _HEADER.size + metadata_length,
+                       metadata.get("token"))  # Older index files have no token
+
+
+class SearchIndex(object):
+    """An inverted index of the words in a date ordered list of messages.
+
+        - For each word, in lower case, the index stores the positions in the list
+          of the messages containing it, in date order. Use build_index() to make
+          one, and write_index() and read_index() to save and load it.
+        - matching() returns the messages which might contain a string, which is
+          usually far fewer than all of them. Words in the middle of the string
+          must appear in the message as whole words, but the first and last words
+          may be the end or the start of a longer word, so the exact string must
+          still be checked for in each message found.
+        - with_words() returns the messages containing all of a list of words."""
+
+    def __init__(self, terms, starts, total, data, offset, token=None):
+        self.terms = terms
+        self.total = total
+        self.token = token
+        self._starts = starts
+        self._data = data
+        self._offset = offset
+        self._ids = None
+        self._reversed = None
+
+    def __len__(self):
+        """Return the number of different words in the index."""
+        return len(self.terms)
+
+    def __repr__(self):
+        return "<SEARCH INDEX: WORDS={} MESSAGES={}>".format(len(self.terms), self.total)
+
+    def _postings(self, term_id):
+        """Return the positions of the messages containing the word with ID 'term_id'."""
+        start, end = self._starts[term_id], self._starts[term_id + 1]
+        return struct.unpack_from("<{}i".format(end - start), self._data, self._offset + 4 * start)
+
+    def _exact(self, word):
+        if self._ids is None:
+            self._ids = dict((term, i) for i, term in enumerate(self.terms))
+        term_id = self._ids.get(word)
+        return [] if term_id is None else [term_id]
+
+    def _starting(self, prefix):
+        """Return the IDs of words starting with 'prefix', found by binary search."""
+        term_ids = []
+        i = bisect.bisect_left(self.terms, prefix)
+        while (i < len(self.terms)) and self.terms[i].startswith(prefix):
+            term_ids.append(i)
+            i += 1
+        return term_ids
+
+    def _ending(self, suffix):
+        """Return the IDs of words ending with 'suffix', found by binary search on the reversed words."""
+        if self._reversed is None:
+            self._reversed = sorted((term[::-1], i) for i, term in enumerate(self.terms))
+        reversed_suffix = suffix[::-1]
+        term_ids = []
+        i = bisect.bisect_left(self._reversed, (reversed_suffix,))
+        while (i < len(self._reversed)) and self._reversed[i][0].startswith(reversed_suffix):
+            term_ids.append(self._reversed[i][1])
+            i += 1
+        return term_ids
+
+    def _containing(self, infix):
+        return [i for i, term in enumerate(self.terms) if infix in term]
+
+    def _positions(self, term_ids):
+        """Return the set of positions of messages containing any of the words with IDs 'term_ids'."""
+        positions = set()
+        for term_id in term_ids:
+            positions.update(self._postings(term_id))
+        return positions
+
+    def _intersect(self, position_sets):
+        """Return the sorted list of positions in every one of 'position_sets'."""
+        position_sets = sorted(position_sets, key=len)
+        positions = position_sets[0]
+        for other in position_sets[1:]:
+            positions = positions.intersection(other)
+        return sorted(positions)
+
+    def matching(self, string):
+        """Return the sorted positions of messages which may contain 'string', ignoring case.
+
+           Returns None if 'string' contains no words, in which case any message
+           may contain it."""
+        string = _lower(string)
+        matches = list(_WORD.finditer(string))
+        if len(matches) == 0:
+            return None
+        position_sets = []
+        for n, match in enumerate(matches):
+            open_start = (n == 0) and (match.start() == 0)
+            open_end = (n == len(matches) - 1) and (match.end() == len(string))
+            word = match.group()
+            # Words at the ends of 'string' may be part of longer words:
+            if open_start and open_end:
+                term_ids = self._containing(word)
+            elif open_start:
+                term_ids = self._ending(word)
+            elif open_end:
+                term_ids = self._starting(word)
+            else:
+                term_ids = self._exact(word)
+            if len(term_ids) == 0:
+                return []
+            position_sets.append(self._positions(term_ids))
+        return self._intersect(position_sets)
+
+    def with_words(self, word_list):
+        """Return the sorted positions of messages containing every word in 'word_list', ignoring case.
+
+           Each item in 'word_list' is split into words as the messages are, so
+           a phrase may be given as one item; the order of the words is ignored."""
+        query = [word for item in word_list for word in words(item)]
+        if len(query) == 0:
+            return range(self.total)
+        position_sets = []
+        for word in set(query):
+            term_ids = self._exact(word)
+            if len(term_ids) == 0:
+                return []
+            position_sets.append(self._positions(term_ids))
+        return self._intersect(position_sets)
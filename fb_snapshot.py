@@ -0,0 +1,475 @@
+import array
+import datetime
+import glob
+import itertools
+import mmap
+import os
+import struct
+import uuid
+import cPickle as pickle
+import fb_cache
+import fb_chat
+
+
+# Snapshot files start with this, then the length of the pickled metadata:
+_MAGIC = "FBSNAP01"
+_HEADER = struct.Struct("<8sQ")
+_SNAPSHOT_VERSION = 2
+# Version 1 snapshots, without the counts of characters and words, can still be read:
+_READABLE_VERSIONS = (1, 2)
+# Timestamps are stored as microseconds since this date:
+_EPOCH = datetime.datetime(1970, 1, 1)
+# Columns are packed this many numbers at a time:
+_CHUNK_SIZE = 65536
+
+
+def _to_microseconds(date_time):
+    delta = date_time - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _from_microseconds(microseconds):
+    return _EPOCH + datetime.timedelta(microseconds=microseconds)
+
+
+def _write_column(f, code, numbers):
+    """Write the iterable of integers 'numbers' to the file 'f' as little-endian struct 'code' values.
+
+       Numbers are packed in chunks, rather than as one struct.pack() call with
+       an argument for every message."""
+    numbers = iter(numbers)
+    chunk = list(itertools.islice(numbers, _CHUNK_SIZE))
+    while chunk:
+        f.write(struct.pack("<{}{}".format(len(chunk), code), *chunk))
+        chunk = list(itertools.islice(numbers, _CHUNK_SIZE))
+
+
+def _write_bodies(f, messages, heap_start):
+    """Write the 'bodies' column of offsets for 'messages' at the position of file 'f', and their text from 'heap_start'.
+
+       The bodies are encoded as UTF-8 a chunk at a time, and each chunk is
+       written to the heap and its offsets to the column, so the encoded text
+       of only one chunk is held in memory."""
+    offsets_position = f.tell()
+    heap_position = heap_start
+    heap_end = 0
+    _write_column(f, "q", [heap_end])
+    offsets_position += 8
+    messages = iter(messages)
+    chunk = list(itertools.islice(messages, _CHUNK_SIZE))
+    while chunk:
+        bodies = [message.text.encode("utf8") for message in chunk]
+        body_offsets = []
+        for body in bodies:
+            heap_end += len(body)
+            body_offsets.append(heap_end)
+        f.seek(offsets_position)
+        _write_column(f, "q", body_offsets)
+        offsets_position = f.tell()
+        f.seek(heap_position)
+        f.write("".join(bodies))
+        heap_position = f.tell()
+        chunk = list(itertools.islice(messages, _CHUNK_SIZE))
+    f.seek(heap_position)
+
+
+def _align(offset):
+    """Round 'offset' up to a multiple of 8 bytes."""
+    return (offset + 7) & ~7
+
+
+def _column_offsets(total, version=_SNAPSHOT_VERSION):
+    """Return the offset of each column from the start of the data, for 'total' messages.
+
+       Columns are stored one after another, each aligned to 8 bytes:
+        - 'timestamps': int64 microseconds since 1970-01-01.
+        - 'authors': int32 IDs of the author names in the SymbolTable.
+        - 'threads': int32 IDs of the thread names in the SymbolTable.
+        - 'nums': int32 message numbers.
+        - 'chars' and 'words': int32 numbers of characters and words in each
+          message body. Not in version 1 snapshots.
+        - 'bodies': int64 offsets into the heap, one more than the number of
+          messages, so that body i is heap[bodies[i]:bodies[i + 1]].
+        - 'heap': the UTF-8 encoded message bodies, one after another."""
+    offsets = {"timestamps": 0}
+    offsets["authors"] = offsets["timestamps"] + 8 * total
+    offsets["threads"] = offsets["authors"] + 4 * total
+    offsets["nums"] = offsets["threads"] + 4 * total
+    end = offsets["nums"] + 4 * total
+    if version >= 2:
+        offsets["chars"] = end
+        offsets["words"] = offsets["chars"] + 4 * total
+        end = offsets["words"] + 4 * total
+    offsets["bodies"] = _align(end)
+    offsets["heap"] = offsets["bodies"] + 8 * (total + 1)
+    return offsets
+
+
+def is_snapshot(filename):
+    """Return True if 'filename' is a snapshot file written by write_snapshot()."""
+    with open(filename, "rb") as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+
+def write_snapshot(chat, filename):
+    """Write the fb_chat.Chat object 'chat' to a snapshot file.
+
+       Messages are stored in columns of fixed-width numbers, with the bodies in
+       a single block of UTF-8 text, so the file can be read by read_snapshot()
+       without creating any Message objects until they are needed. The numbers
+       of characters and words in each message are stored too, and a token which
+       identifies the messages written (see fb_chat.Chat._get_cache_token()),
+       which is returned."""
+    symbols = fb_chat.SymbolTable(chat.symbols.names)
+    threads = []
+    total = 0
+    for thread in chat.threads:
+        threads.append((thread.people, total, len(thread.messages)))
+        total += len(thread.messages)
+    # Every author and thread name must have an ID before the metadata is written:
+    messages = [message for thread in chat.threads for message in thread.messages]
+    chars, words = array.array("i"), array.array("i")
+    for thread in chat.threads:
+        thread_chars, thread_words, _ = thread._get_text_stats()
+        chars.extend(thread_chars)
+        words.extend(thread_words)
+    authors = [symbols.id(message.author) for message in messages]
+    thread_names = [symbols.id(message.thread_name) for message in messages]
+    # A Chat read from the file shares the token of an unchanged Chat, so can reuse its results (see fb_analysis):
+    token = chat._get_cache_token() if chat._get_version() == 0 else uuid.uuid4().hex
+    metadata = {"version": _SNAPSHOT_VERSION, "myname": chat._myname, "names": symbols.names,
+                "threads": threads, "total": total, "token": token}
+    metadata = pickle.dumps(metadata, pickle.HIGHEST_PROTOCOL)
+    data_start = _align(_HEADER.size + len(metadata))
+    offsets = _column_offsets(total)
+    with open(filename, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(metadata)))
+        f.write(metadata)
+        f.write("\0" * (data_start - f.tell()))
+        _write_column(f, "q", (_to_microseconds(message.date_time) for message in messages))
+        _write_column(f, "i", authors)
+        _write_column(f, "i", thread_names)
+        _write_column(f, "i", (message._num for message in messages))
+        _write_column(f, "i", chars)
+        _write_column(f, "i", words)
+        f.write("\0" * (data_start + offsets["bodies"] - f.tell()))
+        _write_bodies(f, messages, data_start + offsets["heap"])
+    return token
+
+
+def read_snapshot(filename):
+    """Open a snapshot file written by write_snapshot() and return the Chat object.
+
+       The file is memory mapped, and only the list of threads is read. The
+       Message objects in each Thread are created from the file the first time
+       that Thread's messages are used."""
+    with open(filename, "rb") as f:
+        magic, metadata_length = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC:
+            raise ValueError("{} is not a snapshot file.".format(filename))
+        metadata = pickle.loads(f.read(metadata_length))
+        if metadata["version"] not in _READABLE_VERSIONS:
+            raise ValueError("{} is a snapshot of an unsupported version.".format(filename))
+        snapshot = _Snapshot(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ),
+                             _align(_HEADER.size + metadata_length), metadata)
+    threads = [SnapshotThread(snapshot, people, start, count) for people, start, count in metadata["threads"]]
+    chat = fb_chat.Chat(metadata["myname"], threads, snapshot.symbols)
+    chat._cache_token = metadata.get("token")  # Older snapshots have none, so the Chat makes its own
+    return chat
+
+
+class _Snapshot(object):
+    """The memory mapped columns of a snapshot file, shared by all its Threads."""
+
+    def __init__(self, data, data_start, metadata):
+        self._data = data
+        self.symbols = fb_chat.SymbolTable(metadata["names"])
+        self._offsets = dict((column, data_start + offset)
+                             for column, offset in _column_offsets(metadata["total"], metadata["version"]).items())
+        self.has_text_stats = "chars" in self._offsets
+
+    def _column(self, column, fmt, size, start, count):
+        return struct.unpack_from("<{}{}".format(count, fmt), self._data, self._offsets[column] + size * start)
+
+    def messages(self, start, count):
+        """Create the Message objects numbered 'start' to 'start + count' in the file."""
+        names = self.symbols.names
+        timestamps = self._column("timestamps", "q", 8, start, count)
+        authors = self._column("authors", "i", 4, start, count)
+        thread_names = self._column("threads", "i", 4, start, count)
+        nums = self._column("nums", "i", 4, start, count)
+        body_offsets = self._column("bodies", "q", 8, start, count + 1)
+        heap = self._offsets["heap"]
+        data = self._data
+        return [fb_chat.Message(names[thread_names[i]], names[authors[i]], _from_microseconds(timestamps[i]),
+                                data[heap + body_offsets[i]:heap + body_offsets[i + 1]].decode("utf8"), nums[i])
+                for i in xrange(count)]
+
+    def text_stats(self, start, count):
+        """Return the numbers of characters and words of the messages numbered 'start' to 'start + count', and their authors."""
+        names = self.symbols.names
+        chars = array.array("i", self._column("chars", "i", 4, start, count))
+        words = array.array("i", self._column("words", "i", 4, start, count))
+        authors = [names[author] for author in self._column("authors", "i", 4, start, count)]
+        return chars, words, authors
+
+
+class SnapshotThread(fb_chat.Thread):
+    """A Thread read from a snapshot file, whose messages are only created when used.
+
+        - Behaves exactly like a Thread. The number of messages and the people
+          in the Thread are known without reading any messages.
+        - Accessing a single message using Thread[n] creates only that Message;
+          anything else using the messages creates them all, once. The numbers of
+          characters and words in the messages are read without creating them.
+        - Pickles as an ordinary Thread object."""
+
+    def __init__(self, snapshot, people, start, count):
+        self.people = people
+        self.people_str = ", ".join(self.people)
+        self._snapshot = snapshot
+        self._start = start
+        self._count = count
+        self._messages = None
+        self._replaced = False
+        self._snapshot_text_stats = None
+
+    @property
+    def messages(self):
+        if self._messages is None:
+            self._messages = self._snapshot.messages(self._start, self._count)
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages):
+        self._messages = messages
+        self._replaced = True
+
+    def __getitem__(self, key):
+        """Allow accessing Message objects in the messages list using Thread[n]."""
+        if ((self._messages is None) and (type(key) is int) and (-self._count <= key < self._count)):
+            return self._snapshot.messages(self._start + (key % self._count), 1)[0]
+        return self.messages[key]
+
+    def __len__(self):
+        """Return the total number of messages in the thread."""
+        if self._messages is None:
+            return self._count
+        return len(self._messages)
+
+    def _get_text_stats(self):
+        """Return the counts of characters and words in each message, and the totals for each author.
+
+           Read from the snapshot unless messages have been added or the list of
+           messages replaced, and otherwise counted as for any Thread."""
+        if (self._snapshot.has_text_stats and (not self._replaced) and (len(self) == self._count)):
+            if self._snapshot_text_stats is None:
+                chars, words, authors = self._snapshot.text_stats(self._start, self._count)
+                self._snapshot_text_stats = (chars, words, fb_chat._author_totals(authors, chars, words))
+            return self._snapshot_text_stats
+        return fb_chat.Thread._get_text_stats(self)
+
+    def __reduce__(self):
+        return (fb_chat.Thread, (self.people, self.messages))
+
+
+# Sharded snapshots are directories containing an index and one file per Thread:
+_SHARD_INDEX = "index.pickle"
+_SHARD_NAME = "thread-{:06d}.pickle"
+_SHARDS_VERSION = 1
+
+
+def write_sharded_snapshot(chat, directory):
+    """Write the fb_chat.Chat object 'chat' to a directory of files, one per Thread.
+
+       The directory also contains an index of the people, message count and
+       first and last message timestamps of every Thread, so that
+       read_sharded_snapshot() can read each Thread only when it is needed. Any
+       files from an earlier sharded snapshot in 'directory' are replaced."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for old_file in glob.glob(os.path.join(directory, "thread-*.pickle")):
+        os.remove(old_file)
+    threads = []
+    for number, thread in enumerate(chat.threads):
+        messages = thread.messages
+        first, last = (messages[0].date_time, messages[-1].date_time) if messages else (None, None)
+        threads.append((thread.people, len(messages), first, last))
+        with open(os.path.join(directory, _SHARD_NAME.format(number)), "wb") as f:
+            pickle.dump([(m.thread_name, m.author, m.date_time, m.text, m._num) for m in messages], f,
+                        pickle.HIGHEST_PROTOCOL)
+    # Write the index last, so a partly written snapshot cannot be read:
+    index = {"version": _SHARDS_VERSION, "myname": chat._myname, "threads": threads}
+    with open(os.path.join(directory, _SHARD_INDEX), "wb") as f:
+        pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+
+
+def read_sharded_snapshot(directory, max_loaded_threads=64):
+    """Read the index of a sharded snapshot written by write_sharded_snapshot().
+
+        - Returns a Chat object whose Threads are ShardedThread objects, which read
+          their messages from the directory the first time they are used.
+        - At most 'max_loaded_threads' Threads have their messages kept in memory;
+          the least recently used are dropped, and read again if needed.
+        - The date ordered list of all messages is not kept, as it would keep
+          every message in memory. Instead, each query of the whole Chat, such as
+          Chat.sent_after() or Chat.search(), merges the results of the same
+          query of each Thread, reading each Thread at most once.
+        - The index holds the dates of the first and last messages of each
+          Thread, so date queries, including Chat.on(), do not read the Threads
+          which have no messages in the dates asked for. Queries of single
+          Threads only read that Thread."""
+    with open(os.path.join(directory, _SHARD_INDEX), "rb") as f:
+        index = pickle.load(f)
+    if index["version"] != _SHARDS_VERSION:
+        raise ValueError("{} is a snapshot of an unsupported version.".format(directory))
+    shards = _Shards(directory, max_loaded_threads)
+    threads = [ShardedThread(shards, number, people, count, first, last)
+               for number, (people, count, first, last) in enumerate(index["threads"])]
+    chat = fb_chat.Chat(index["myname"], threads, shards.symbols)
+    chat._keep_timeline = False  # Keeping every message would defeat 'max_loaded_threads'
+    return chat
+
+
+class _Shards(object):
+    """The files of a sharded snapshot, and a cache of the Threads read from them."""
+
+    def __init__(self, directory, max_loaded_threads):
+        self._directory = directory
+        self.symbols = fb_chat.SymbolTable()
+        self.loaded = fb_cache.LRUCache(max_loaded_threads)
+
+    def messages(self, number):
+        """Return the list of Message objects in Thread 'number', reading it if necessary."""
+        messages = self.loaded.get(number)
+        if messages is None:
+            intern = self.symbols.intern
+            with open(os.path.join(self._directory, _SHARD_NAME.format(number)), "rb") as f:
+                messages = [fb_chat.Message(intern(thread_name), intern(author), date_time, text, num)
+                            for thread_name, author, date_time, text, num in pickle.load(f)]
+            self.loaded[number] = messages
+        return messages
+
+
+class ShardedThread(fb_chat.Thread):
+    """A Thread read from a sharded snapshot, whose messages are only read when used.
+
+        - Behaves exactly like a Thread. The people in the Thread, the number of
+          messages and the dates of the first and last messages ('first_date_time'
+          and 'last_date_time') are known without reading any messages.
+        - The messages may be dropped from memory when other Threads are used, and
+          are read again when next needed. Messages added using _add_messages()
+          are kept in memory.
+        - The timestamps, index of authors and text counts are kept without the
+          messages they were made from, so do not keep the messages in memory.
+        - Pickles as an ordinary Thread object."""
+
+    _shard_dates = None
+    _shard_authors = None
+    _shard_text_stats = None
+
+    def __init__(self, shards, number, people, count, first_date_time, last_date_time):
+        self.people = people
+        self.people_str = shards.symbols.intern(", ".join(self.people))
+        self.first_date_time = first_date_time
+        self.last_date_time = last_date_time
+        self._shards = shards
+        self._number = number
+        self._count = count
+        self._messages = None
+
+    @property
+    def messages(self):
+        if self._messages is not None:
+            return self._messages
+        return self._shards.messages(self._number)
+
+    @messages.setter
+    def messages(self, messages):
+        self._messages = messages
+
+    def __len__(self):
+        """Return the total number of messages in the thread."""
+        if self._messages is None:
+            return self._count
+        return len(self._messages)
+
+    def __reduce__(self):
+        return (fb_chat.Thread, (self.people, self.messages))
+
+    def _get_date_index(self):
+        """Return the list of messages and a list of their timestamps, in order."""
+        if self._messages is not None:
+            return fb_chat.Thread._get_date_index(self)
+        messages = self.messages
+        if self._shard_dates is None:
+            self._shard_dates = [message.date_time for message in messages]
+        return messages, self._shard_dates
+
+    def _get_author_index(self):
+        """Return the list of messages and a dictionary of the positions of each author's messages in it."""
+        if self._messages is not None:
+            return fb_chat.Thread._get_author_index(self)
+        messages = self.messages
+        if self._shard_authors is None:
+            self._shard_authors = fb_chat._author_positions(messages)
+        return messages, self._shard_authors
+
+    def _get_text_stats(self):
+        """Return the number of characters and words in each message, and the totals sent by each author."""
+        if self._messages is not None:
+            return fb_chat.Thread._get_text_stats(self)
+        if self._shard_text_stats is None:
+            messages = self.messages
+            chars, words = fb_chat._text_counts(messages)
+            self._shard_text_stats = (chars, words, fb_chat._author_totals((m.author for m in messages), chars, words))
+        return self._shard_text_stats
+
+    def sent_before(self, date):
+        """Return a date ordered list of all messages sent before specified date.
+
+           If no messages or all messages were sent before 'date', the messages
+           are not read."""
+        if self._messages is None:
+            date = fb_chat._parse_date(date)
+            if ((self._count == 0) or (self.first_date_time >= date)):
+                return []
+            if self.last_date_time < date:
+                return list(self.messages)
+        return super(ShardedThread, self).sent_before(date)
+
+    def sent_after(self, date):
+        """Return a date ordered list of all messages sent after specified date.
+
+           If no messages or all messages were sent after 'date', the messages
+           are not read."""
+        if self._messages is None:
+            date = fb_chat._parse_date(date)
+            if ((self._count == 0) or (self.last_date_time <= date)):
+                return []
+            if self.first_date_time > date:
+                return list(self.messages)
+        return super(ShardedThread, self).sent_after(date)
+
+    def sent_between(self, start, end=None):
+        """Return a date ordered list of all messages sent between specified dates.
+
+           If no messages were sent between the dates, the messages are not read."""
+        if self._messages is None:
+            first, last = fb_chat._parse_between(start, end)
+            if ((self._count == 0) or (self.last_date_time < first) or (self.first_date_time > last)):
+                return []
+        return super(ShardedThread, self).sent_between(start, end)
+
+    def on(self, date):
+        """Return the Thread object as it would have been on 'date'.
+
+           If no messages or all messages were sent before 'date', the messages
+           are not read."""
+        if self._messages is None:
+            date = fb_chat._parse_date(date)
+            if ((self._count == 0) or (self.first_date_time >= date)):
+                return fb_chat.ThreadView(self, 0)
+            if self.last_date_time < date:
+                return fb_chat.ThreadView(self, self._count)
+        return super(ShardedThread, self).on(date)
@@ -0,0 +1,302 @@
+import array
+import itertools
+import os
+import sqlite3
+import fb_chat
+import fb_search
+
+
+_DATABASE_VERSION = 2
+# Version 1 databases, without the counts of characters and words, can still be read:
+_READABLE_VERSIONS = (1, 2)
+_SCHEMA = """
+    CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE people (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+    CREATE TABLE threads (id INTEGER PRIMARY KEY, name TEXT, message_count INTEGER);
+    CREATE TABLE thread_people (thread_id INTEGER, person_id INTEGER, position INTEGER,
+                                PRIMARY KEY (thread_id, position));
+    CREATE TABLE messages (id INTEGER PRIMARY KEY, thread_id INTEGER, author_id INTEGER,
+                           date_time timestamp, num INTEGER, body TEXT, chars INTEGER, words INTEGER);
+"""
+_INDEXES = """
+    CREATE INDEX messages_thread_time ON messages (thread_id, date_time, num);
+    CREATE INDEX messages_author_time ON messages (author_id, date_time, num);
+    CREATE INDEX messages_time ON messages (date_time, num);
+"""
+# The full-text index uses trigrams, so that any substring of 3 or more characters can be found:
+_FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE message_text USING fts5(body, content='messages', content_rowid='id', tokenize='trigram');
+    INSERT INTO message_text (message_text) VALUES ('rebuild');
+"""
+_MESSAGE_COLUMNS = "thread_id, author_id, date_time, num, body"
+# Messages in a Thread are stored in order, so this gives the order Chat objects use:
+_MESSAGE_ORDER = " ORDER BY date_time, num, id"
+
+
+def _connect(filename):
+    connection = sqlite3.connect(filename, detect_types=sqlite3.PARSE_DECLTYPES)
+    connection.text_factory = str  # Names are stored as bytes, as the parser creates them
+    return connection
+
+
+def _message_rows(chat, people):
+    """Yield the row of the messages table for each message in 'chat', using the IDs of the SymbolTable 'people'."""
+    for i, thread in enumerate(chat.threads):
+        chars, words, _ = thread._get_text_stats()
+        for message, message_chars, message_words in itertools.izip(thread.messages, chars, words):
+            yield (i, people.id(message.author), message.date_time, message._num, message.text, message_chars, message_words)
+
+
+def write_database(chat, filename):
+    """Write the fb_chat.Chat object 'chat' to a SQLite database file.
+
+        - Any existing file called 'filename' is replaced.
+        - Threads are stored in the order of 'chat.threads', and messages in the
+          order of each Thread's message list.
+        - The numbers of characters and words in each message are stored too.
+        - Everything is inserted in one transaction. If the SQLite library has the
+          FTS5 extension, a full-text index of the message bodies is built too."""
+    if os.path.isfile(filename):
+        os.remove(filename)
+    connection = _connect(filename)
+    people = fb_chat.SymbolTable([chat._myname])
+    for thread in chat.threads:
+        for person in thread.people:
+            people.id(person)
+    with connection:
+        connection.executescript(_SCHEMA)
+        connection.executemany("INSERT INTO info VALUES (?, ?)", [("version", str(_DATABASE_VERSION)),
+                                                                   ("myname", chat._myname)])
+        connection.executemany("INSERT INTO threads VALUES (?, ?, ?)",
+                               ((i, thread.people_str, len(thread)) for i, thread in enumerate(chat.threads)))
+        connection.executemany("INSERT INTO thread_people VALUES (?, ?, ?)",
+                               ((i, people.id(person), position) for i, thread in enumerate(chat.threads)
+                                for position, person in enumerate(thread.people)))
+        connection.executemany("INSERT INTO messages (thread_id, author_id, date_time, num, body, chars, words) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?)", _message_rows(chat, people))
+        connection.executemany("INSERT INTO people VALUES (?, ?)", enumerate(people.names))
+        connection.executescript(_INDEXES)
+    try:
+        with connection:
+            connection.executescript(_FTS_SCHEMA)
+    except sqlite3.OperationalError:
+        print "SQLite FTS5 trigram index not available: searching will scan every message."
+    connection.close()
+
+
+class DatabaseChat(fb_chat.Chat):
+    """A Chat object whose messages stay in a SQLite database written by write_database().
+
+        - Behaves like a Chat object: it can be used with the fb_analysis functions.
+          The threads, people and message counts are read when opened; messages
+          are read from the database only when asked for, using its indexes.
+        - Optionally, only the messages sent before the date 'before' are included,
+          as if on() had been used.
+        - The Chat is read only: messages cannot be added to its Threads.
+        - Pickles as a reference to the database file, not as the messages."""
+
+    # Methods inherited from Chat which need every message read them again each time:
+    _keep_timeline = False
+
+    def __init__(self, filename, before=None, _connection=None):
+        self._filename = filename
+        self._connection = _connection if _connection is not None else _connect(filename)
+        self._before = before
+        info = dict(self._connection.execute("SELECT key, value FROM info"))
+        if int(info["version"]) not in _READABLE_VERSIONS:
+            raise ValueError("{} is a database of an unsupported version.".format(filename))
+        self._has_text_stats = int(info["version"]) >= 2
+        self._people = dict(self._connection.execute("SELECT id, name FROM people"))
+        self._person_ids = dict((name, person_id) for person_id, name in self._people.items())
+        self._thread_names = dict(self._connection.execute("SELECT id, name FROM threads"))
+        tables = [row[0] for row in self._connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        self._full_text = "message_text" in tables
+        # Find the number of messages in each thread, allowing for the date cut off:
+        if before is None:
+            counts = self._connection.execute("SELECT id, message_count FROM threads ORDER BY id")
+        else:
+            counts = self._connection.execute("SELECT thread_id, count(*) FROM messages WHERE date_time < ? "
+                                              "GROUP BY thread_id ORDER BY thread_id", (before,))
+        thread_people = {}
+        for thread_id, person_id in self._connection.execute("SELECT thread_id, person_id FROM thread_people "
+                                                             "ORDER BY thread_id, position"):
+            thread_people.setdefault(thread_id, []).append(self._people[person_id])
+        threads = [DatabaseThread(self, thread_id, thread_people[thread_id], count) for thread_id, count in counts]
+        super(DatabaseChat, self).__init__(info["myname"], threads)
+
+    def __reduce__(self):
+        return (DatabaseChat, (self._filename, self._before))
+
+    def _rows(self, columns, where="", params=(), limit=None):
+        """Return a cursor of the 'columns' of the messages matching the SQL condition 'where', in date order."""
+        conditions = [where] if where else []
+        if self._before is not None:
+            conditions.append("date_time < ?")
+            params = tuple(params) + (self._before,)
+        query = "SELECT " + columns + " FROM messages"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += _MESSAGE_ORDER
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params = tuple(params) + limit
+        return self._connection.execute(query, params)
+
+    def _messages(self, where="", params=(), limit=None):
+        """Return a date ordered list of the messages matching the SQL condition 'where'."""
+        return [fb_chat.Message(self._thread_names[thread_id], self._people[author_id], date_time, body.decode("utf8"), num)
+                for thread_id, author_id, date_time, num, body in self._rows(_MESSAGE_COLUMNS, where, params, limit)]
+
+    def _person_id(self, name):
+        return self._person_ids.get(name, -1)
+
+    def _text_condition(self, strings, where="", params=()):
+        """Return the SQL condition 'where', and its parameters, with a condition that messages contain each of 'strings'.
+
+           The full-text index finds messages containing the same trigrams as each
+           string, ignoring case, so the messages found must still be checked.
+           Strings of fewer than 3 characters cannot be looked up, so are left out."""
+        conditions = [where] if where else []
+        strings = [string for string in strings if len(string.decode("utf8") if type(string) is str else string) >= 3]
+        if self._full_text and strings:
+            conditions.append("id IN (SELECT rowid FROM message_text WHERE message_text MATCH ?)")
+            params = tuple(params) + (" AND ".join('"' + string.replace('"', '""') + '"' for string in strings),)
+        return " AND ".join(conditions), params
+
+    def _search(self, string, ignore_case, where="", params=()):
+        """Return a date ordered list of messages matching 'where' which contain 'string'.
+
+           The full-text index finds messages which may contain 'string', and then
+           each is checked exactly as Message.contains() would."""
+        messages = self._messages(*self._text_condition([string], where, params))
+        return [message for message in messages if message.contains(string, ignore_case)]
+
+    def all_messages(self):
+        """Return a date ordered list of all messages."""
+        return self._messages()
+
+    def all_from(self, name):
+        """Return a date ordered list of all messages sent by 'name'."""
+        return self._messages("author_id = ?", (self._person_id(name),))
+
+    def sent_before(self, date):
+        """Return a date ordered list of all messages sent before specified date."""
+        return self._messages("date_time < ?", (self._date_parse(date),))
+
+    def sent_after(self, date):
+        """Return a date ordered list of all messages sent after specified date."""
+        return self._messages("date_time > ?", (self._date_parse(date),))
+
+    def sent_between(self, start, end=None):
+        """Return a date ordered list of all messages sent between specified dates."""
+        return self._messages("date_time BETWEEN ? AND ?", fb_chat._parse_between(start, end))
+
+    def search(self, string, ignore_case=False):
+        """Return a date ordered list of all messages containing 'string'."""
+        return self._search(string, ignore_case)
+
+    def search_words(self, words):
+        """Return a date ordered list of all messages containing every word in the list 'words'.
+
+           Words are matched whole and case-insensitively, as Chat.search_words()
+           does; the full-text index finds the messages which may contain them."""
+        query = set(word for item in words for word in fb_search.words(item))
+        messages = self._messages(*self._text_condition(query))
+        return [message for message in messages if query.issubset(fb_search.words(message.text))]
+
+    def search_phrase(self, phrase):
+        """Return a date ordered list of all messages containing the words of 'phrase', in order.
+
+           Matches as Chat.search_phrase() does; the full-text index finds the
+           messages which may contain the words."""
+        phrase_words = fb_search.words(phrase)
+        messages = self._messages(*self._text_condition(set(phrase_words)))
+        return [message for message in messages if fb_search.contains_phrase(message.text, phrase_words)]
+
+    def on(self, date):
+        """Return the Chat object as it would have been on 'date'.
+
+           The DatabaseChat returned uses the same database connection."""
+        date = self._date_parse(date)
+        if ((self._before is not None) and (self._before < date)):
+            date = self._before
+        return DatabaseChat(self._filename, date, self._connection)
+
+
+class DatabaseThread(fb_chat.Thread):
+    """A Thread whose messages stay in the database of a DatabaseChat.
+
+        - Behaves like a Thread object. Each use of 'messages', or of any method
+          returning messages, reads them from the database again.
+        - The counts of characters and words in each message are read from the
+          database without reading the messages, and kept.
+        - Pickles as an ordinary Thread object."""
+
+    _db_text_stats = None
+
+    def __init__(self, chat, thread_id, people, count):
+        self.people = people
+        self.people_str = ", ".join(self.people)
+        self._chat = chat
+        self._id = thread_id
+        self._count = count
+
+    def __reduce__(self):
+        return (fb_chat.Thread, (self.people, self.messages))
+
+    @property
+    def messages(self):
+        return self._chat._messages("thread_id = ?", (self._id,))
+
+    def __getitem__(self, key):
+        """Allow accessing Message objects in the messages list using Thread[n]."""
+        if ((type(key) is int) and (-self._count <= key < self._count)):
+            return self._chat._messages("thread_id = ?", (self._id,), limit=(1, key % self._count))[0]
+        return self.messages[key]
+
+    def __len__(self):
+        """Return the total number of messages in the thread."""
+        return self._count
+
+    def _get_text_stats(self):
+        """Return the number of characters and words in each message, and the totals sent by each author.
+
+           Version 1 databases have no counts, so the messages are read and
+           counted; only the counts are kept."""
+        if self._db_text_stats is None:
+            if self._chat._has_text_stats:
+                rows = self._chat._rows("author_id, chars, words", "thread_id = ?", (self._id,)).fetchall()
+                chars = array.array("i", [row[1] for row in rows])
+                words = array.array("i", [row[2] for row in rows])
+                authors = [self._chat._people[row[0]] for row in rows]
+            else:
+                messages = self.messages
+                chars, words = fb_chat._text_counts(messages)
+                authors = [message.author for message in messages]
+            self._db_text_stats = (chars, words, fb_chat._author_totals(authors, chars, words))
+        return self._db_text_stats
+
+    def by(self, name):
+        """Return a date ordered list of all messages sent by 'name'."""
+        return self._chat._messages("thread_id = ? AND author_id = ?", (self._id, self._chat._person_id(name)))
+
+    def sent_before(self, date):
+        """Return a date ordered list of all messages sent before specified date."""
+        return self._chat._messages("thread_id = ? AND date_time < ?", (self._id, self._chat._date_parse(date)))
+
+    def sent_after(self, date):
+        """Return a date ordered list of all messages sent after specified date."""
+        return self._chat._messages("thread_id = ? AND date_time > ?", (self._id, self._chat._date_parse(date)))
+
+    def sent_between(self, start, end=None):
+        """Return a date ordered list of all messages sent between specified dates."""
+        return self._chat._messages("thread_id = ? AND date_time BETWEEN ? AND ?",
+                                    (self._id,) + fb_chat._parse_between(start, end))
+
+    def search(self, string, ignore_case=False):
+        """Return a date ordered list of messages in Thread containing 'string'."""
+        return self._chat._search(string, ignore_case, "thread_id = ?", (self._id,))
+
+    def on(self, date):
+        """Return the Thread object as it would have been on 'date'."""
+        return fb_chat.Thread(self.people, self.sent_before(date))
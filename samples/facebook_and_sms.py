@@ -1,9 +1,14 @@
 import sys
 import codecs
+import operator
 import fb_parser
 import ios_parser
 import ios_chat
 
+# Both kinds of Message object have a date and number, so sort using these as a key
+# rather than comparing Message objects of different classes:
+_sort_key = operator.attrgetter("date_time", "_num")
+
 
 class Merge_Chat_Logs(object):
     """An object to merge the iOS and Facebook Chat objects.
@@ -61,7 +66,7 @@ class Merge_Chat_Logs(object):
 
            The list is all messages contained in both Chat objects, as a list of
            Message objects."""
-        return sorted([m for m in self.Chat.all_messages() + self.Texts.all_messages()])
+        return sorted([m for m in self.Chat.all_messages() + self.Texts.all_messages()], key=_sort_key)
 
     def all_from(self, name):
         """Return a date ordered list of all messages sent by 'name', from both Chat objects.
@@ -69,21 +74,21 @@ class Merge_Chat_Logs(object):
            The list returned is a list of Message objects. This is distinct from
            Thread.by(name) since all threads are searched by this method. For all
            messages in one thread from 'name', use Thread.by(name) on the correct Thread."""
-        return sorted([m for m in self.Chat.all_from(name) + self.Texts.all_from(name)])
+        return sorted([m for m in self.Chat.all_from(name) + self.Texts.all_from(name)], key=_sort_key)
 
     def sent_before(self, date):
         """Return a date ordered list of all messages sent before specified date, from both Chat objects.
 
            The function returns a list of Message objects. The 'date' can be a
            datetime.datetime object, or a three to six tuple (YYYY, MM, DD[, HH, MM, SS])."""
-        return sorted([m for m in self.Chat.sent_before(date) + self.Texts.sent_before(date)])
+        return sorted([m for m in self.Chat.sent_before(date) + self.Texts.sent_before(date)], key=_sort_key)
 
     def sent_after(self, date):
         """Return a date ordered list of all messages sent after specified date, from both Chat objects.
 
            The list returned is a list of Message objects. The 'date' can be a
            datetime.datetime object, or a three to six tuple (YYYY, MM, DD[, HH, MM, SS])."""
-        return sorted([m for m in self.Chat.sent_after(date) + self.Texts.sent_after(date)])
+        return sorted([m for m in self.Chat.sent_after(date) + self.Texts.sent_after(date)], key=_sort_key)
 
     def sent_between(self, start, end=None):
         """Return a date ordered list of all messages sent between specified dates, from both Chat objects.
@@ -94,7 +99,7 @@ class Merge_Chat_Logs(object):
             - Not entering an 'end' date is interpreted as all messages sent on
               the day 'start'. Where a time is specified also, a 24 hour period
               beginning at 'start' is used."""
-        return sorted([m for m in self.Chat.sent_between(start, end) + self.Texts.sent_between(start, end)])
+        return sorted([m for m in self.Chat.sent_between(start, end) + self.Texts.sent_between(start, end)], key=_sort_key)
 
     def search(self, string, ignore_case=False):
         """Return a date ordered list of all messages containing 'string', from both Chat objects.
@@ -103,7 +108,7 @@ class Merge_Chat_Logs(object):
            objects.
             - The function can be made case-insensitive by setting 'ignore_case'
               to True."""
-        return sorted([m for m in self.Chat.search(string, ignore_case) + self.Texts.search(string, ignore_case)])
+        return sorted([m for m in self.Chat.search(string, ignore_case) + self.Texts.search(string, ignore_case)], key=_sort_key)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,32 @@
+import sys
+import os
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import matplotlib
+matplotlib.use("Agg")
+import fb_analysis
+import fb_chat
+from test_chat import _sample_chat
+
+
+class TestResultsCache(unittest.TestCase):
+    """Check remembered results are not reused once the messages they were worked out from change."""
+
+    def setUp(self):
+        fb_analysis.clear_results_cache()
+        self.chat = _sample_chat()
+
+    def test_changed_thread(self):
+        self.assertEqual(dict(fb_analysis.top_word_use(self.chat, "My Name")).get("hello"), 1)
+        thread = self.chat["Bob Jones"]
+        # Add a message without calling _recount_messages():
+        thread._add_messages([fb_chat.Message(thread.people_str, "My Name", datetime.datetime(2014, 1, 5),
+                                              "hello hello", 2)])
+        self.assertEqual(dict(fb_analysis.top_word_use(self.chat, "My Name")).get("hello"), 3)
+        self.assertEqual(fb_analysis.results_cache_info()["misses"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import sys
+import os
+import datetime
+import shutil
+import tempfile
+import cPickle as pickle
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_chat
+import fb_snapshot
+
+
+def _thread(people, messages):
+    """Make a Thread between 'people' from a list of (author, (YYYY, MM, DD), text) tuples, in date order."""
+    people_str = ", ".join(people)
+    num = len(messages)
+    message_list = []
+    for author, date, text in reversed(messages):
+        message_list.append(fb_chat.Message(people_str, author, datetime.datetime(*date), text, num))
+        num -= 1
+    return fb_chat.Thread(people, list(reversed(message_list)))
+
+
+def _sample_chat():
+    return fb_chat.Chat("My Name", [_thread(["Alice Smith"], [("Alice Smith", (2014, 1, 1), "hello there"),
+                                                              ("My Name", (2014, 1, 2), "hi alice")]),
+                                    _thread(["Bob Jones"], [("My Name", (2014, 1, 3), "hello bob")])])
+
+
+class TestMergeMessages(unittest.TestCase):
+    """Check messages are merged into the order sorting them together would give."""
+
+    def test_equal_keys(self):
+        date = datetime.datetime(2014, 1, 1)
+        lists = [[fb_chat.Message(name, name, date, "hello", 1)] for name in ["Alice Smith", "Bob Jones", "Eve"]]
+        merged = list(fb_chat._merge_messages(lists))
+        self.assertEqual([m.thread_name for m in merged], ["Alice Smith", "Bob Jones", "Eve"])
+        self.assertEqual(merged, sorted(lists[0] + lists[1] + lists[2], key=fb_chat._sort_key))
+
+    def test_chat_equal_keys(self):
+        date = (2014, 1, 1)
+        chat = fb_chat.Chat("My Name", [_thread(["Alice Smith"], [("Alice Smith", date, "hello")]),
+                                        _thread(["Bob Jones"], [("Bob Jones", date, "hello")])])
+        self.assertEqual([m.thread_name for m in chat.all_messages()], [t.people_str for t in chat.threads])
+
+
+class TestThreadView(unittest.TestCase):
+    """Check a ThreadView's messages are the first messages of its Thread, without copying them."""
+
+    def setUp(self):
+        self.thread = _sample_chat()["Alice Smith"]
+        self.view = self.thread.on((2014, 1, 2))
+
+    def test_messages(self):
+        messages = self.view.messages
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages, self.thread.messages[:1])
+        self.assertEqual(list(messages), self.thread.messages[:1])
+        self.assertIs(messages[0], self.thread.messages[0])
+        self.assertIs(messages[-1], self.thread.messages[0])
+        self.assertEqual(messages[::-1], self.thread.messages[:1])
+        self.assertRaises(IndexError, lambda: messages[1])
+
+    def test_shared(self):
+        self.assertIs(self.view.messages._messages, self.thread.messages)
+
+    def test_pickle(self):
+        thread = pickle.loads(pickle.dumps(self.view, 2))
+        self.assertEqual(type(thread), fb_chat.Thread)
+        self.assertEqual([m.text for m in thread.messages], ["hello there"])
+
+
+class TestChatChanges(unittest.TestCase):
+    """Check queries on a Chat see messages added to its Threads without calling _recount_messages()."""
+
+    def setUp(self):
+        self.chat = _sample_chat()
+        # Make the date ordered list of messages and its indexes before changing the Chat:
+        self.chat.all_from("Alice Smith")
+        self.chat.sent_after((2014, 1, 1))
+        self.chat.search("hello")
+        thread = self.chat["Alice Smith"]
+        thread._add_messages([fb_chat.Message(thread.people_str, "Alice Smith", datetime.datetime(2014, 1, 4),
+                                              "hello again", 3)])
+
+    def test_all_from(self):
+        self.assertEqual([m.text for m in self.chat.all_from("Alice Smith")], ["hello there", "hello again"])
+
+    def test_sent_after(self):
+        self.assertEqual([m.text for m in self.chat.sent_after((2014, 1, 2))], ["hello bob", "hello again"])
+
+    def test_search(self):
+        self.assertEqual([m.text for m in self.chat.search("hello")], ["hello there", "hello bob", "hello again"])
+
+
+class TestOldPickles(unittest.TestCase):
+    """Check Chat and Message objects pickled by older versions can still be used."""
+
+    def setUp(self):
+        chat = _sample_chat()
+        del chat.__dict__["_symbols_cache"]
+        self.chat = pickle.loads(pickle.dumps(chat, 2))
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_symbols(self):
+        self.assertEqual(self.chat.symbols.names, ["My Name", "Alice Smith", "Bob Jones"])
+
+    def test_on(self):
+        self.assertEqual(len(self.chat.on((2014, 1, 3))), 1)
+
+    def test_message_text(self):
+        message = fb_chat.Message.__new__(fb_chat.Message)
+        message.__setstate__({"thread_name": "Alice Smith", "author": "Alice Smith", "date_time": datetime.datetime(2014, 1, 1),
+                              "text": 'say ""hi""<|NEWLINE|>bye', "_num": 1})
+        self.assertEqual(message.text, 'say "hi"\nbye')
+        self.assertEqual(len(message), 12)
+
+    def test_new_message_text(self):
+        message = fb_chat.Message("Alice Smith", "Alice Smith", datetime.datetime(2014, 1, 1), 'say ""hi""<|NEWLINE|>', 1)
+        self.assertEqual(pickle.loads(pickle.dumps(message, 2)).text, 'say ""hi""<|NEWLINE|>')
+
+    def test_snapshot(self):
+        filename = os.path.join(self.directory, "chat.snapshot")
+        fb_snapshot.write_snapshot(self.chat, filename)
+        chat = fb_snapshot.read_snapshot(filename)
+        self.assertEqual([m.text for m in chat.all_messages()], [m.text for m in self.chat.all_messages()])
+
+
+if __name__ == "__main__":
+    unittest.main()
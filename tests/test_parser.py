@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fb_parser
+
+_HEADER = (u'<!DOCTYPE html><html><head><meta charset="UTF-8" /><title>My Name - Messages</title></head><body>'
+           u'<div class="contents"><h1>My Name</h1><div>')
+_FOOTER = u'</div></div><div class="footer">Downloaded by My Name</div></body></html>'
+_THREADS = [(u"Alice Smith, My Name", [(u"Alice Smith", u"Monday, 6 January 2014 at 10:05 UTC", u"see you soon"),
+                                       (u"My Name", u"Monday, 6 January 2014 at 10:00 UTC", u'she said "hi"'),
+                                       (u"Alice Smith", u"Monday, 6 January 2014 at 10:00 UTC", u"hello")]),
+            (u"123456789@facebook.com, My Name", [(u"123456789@facebook.com", u"Friday, 3 January 2014 at 9:00am PDT",
+                                                   u"who is this?\nnew line")]),
+            (u"Désirée Klüg, My Name", [(None, u"Sunday, 5 January 2014 at 08:00 UTC+01", u"café &lt;3")]),
+            # Facebook splits long threads into several blocks with the same people:
+            (u"My Name, Alice Smith", [(u"My Name", u"Wednesday, 1 January 2014 at 12:00 UTC", u"happy new year")])]
+
+
+def _export_htm(threads=_THREADS):
+    """Return the UTF-8 text of a messages.htm file containing 'threads', each a (names, [(author, date, body)]) pair."""
+    parts = [_HEADER]
+    for names, messages in threads:
+        parts.append(u'<div class="thread">' + names)
+        for author, date, body in messages:
+            parts.append(u'<div class="message"><div class="message_header"><span class="user">{}</span>'
+                         u'<span class="meta">{}</span></div></div><p>{}</p>'.format(author or u"", date, body))
+        parts.append(u'</div>')
+    parts.append(_FOOTER)
+    return u"".join(parts).encode("utf8")
+
+
+def _contents(parser):
+    """Return everything about the Chat object of 'parser' which the ways of parsing should agree on."""
+    chat = parser.Chat
+    return ([(t.people, t.people_str, [(m.thread_name, m.author, m.date_time, m.text, m._num) for m in t.messages])
+             for t in chat.threads],
+            [(m.thread_name, m._num) for m in chat.all_messages()], sorted(parser._UNKNOWNS))
+
+
+class TestParseMessages(unittest.TestCase):
+    """Check every way of parsing an export gives the same Chat object."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.htm = os.path.join(self.directory, "messages.htm")
+        with open(self.htm, "wb") as f:
+            f.write(_export_htm())
+        self.zip = os.path.join(self.directory, "facebook.zip")
+        with zipfile.ZipFile(self.zip, "w") as archive:
+            archive.write(self.htm, "html/messages.htm")
+        self.expected = self._parse(self.htm)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _parse(self, filename, **kwargs):
+        parser = fb_parser.FBMessageParse(filename)
+        parser._MYNAME = "My Name"
+        parser.parse_messages(**kwargs)
+        contents = _contents(parser)
+        parser._close()
+        return contents
+
+    def test_default(self):
+        threads, all_messages, unknowns = self.expected
+        self.assertEqual(len(threads), 3)
+        self.assertEqual(len(all_messages), 6)
+        self.assertEqual(unknowns, ["123456789"])
+
+    def test_stream(self):
+        self.assertEqual(self._parse(self.htm, stream=True), self.expected)
+        self.assertEqual(self._parse(self.zip, stream=True), self.expected)
+
+    def test_processes(self):
+        self.assertEqual(self._parse(self.htm, processes=2), self.expected)
+        self.assertEqual(self._parse(self.zip, processes=2), self.expected)
+
+    def test_manifest(self):
+        manifest = os.path.join(self.directory, "messages.manifest")
+        self.assertEqual(self._parse(self.htm, manifest=manifest), self.expected)
+        self.assertTrue(os.path.isfile(manifest))
+        self.assertEqual(self._parse(self.htm, manifest=manifest), self.expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import sys
+import os
+import gc
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import matplotlib
+matplotlib.use("Agg")
+import fb_analysis
+import fb_chat
+import fb_parser
+import fb_snapshot
+from test_chat import _sample_chat, _thread
+
+
+def _live_messages():
+    """Return the number of Message objects in memory."""
+    gc.collect()
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, fb_chat.Message))
+
+
+class TestShardedSnapshot(unittest.TestCase):
+    """Check a sharded snapshot keeps at most 'max_loaded_threads' Threads of messages in memory."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        threads = [_thread(["Person {}".format(i)], [("Person {}".format(i), (2014, 1, day), "hello number {}".format(day))
+                                                    for day in range(1, 11)])
+                   for i in range(8)]
+        fb_snapshot.write_sharded_snapshot(fb_chat.Chat("My Name", threads), self.directory)
+        del threads
+        fb_analysis.clear_results_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        fb_analysis.clear_results_cache()
+
+    def test_loaded_threads(self):
+        chat = fb_snapshot.read_sharded_snapshot(self.directory, max_loaded_threads=2)
+        before = _live_messages()
+        for thread in chat.threads:
+            thread.by(thread.people_str)
+            thread.sent_between((2014, 1, 3), (2014, 1, 5))
+        chat.all_from("Person 1")
+        fb_analysis.top_n_people(chat, count_type="words")
+        fb_analysis.top_word_use(chat, "Person 2")
+        self.assertEqual(len(chat.threads[0]._shards.loaded), 2)
+        self.assertLessEqual(_live_messages() - before, 2 * 10)
+
+    def test_date_queries_read_matching_threads(self):
+        shutil.rmtree(self.directory)
+        self.directory = tempfile.mkdtemp()
+        # Thread i has its messages in month i + 1:
+        whole = fb_chat.Chat("My Name", [_thread(["Person {}".format(i)],
+                                                 [("Person {}".format(i), (2014, i + 1, day), "hello number {}".format(day))
+                                                  for day in range(1, 11)])
+                                         for i in range(8)])
+        fb_snapshot.write_sharded_snapshot(whole, self.directory)
+        chat = fb_snapshot.read_sharded_snapshot(self.directory, max_loaded_threads=2)
+        loaded = chat.threads[0]._shards.loaded
+        self.assertEqual(chat.sent_between((2014, 3, 1), (2014, 3, 31)), whole.sent_between((2014, 3, 1), (2014, 3, 31)))
+        self.assertEqual(chat.sent_between((2014, 3, 5)), whole.sent_between((2014, 3, 5)))
+        self.assertEqual(loaded.misses, 1)
+        self.assertEqual(chat.sent_after((2014, 8, 5)), whole.sent_after((2014, 8, 5)))
+        self.assertEqual(loaded.misses, 2)
+        view = chat.on((2014, 4, 5))
+        self.assertEqual(loaded.misses, 3)
+        self.assertEqual(len(view.threads), 4)
+        self.assertEqual(view.all_messages(), whole.on((2014, 4, 5)).all_messages())
+        self.assertEqual(view.search_words(["number"]), whole.on((2014, 4, 5)).search_words(["number"]))
+        reads = loaded.hits + loaded.misses
+        self.assertEqual(chat.search("number 3"), whole.search("number 3"))
+        self.assertEqual(loaded.hits + loaded.misses - reads, 8)
+
+
+class TestSearchIndexFile(unittest.TestCase):
+    """Check the search index saved with a snapshot is only used with that snapshot."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "chat.snapshot")
+        fb_snapshot.write_snapshot(_sample_chat(), self.filename)
+        fb_parser.FBMessageParse(self.filename).dump_to_snapshot(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_same_snapshot(self):
+        self.assertIsNotNone(fb_parser.FBMessageParse(self.filename).Chat._search_index)
+
+    def test_replaced_snapshot(self):
+        chat = _sample_chat()
+        chat.threads[0].messages[0].text = "goodbye there"
+        fb_snapshot.write_snapshot(chat, self.filename)
+        chat = fb_parser.FBMessageParse(self.filename).Chat
+        self.assertIsNone(chat._search_index)
+        self.assertEqual([m.text for m in chat.search("goodbye")], ["goodbye there"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import matplotlib
+matplotlib.use("Agg")
+import fb_analysis
+import fb_sqlite
+from test_chat import _sample_chat
+from test_snapshot import _live_messages
+
+
+class TestDatabaseChat(unittest.TestCase):
+    """Check a DatabaseChat gives the same results as the Chat written to it, without keeping its messages."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "chat.sqlite")
+        self.chat = _sample_chat()
+        fb_sqlite.write_database(self.chat, self.filename)
+        fb_analysis.clear_results_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        fb_analysis.clear_results_cache()
+
+    def test_text_stats(self):
+        database_chat = fb_sqlite.DatabaseChat(self.filename)
+        for count_type in ["words", "charsfrom"]:
+            self.assertEqual(fb_analysis.top_n_people(database_chat, count_type=count_type),
+                             fb_analysis.top_n_people(self.chat, count_type=count_type))
+
+    def test_messages_not_kept(self):
+        database_chat = fb_sqlite.DatabaseChat(self.filename)
+        before = _live_messages()
+        fb_analysis.top_n_people(database_chat, count_type="words")
+        self.assertEqual(_live_messages(), before)
+
+    def test_search_words(self):
+        database_chat = fb_sqlite.DatabaseChat(self.filename)
+        for words in [["hello"], ["Hello", "there"], ["hell"], ["hi"], []]:
+            self.assertEqual([m.text for m in database_chat.search_words(words)],
+                             [m.text for m in self.chat.search_words(words)])
+        for phrase in ["hello there", "there hello", "hi alice", ""]:
+            self.assertEqual([m.text for m in database_chat.search_phrase(phrase)],
+                             [m.text for m in self.chat.search_phrase(phrase)])
+        self.assertIsNone(database_chat._timeline)
+        self.assertIsNone(database_chat._search_index)
+
+
+if __name__ == "__main__":
+    unittest.main()